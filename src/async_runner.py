@@ -0,0 +1,242 @@
+import time
+import random
+import asyncio
+import logging
+from utils.resilient_client import is_rate_limit_error, is_retryable_error, get_retry_after, call_retry_policy
+from utils.token_counter import record_retry
+
+
+class TokenBucket:
+    """
+    A token bucket holding up to capacity units, refilled with capacity units per minute.
+    """
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.rate = capacity / 60
+        self.level = capacity
+        self.updated = time.monotonic()
+
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    def get_wait_time(self, amount: float) -> float:
+        """
+        Return the seconds until amount units are available, amounts above the capacity wait for a full bucket.
+        """
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) / self.rate
+
+
+    def consume(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Schedules calls against requests-per-minute and tokens-per-minute budgets.
+
+    A budget left as None is not limited.
+    """
+
+    def __init__(self, requests_per_minute: int = None, tokens_per_minute: int = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.lock = asyncio.Lock()
+        self.waited = 0
+
+
+    async def acquire(self, requests: int = 1, tokens: int = 0) -> None:
+        """
+        Wait until both budgets allow the call, then take its requests and tokens from them.
+        """
+        # Calls are admitted one at a time, so a large call is not starved by smaller ones
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                wait = 0
+                for bucket, amount in ((self.requests, requests), (self.tokens, tokens)):
+                    if bucket is not None:
+                        bucket.refill(now)
+                        wait = max(wait, bucket.get_wait_time(amount))
+
+                if wait <= 0:
+                    break
+                self.waited += wait
+                await asyncio.sleep(wait)
+
+            for bucket, amount in ((self.requests, requests), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.consume(amount)
+
+
+class AdaptiveConcurrency:
+    """
+    A concurrency limit that adapts to rate limiting with additive increase, multiplicative decrease.
+
+    Every rate-limited call halves the limit, down to 1. Every successful call
+    raises it by 1 / limit, so a full window of successes raises it by one,
+    up to max_concurrency.
+    """
+
+    def __init__(self, max_concurrency: int):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+
+    async def acquire(self) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+
+    async def release(self) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+
+    def on_success(self) -> None:
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+
+    def on_rate_limit(self) -> None:
+        self.limit = max(1.0, self.limit / 2)
+
+
+class AsyncRunner:
+    """
+    Runs an async call for every item with several calls in flight, and hands
+    the results on in item order.
+
+    At most max_concurrency calls are in flight, fewer after rate limiting (see
+    AdaptiveConcurrency). Before each call the requests-per-minute and
+    tokens-per-minute budgets are checked with the estimate of the item.
+    Retries are per LLM call, not per item: a call made with
+    utils.resilient_client.acall_with_retries, as CachedChain.arun does, that
+    fails with a 429 or another retryable error is retried on its own with
+    exponential backoff and jitter, respecting Retry-After, up to max_retries
+    times. The calls the item made before it are not repeated. An error
+    raised by the item itself fails the run. on_result is called for each
+    item in order as soon as the results of all earlier items are available,
+    so logging and evaluation see the same order whatever the concurrency.
+    """
+
+    def __init__(self, max_concurrency: int = 1, requests_per_minute: int = None, tokens_per_minute: int = None,
+                 max_retries: int = 6, initial_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.rate_limited = 0
+        self.retries = 0
+        self.concurrency = None
+        self.rate_limiter = None
+
+
+    @classmethod
+    def from_config(cls, config) -> "AsyncRunner":
+        """
+        Create the runner from the concurrency, requests_per_minute and tokens_per_minute settings of a config.
+        """
+        return cls(
+            max_concurrency=config.get('concurrency') or 1,
+            requests_per_minute=config.get('requests_per_minute'),
+            tokens_per_minute=config.get('tokens_per_minute')
+        )
+
+
+    def run(self, items: list, call, on_result, estimate=None) -> None:
+        """
+        Run call for every item and pass the results to on_result in item order.
+
+        Parameters:
+            items (list): The items, for example question indices.
+            call (callable): Coroutine function taking an item and returning its result.
+            on_result (callable): Called with the position, the item and its result. It runs on the
+                event loop, so blocking work such as executing queries belongs in call, on a thread.
+            estimate (callable): Returns the (requests, tokens) an item uses, (1, 0) by default.
+        """
+        asyncio.run(self.arun(items, call, on_result, estimate))
+
+
+    async def arun(self, items: list, call, on_result, estimate=None) -> None:
+        self.concurrency = AdaptiveConcurrency(self.max_concurrency)
+        self.rate_limiter = RateLimiter(self.requests_per_minute, self.tokens_per_minute)
+
+        tasks = [asyncio.ensure_future(self.run_item(item, call, estimate)) for item in items]
+        try:
+            for position, (item, task) in enumerate(zip(items, tasks)):
+                on_result(position, item, await task)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+    async def run_item(self, item, call, estimate=None):
+        await self.concurrency.acquire()
+        try:
+            # Estimated once a slot is free, so the inputs of waiting items are not prepared up front
+            requests, tokens = estimate(item) if estimate is not None else (1, 0)
+            await self.rate_limiter.acquire(requests, tokens)
+            # Set in the context of this item's task only, and inherited by the tasks it starts
+            call_retry_policy.set(self.retry_call)
+            result = await call(item)
+        finally:
+            await self.concurrency.release()
+
+        self.concurrency.on_success()
+        return result
+
+
+    async def retry_call(self, function, tokens: int = 0):
+        """
+        Await function(), retrying it alone when it fails with a retryable error.
+
+        The first attempt is covered by the estimate of the item, every retry
+        takes one request and the tokens of the call from the rate limits.
+        Each failed attempt is counted in the enclosing get_token_estimate.
+        """
+        backoff = self.initial_backoff
+
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await self.rate_limiter.acquire(1, tokens)
+            try:
+                return await function()
+            except Exception as err:
+                if not is_retryable_error(err) or attempt == self.max_retries:
+                    raise
+                retry_after = get_retry_after(err)
+                if is_rate_limit_error(err):
+                    self.rate_limited += 1
+                    self.concurrency.on_rate_limit()
+                logging.warning(f"AsyncRunner retrying call after {type(err).__name__}, concurrency limit "
+                                f"{self.concurrency.limit:.1f}: " + str(err))
+
+            self.retries += 1
+            record_retry()
+            await asyncio.sleep(max(backoff * (1 + random.random()), retry_after or 0))
+            backoff = min(backoff * 2, self.max_backoff)
+
+
+    def get_stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "concurrency_limit": self.concurrency.limit if self.concurrency is not None else self.max_concurrency,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "rate_limit_wait": self.rate_limiter.waited if self.rate_limiter is not None else 0
+        }
@@ -2,9 +2,32 @@
 import sqlite3
 import os
 import logging
+import threading
 from utils.timer import Timer
+from utils.connection_pool import ConnectionPool
+from utils.gold_cache import GoldResultCache
+from utils.schema_catalog import SchemaCatalog, SchemaCatalogCache
+from utils.token_budget import BudgetedSchema, fit_schema
+from utils.schema_pruning import PrunedSchema, prune_schema
+from utils.bird_descriptions import DatabaseDescription, DescriptionCache
+from utils.data_point import DataPoint
+from utils.sql_tables import get_table_aliases
+from utils.admission import (
+   ADMIT, REJECT, CAP, SLOW_LANE, ADMISSION_POLICIES, REJECTED,
+   explain_query_plan, estimate_plan_cost, cap_query
+)
+from utils.query_timeout import QueryTimeout, QueryTimeoutError, SUCCESS, ERROR, TIMEOUT
+from utils.result_comparison import (
+   ResultFingerprint, EXACT, PUSHDOWN, COMPARISON_MODES,
+   fingerprint_query, count_query_rows
+)
+from evaluation import EvaluationResult
+from scheduling import (
+   FILE_ORDER, DATABASE_ORDER, LONGEST_FIRST_ORDER, QUESTION_ORDERS,
+   schedule_by_database, schedule_longest_first, load_latency_history
+)
 from config import load_config
-from utils.utils import load_json
+from utils.utils import load_json, iter_json_array, parse_name_list
 from collections import Counter
 
 class Dataset:
@@ -16,6 +39,12 @@ class Dataset:
    DATA_PATH = None
    CONFIG_PATH = os.path.abspath(
       os.path.join(os.path.dirname( __file__ ), '..', 'config/dataset_config.yaml'))
+   GOLD_CACHE_PATH = os.path.abspath(
+      os.path.join(os.path.dirname( __file__ ), '..', 'cache/gold_results'))
+   SCHEMA_CATALOG_PATH = os.path.abspath(
+      os.path.join(os.path.dirname( __file__ ), '..', 'cache/schema_catalog'))
+   ROOT_PATH = os.path.abspath(
+      os.path.join(os.path.dirname( __file__ ), '..'))
 
    def __init__(self):
       self.conn = None
@@ -25,13 +54,40 @@ class Dataset:
       self.total_gold_execution_time = 0
       self.last_predicted_execution_time = 0
       self.last_gold_execution_time = 0
+      self.last_predicted_outcome = ""
+      self.last_gold_outcome = ""
+      self.predicted_outcomes = Counter()
+      self.gold_outcomes = Counter()
+      self.predicted_sql_timeout = None
+      self.gold_sql_timeout = None
+      self.result_comparison = EXACT
+      self.result_batch_size = 1000
+      self.max_result_rows = None
+      self.admission_control = "off"
+      self.admission_max_cost = 10 ** 9
+      self.admission_cap_rows = 10000
+      self.slow_lane_timeout = None
+      self.slow_lane = threading.BoundedSemaphore(1)
+      self.admission_counts = Counter()
+      self.schema_catalog_lock = threading.Lock()
 
       self.current_db = ""
-      self.current_database_schema = ""
+      self.db_index = {}
+      self.difficulty_index = {}
       self.config = None
+      self.connection_pool = None
+      self.gold_result_cache = None
+      self.schema_catalog_cache = None
 
       self.load_config()
+      self.load_query_timeouts()
+      self.load_admission_control()
+      self.load_result_comparison()
+      self.load_connection_pool()
+      self.load_gold_result_cache()
+      self.load_schema_catalog_cache()
       self.load_data()
+      self.build_indexes()
       
 
    def load_data(self):
@@ -46,12 +102,241 @@ class Dataset:
 
       data = load_json(self.DATA_PATH)      
 
-      self.data = data
+      self.data = [DataPoint.from_bird(data_point) for data_point in data]
+
+
+   def build_indexes(self) -> None:
+      """
+      Index the loaded questions by database and by difficulty.
+      """
+      self.db_index = {}
+      self.difficulty_index = {}
+
+      for index, data_point in enumerate(self.data):
+         self.db_index.setdefault(data_point['db_id'], []).append(index)
+         self.difficulty_index.setdefault(data_point.get('difficulty', ""), []).append(index)
+
+
+   def get_indices(self, db_id: str = None, difficulty: str = None) -> list:
+      """
+      Return the indices of the questions on a database and/or of a difficulty, using the indexes.
+
+      Parameters:
+         db_id (str): Only include questions on this database, None for all databases.
+         difficulty (str): Only include questions of this difficulty, None for all difficulties.
+
+      Returns:
+         list: The matching question indices in increasing order.
+      """
+      if db_id is None and difficulty is None:
+         return list(range(len(self.data)))
+
+      if db_id is None:
+         return list(self.difficulty_index.get(difficulty, []))
+
+      indices = self.db_index.get(db_id, [])
+      if difficulty is None:
+         return list(indices)
+
+      difficulty_indices = set(self.difficulty_index.get(difficulty, []))
+      return [index for index in indices if index in difficulty_indices]
+
+
+   def iter_data_points(self, db_id: str = None, difficulty: str = None):
+      """
+      Iterate over the questions on a database and/or of a difficulty.
+
+      Parameters:
+         db_id (str): Only include questions on this database, None for all databases.
+         difficulty (str): Only include questions of this difficulty, None for all difficulties.
+
+      Yields:
+         tuple: The index and the data point of each matching question.
+      """
+      for index in self.get_indices(db_id, difficulty):
+         yield index, self.get_data_point(index)
+
+
+   def get_schedule(self, order: str = None) -> list:
+      """
+      Return the order in which to process the questions, as a list of question indices.
+
+      The indices are the original question indices, so results can still be
+      reported against the file order.
+
+      Parameters:
+         order (str): "file", "database" or "longest_first", defaults to question_order in the config.
+
+      Returns:
+         list: The question indices in the scheduled order.
+      """
+      if order is None:
+         order = (self.config.get('question_order') if self.config is not None else None) or FILE_ORDER
+
+      if order not in QUESTION_ORDERS:
+         raise ValueError(f"question_order must be one of {', '.join(QUESTION_ORDERS)}")
+
+      if order == DATABASE_ORDER:
+         return schedule_by_database(self.data)
+
+      if order == LONGEST_FIRST_ORDER:
+         latency_history = load_latency_history(self.get_latency_history_path())
+         return schedule_longest_first(self.data, latency_history)
+
+      return list(range(len(self.data)))
+
+
+   def get_latency_history_path(self) -> str:
+      """
+      Return the path of the file with the recorded per-question latencies.
+      """
+      path = 'results/latency_history.json'
+      if self.config is not None and self.config.get('latency_history_path'):
+         path = self.config.latency_history_path
+      return os.path.join(self.ROOT_PATH, path)
+
+   def get_stage_metrics_path(self) -> str:
+      """
+      Return the path of the file with the per-stage latency, token and cost metrics of multi-call agents.
+      """
+      path = 'results/stage_metrics.json'
+      if self.config is not None and self.config.get('stage_metrics_path'):
+         path = self.config.stage_metrics_path
+      return os.path.join(self.ROOT_PATH, path)
+
+
+   def get_stage_checkpoint_path(self) -> str:
+      """
+      Return the path of the append-only store of checkpointed agent stage outputs.
+      """
+      path = 'results/stage_checkpoints.jsonl'
+      if self.config is not None and self.config.get('stage_checkpoint_path'):
+         path = self.config.stage_checkpoint_path
+      return os.path.join(self.ROOT_PATH, path)
+
+   def report_question_index(self) -> bool:
+      """
+      Whether the run scripts should log the original index of each question.
+      """
+      return self.config is not None and bool(self.config.get('report_question_index'))
 
 
    def load_config(self):      
       self.config = load_config(self.CONFIG_PATH)
 
+
+   def load_query_timeouts(self) -> None:
+      """
+      Read the predicted and gold SQL execution budgets from the config.
+      """
+      if self.config is None:
+         return
+
+      self.predicted_sql_timeout = self.config.get('predicted_sql_timeout')
+      self.gold_sql_timeout = self.config.get('gold_sql_timeout')
+
+
+   def load_admission_control(self) -> None:
+      """
+      Read the admission gate settings for predicted SQL from the config.
+      """
+      if self.config is None:
+         return
+
+      self.admission_control = self.config.get('admission_control') or "off"
+      if self.admission_control not in ADMISSION_POLICIES:
+         raise ValueError(f"admission_control must be one of {', '.join(ADMISSION_POLICIES)}")
+
+      if self.config.get('admission_max_cost') is not None:
+         self.admission_max_cost = self.config.admission_max_cost
+      if self.config.get('admission_cap_rows') is not None:
+         self.admission_cap_rows = self.config.admission_cap_rows
+
+      self.slow_lane_timeout = self.config.get('slow_lane_timeout')
+      self.slow_lane = threading.BoundedSemaphore(self.config.get('slow_lane_workers') or 1)
+
+
+   def load_result_comparison(self) -> None:
+      """
+      Read how predicted and gold results are compared from the config.
+      """
+      if self.config is None:
+         return
+
+      self.result_comparison = self.config.get('result_comparison') or EXACT
+      if self.result_comparison not in COMPARISON_MODES:
+         raise ValueError(f"result_comparison must be one of {', '.join(COMPARISON_MODES)}")
+
+      self.result_batch_size = self.config.get('result_batch_size') or self.result_batch_size
+      self.max_result_rows = self.config.get('max_result_rows')
+
+
+   def load_connection_pool(self) -> None:
+      """
+      Create the pool of database connections shared by all query methods.
+      """
+      max_open_databases = 8
+      if self.config is not None and self.config.get('max_open_databases') is not None:
+         max_open_databases = self.config.max_open_databases
+
+      settings = {}
+      if self.config is not None:
+         for key in ('connection_profile', 'mmap_size', 'cache_size', 'hot_memory_budget', 'hot_min_requests'):
+            if self.config.get(key) is not None:
+               settings[key] = self.config[key]
+
+      if 'connection_profile' in settings:
+         settings['profile'] = settings.pop('connection_profile')
+
+      self.connection_pool = ConnectionPool(max_open_databases, **settings)
+
+
+   def load_gold_result_cache(self) -> None:
+      """
+      Create the on-disk gold result cache if it is enabled in the config.
+      """
+      if self.config is None or not self.config.get('gold_result_cache'):
+         return
+
+      cache_path = self.config.get('gold_result_cache_path') or self.GOLD_CACHE_PATH
+      self.gold_result_cache = GoldResultCache(cache_path)
+
+
+   def load_schema_catalog_cache(self) -> None:
+      """
+      Create the cache of per-database schema catalogs.
+      """
+      max_bytes = 64 * 1024 * 1024
+      cache_dir = self.SCHEMA_CATALOG_PATH
+
+      if self.config is not None:
+         if self.config.get('schema_catalog_max_bytes') is not None:
+            max_bytes = self.config.schema_catalog_max_bytes
+         if self.config.get('schema_catalog_cache') is False:
+            cache_dir = None
+
+      self.schema_catalog_cache = SchemaCatalogCache(max_bytes, cache_dir)
+
+
+   def get_connection_pool_stats(self) -> dict:
+      """
+      Return the hit/miss counters of the connection pool.
+
+      Returns:
+         dict: The connection pool statistics.
+      """
+      return self.connection_pool.get_stats()
+
+
+   def close(self) -> None:
+      """
+      Close all open database connections.
+      """
+      self.connection_pool.close_all()
+      self.conn = None
+      self.cursor = None
+      self.current_db = ""
+
    
    def get_number_of_data_points(self):
       """
@@ -63,7 +348,7 @@ class Dataset:
       return len(self.data)
    
 
-   def get_data_point(self, index: int) -> dict:      
+   def get_data_point(self, index: int) -> DataPoint:      
       """
       Retrieve a data point based on the provided index.
 
@@ -71,7 +356,7 @@ class Dataset:
          index (int): The index of the desired data point.
 
       Returns:
-         dict: The retrieved data point.
+         DataPoint: The retrieved data point.
       """
          
       return self.data[index]
@@ -81,6 +366,10 @@ class Dataset:
       """
       Execute provided SQL queries and compare the results.
 
+      The outcome of each query ("success", "error" or "timeout") is stored in
+      last_predicted_outcome and last_gold_outcome and counted in
+      predicted_outcomes and gold_outcomes.
+
       Parameters:
          sql (str): The predicted SQL query to execute.
          gold_sql (str): The golden SQL query to compare results.
@@ -90,37 +379,126 @@ class Dataset:
          int: 1 if the results match, otherwise 0.
       """
 
-      if self.current_db != db_name:
-         self.load_db(db_name)
+      self.load_db(db_name)
+
+      result = self.evaluate_queries(self.conn, sql, gold_sql, db_name)
+      self.record_evaluation_result(result)
+      return result.success
+
+
+   def evaluate_queries(self, conn: sqlite3.Connection, sql: str, gold_sql: str, db_name: str) -> EvaluationResult:
+      """
+      Execute the predicted and gold queries on a connection and compare the results.
+
+      Unlike execute_queries_and_match_data this does not touch the execution time
+      and outcome counters, so it can be called from several threads, each with
+      its own connection. The predicted query first passes the admission gate,
+      see admit_query.
+
+      Parameters:
+         conn (sqlite3.Connection): An open connection to the database.
+         sql (str): The predicted SQL query to execute.
+         gold_sql (str): The golden SQL query to compare results.
+         db_name (str): The database name on which the queries will be executed.
+
+      Returns:
+         EvaluationResult: The match result, query outcomes and execution times.
+      """
+      action = self.admit_query(conn, sql, db_name)
+
+      if action == REJECT:
+         return EvaluationResult(0, REJECTED, "", 0, 0)
+
+      if action == CAP:
+         sql = cap_query(sql, self.admission_cap_rows)
+
+      if action == SLOW_LANE:
+         timeout = self.slow_lane_timeout if self.slow_lane_timeout is not None else self.predicted_sql_timeout
+         with self.slow_lane:
+            return self.compare_queries(conn, sql, gold_sql, db_name, timeout)
+
+      return self.compare_queries(conn, sql, gold_sql, db_name, self.predicted_sql_timeout)
+
+
+   def admit_query(self, conn: sqlite3.Connection, sql: str, db_name: str) -> str:
+      """
+      Decide how to execute a predicted query from the estimated cost of its query plan.
+
+      The query is compiled with EXPLAIN QUERY PLAN and the number of rows it
+      visits is estimated from the table row counts cached in the schema
+      catalog. Queries estimated to visit more than admission_max_cost rows get
+      the admission_control action of the config:
+         reject     the query is not executed and its outcome is "rejected"
+         cap        the query is wrapped to return at most admission_cap_rows rows
+         slow_lane  the query waits for one of slow_lane_workers lanes and runs
+                    with the slow_lane_timeout budget
+      All other queries, and queries that do not compile, are admitted.
+
+      Parameters:
+         conn (sqlite3.Connection): An open connection to the database.
+         sql (str): The predicted SQL query.
+         db_name (str): The database name on which the query will be executed.
+
+      Returns:
+         str: "admit", "reject", "cap" or "slow_lane".
+      """
+      if self.admission_control == "off":
+         return ADMIT
+
+      try:
+         plan = explain_query_plan(conn, sql)
+      except sqlite3.Error:
+         return ADMIT
+
+      with self.schema_catalog_lock:
+         catalog = self.schema_catalog_cache.get_catalog(db_name, self.get_db_path(db_name), lambda: conn)
+         row_counts = catalog.get_row_counts()
+         aliases = get_table_aliases(sql, catalog.get_table_names())
+
+      plan_cost = estimate_plan_cost(plan, row_counts, aliases)
+      action = ADMIT if plan_cost.cost <= self.admission_max_cost else self.admission_control
+
+      if action != ADMIT:
+         logging.warning(f"DataLoader.admit_query() {action}: estimated {plan_cost.cost} rows, "
+                         f"full scans of {', '.join(plan_cost.full_scans)}\nSQL Query:\n" + sql)
+
+      with self.schema_catalog_lock:
+         self.admission_counts[action] += 1
+      return action
+
+
+   def compare_queries(self, conn: sqlite3.Connection, sql: str, gold_sql: str, db_name: str, timeout: float) -> EvaluationResult:
+      """
+      Execute the predicted and gold queries and compare the results, with timeout as the predicted SQL budget.
+      """
+      if self.result_comparison != EXACT:
+         return self.evaluate_queries_streaming(conn, sql, gold_sql, db_name, timeout)
       
       try:
          with Timer() as t:
-            self.cursor.execute(sql)
-            pred_res = self.cursor.fetchall()
+            pred_res = self.fetch_all_with_timeout(sql, timeout, conn)
          
          if t.elapsed_time > 5:
             logging.info(f"Predicted query execution time: {t.elapsed_time:.2f} \nSQL Query:\n" + sql)
          else:
             logging.info(f"Predicted query execution time: {t.elapsed_time:.2f}")
 
-         self.last_predicted_execution_time = t.elapsed_time
-         self.total_predicted_execution_time += t.elapsed_time               
+      except QueryTimeoutError as err:
+         logging.warning("DataLoader.execute_queries_and_match_data() predicted " + str(err) + "\nSQL Query:\n" + sql)
+         return EvaluationResult(0, TIMEOUT, "", 0, 0)
 
       except sqlite3.Error as err:
          logging.error("DataLoader.execute_queries_and_match_data() " + str(err))
-         return 0
+         return EvaluationResult(0, ERROR, "", 0, 0)
 
-      with Timer() as t:
-         self.cursor.execute(gold_sql)
-         golden_res = self.cursor.fetchall()
+      predicted_execution_time = t.elapsed_time
 
-      if t.elapsed_time > 5:
-         logging.info(f"Golden query execution time: {t.elapsed_time:.2f} \nSQL Query:\n" + gold_sql)
-      else:
-         logging.info(f"Golden query execution time: {t.elapsed_time:.2f}")
-      
-      self.last_gold_execution_time = t.elapsed_time
-      self.total_gold_execution_time += t.elapsed_time      
+      try:
+         golden_res, gold_execution_time = self.execute_gold_query(conn, gold_sql, db_name)
+
+      except QueryTimeoutError as err:
+         logging.warning("DataLoader.execute_queries_and_match_data() gold " + str(err) + "\nSQL Query:\n" + gold_sql)
+         return EvaluationResult(0, SUCCESS, TIMEOUT, predicted_execution_time, 0)
 
       # logging.debug("Predicted data:")
       # logging.debug(set(pred_res))
@@ -128,34 +506,268 @@ class Dataset:
       # logging.debug(set(golden_res))
 
       equal = (Counter(pred_res) == Counter(golden_res))
-      return int(equal)
+      return EvaluationResult(int(equal), SUCCESS, SUCCESS, predicted_execution_time, gold_execution_time)
+
+
+   def evaluate_queries_streaming(self, conn: sqlite3.Connection, sql: str, gold_sql: str, db_name: str,
+                                  timeout: float = None) -> EvaluationResult:
+      """
+      Compare the predicted and gold results by row count and multiset fingerprint.
+
+      The gold fingerprint is computed first so that streaming of the predicted
+      result can stop as soon as it has more rows than the gold result or than
+      max_result_rows. In pushdown mode the predicted rows are first counted
+      inside SQLite and nothing is fetched when the counts differ. Memory use
+      is bounded by result_batch_size whatever the size of the results.
+
+      Parameters:
+         conn (sqlite3.Connection): An open connection to the database.
+         sql (str): The predicted SQL query to execute.
+         gold_sql (str): The golden SQL query to compare results.
+         db_name (str): The database name on which the queries will be executed.
+         timeout (float): The predicted SQL execution budget in seconds, None for no budget.
+
+      Returns:
+         EvaluationResult: The match result, query outcomes and execution times.
+      """
+      try:
+         gold_fingerprint, gold_execution_time = self.execute_gold_fingerprint(conn, gold_sql, db_name)
+
+      except QueryTimeoutError as err:
+         logging.warning("DataLoader.evaluate_queries_streaming() gold " + str(err) + "\nSQL Query:\n" + gold_sql)
+         return EvaluationResult(0, "", TIMEOUT, 0, 0)
+
+      row_limit = gold_fingerprint.row_count
+      if self.max_result_rows is not None:
+         row_limit = min(row_limit, self.max_result_rows)
+
+      try:
+         with Timer() as t:
+            with QueryTimeout(conn, timeout) as budget:
+               predicted_count = None
+               if self.result_comparison == PUSHDOWN:
+                  try:
+                     predicted_count = count_query_rows(conn, sql)
+                  except sqlite3.Error:
+                     if budget.timed_out:
+                        raise
+                     # Not every statement can be wrapped in a COUNT, stream it instead
+
+               if predicted_count is not None and predicted_count != gold_fingerprint.row_count:
+                  pred_fingerprint = ResultFingerprint(predicted_count, None, True)
+               else:
+                  pred_fingerprint = fingerprint_query(conn, sql, self.result_batch_size, row_limit)
+
+         logging.info(f"Predicted query execution time: {t.elapsed_time:.2f}")
+
+      except QueryTimeoutError as err:
+         logging.warning("DataLoader.evaluate_queries_streaming() predicted " + str(err) + "\nSQL Query:\n" + sql)
+         return EvaluationResult(0, TIMEOUT, SUCCESS, 0, gold_execution_time)
+
+      except sqlite3.Error as err:
+         logging.error("DataLoader.evaluate_queries_streaming() " + str(err))
+         return EvaluationResult(0, ERROR, SUCCESS, 0, gold_execution_time)
+
+      equal = (not pred_fingerprint.truncated
+               and not gold_fingerprint.truncated
+               and pred_fingerprint.row_count == gold_fingerprint.row_count
+               and pred_fingerprint.digest == gold_fingerprint.digest)
+
+      return EvaluationResult(int(equal), SUCCESS, SUCCESS, t.elapsed_time, gold_execution_time)
+
+
+   def execute_gold_fingerprint(self, conn: sqlite3.Connection, gold_sql: str, db_name: str) -> tuple:
+      """
+      Fingerprint the result of a gold query, going through the gold result cache when enabled.
+
+      Parameters:
+         conn (sqlite3.Connection): An open connection to the database.
+         gold_sql (str): The golden SQL query.
+         db_name (str): The database name on which the query will be executed.
+
+      Returns:
+         tuple: The ResultFingerprint and the execution time, which is 0 for cached results.
+
+      Raises:
+         QueryTimeoutError: If the query runs longer than the gold SQL budget.
+      """
+      if self.gold_result_cache is not None:
+         db_path = self.get_db_path(db_name)
+         cached = self.gold_result_cache.get(db_name, db_path, gold_sql, kind="fingerprint")
+         if cached is not None:
+            logging.info("Golden query fingerprint loaded from cache")
+            return ResultFingerprint(*cached), 0
+
+      with Timer() as t:
+         with QueryTimeout(conn, self.gold_sql_timeout):
+            gold_fingerprint = fingerprint_query(conn, gold_sql, self.result_batch_size)
+
+      logging.info(f"Golden query execution time: {t.elapsed_time:.2f}")
+
+      if self.gold_result_cache is not None:
+         self.gold_result_cache.put(db_name, db_path, gold_sql, tuple(gold_fingerprint), kind="fingerprint")
+
+      return gold_fingerprint, t.elapsed_time
+
+
+   def record_evaluation_result(self, result: EvaluationResult) -> None:
+      """
+      Update the execution time and outcome counters with the result of one evaluation.
+
+      Parameters:
+         result (EvaluationResult): The result returned by evaluate_queries.
+      """
+      self.last_predicted_outcome = result.predicted_outcome
+      if result.predicted_outcome:
+         self.predicted_outcomes[result.predicted_outcome] += 1
+
+      if result.predicted_outcome == SUCCESS:
+         self.last_predicted_execution_time = result.predicted_execution_time
+         self.total_predicted_execution_time += result.predicted_execution_time
+
+      self.last_gold_outcome = result.gold_outcome
+      if result.gold_outcome:
+         self.gold_outcomes[result.gold_outcome] += 1
+
+      if result.gold_outcome == SUCCESS:
+         self.last_gold_execution_time = result.gold_execution_time
+         self.total_gold_execution_time += result.gold_execution_time
    
 
-   def execute_query(self, sql: str, db_name: str) -> int:
+   def fetch_gold_result(self, gold_sql: str, db_name: str) -> list:
+      """
+      Return the result rows of a gold query, executing it only on a gold result cache miss.
+
+      Parameters:
+         gold_sql (str): The golden SQL query.
+         db_name (str): The database name on which the query will be executed.
+
+      Returns:
+         list: The result rows of the gold query.
+
+      Raises:
+         QueryTimeoutError: If the query runs longer than the gold SQL budget.
+      """
+      self.load_db(db_name)
+
+      golden_res, elapsed_time = self.execute_gold_query(self.conn, gold_sql, db_name)
+
+      self.last_gold_execution_time = elapsed_time
+      self.total_gold_execution_time += elapsed_time
+      return golden_res
+
+
+   def fetch_gold_fingerprint(self, gold_sql: str, db_name: str) -> ResultFingerprint:
+      """
+      Return the result fingerprint of a gold query, executing it only on a gold result cache miss.
+
+      Parameters:
+         gold_sql (str): The golden SQL query.
+         db_name (str): The database name on which the query will be executed.
+
+      Returns:
+         ResultFingerprint: The row count and multiset digest of the gold result.
+
+      Raises:
+         QueryTimeoutError: If the query runs longer than the gold SQL budget.
+      """
+      self.load_db(db_name)
+
+      gold_fingerprint, elapsed_time = self.execute_gold_fingerprint(self.conn, gold_sql, db_name)
+
+      self.last_gold_execution_time = elapsed_time
+      self.total_gold_execution_time += elapsed_time
+      return gold_fingerprint
+
+
+   def execute_gold_query(self, conn: sqlite3.Connection, gold_sql: str, db_name: str) -> tuple:
+      """
+      Execute a gold query on a connection, going through the gold result cache when enabled.
+
+      Parameters:
+         conn (sqlite3.Connection): An open connection to the database.
+         gold_sql (str): The golden SQL query.
+         db_name (str): The database name on which the query will be executed.
+
+      Returns:
+         tuple: The result rows and the execution time, which is 0 for cached results.
+
+      Raises:
+         QueryTimeoutError: If the query runs longer than the gold SQL budget.
+      """
+      if self.gold_result_cache is not None:
+         db_path = self.get_db_path(db_name)
+         golden_res = self.gold_result_cache.get(db_name, db_path, gold_sql)
+         if golden_res is not None:
+            logging.info("Golden query result loaded from cache")
+            return golden_res, 0
+
+      with Timer() as t:
+         golden_res = self.fetch_all_with_timeout(gold_sql, self.gold_sql_timeout, conn)
+
+      if t.elapsed_time > 5:
+         logging.info(f"Golden query execution time: {t.elapsed_time:.2f} \nSQL Query:\n" + gold_sql)
+      else:
+         logging.info(f"Golden query execution time: {t.elapsed_time:.2f}")
+
+      if self.gold_result_cache is not None:
+         self.gold_result_cache.put(db_name, db_path, gold_sql, golden_res)
+
+      return golden_res, t.elapsed_time
+
+
+   def fetch_all_with_timeout(self, sql: str, timeout: float = None, conn: sqlite3.Connection = None) -> list:
+      """
+      Execute a SQL query and fetch all rows within a time budget.
+
+      Parameters:
+         sql (str): The SQL query to execute.
+         timeout (float): The execution budget in seconds, None for no budget.
+         conn (sqlite3.Connection): The connection to use, defaults to the current database.
+
+      Returns:
+         list: The result rows.
+
+      Raises:
+         QueryTimeoutError: If the query runs longer than the budget.
+      """
+      if conn is None:
+         conn = self.conn
+
+      with QueryTimeout(conn, timeout):
+         cursor = conn.cursor()
+         cursor.execute(sql)
+         return cursor.fetchall()
+
+
+   def execute_query(self, sql: str, db_name: str, timeout: float = None) -> int:
       """
       Execute a SQL query on a specified database and log execution time.
 
       Parameters:
          sql (str): The SQL query to execute.
          db_name (str): The database name on which the query will be executed.
+         timeout (float): The execution budget in seconds, None for no budget.
 
       Returns:
          int: 1 if the query executes successfully, otherwise 0.
       """
       
-      if self.current_db != db_name:
-         self.load_db(db_name)
+      self.load_db(db_name)
       
       try:
          with Timer() as t:
-            self.cursor.execute(sql)
-            pred_res = self.cursor.fetchall()
+            self.fetch_all_with_timeout(sql, timeout)
          
          if t.elapsed_time > 5:
-            logging.info(f"Query execution time: {t.elapsed_time:.2f} \nSQL Query:\n" + pred_res)
+            logging.info(f"Query execution time: {t.elapsed_time:.2f} \nSQL Query:\n" + sql)
          else:
             logging.info(f"Query query execution time: {t.elapsed_time:.2f}")
 
+      except QueryTimeoutError as err:
+         logging.warning("DataLoader.execute_query() " + str(err) + "\nSQL Query:\n" + sql)
+         return 0
+
       except sqlite3.Error as err:
          logging.error("DataLoader.execute_query() " + str(err))
          return 0
@@ -163,6 +775,22 @@ class Dataset:
       return 1
 
 
+   def get_schema_catalog(self, db_name: str) -> SchemaCatalog:
+      """
+      Return the schema catalog of a database.
+
+      Parameters:
+         db_name (str): The name of the database.
+
+      Returns:
+         SchemaCatalog: The lazily introspected schema of the database.
+      """
+      db_path = self.get_db_path(db_name)
+      connect = lambda: self.connection_pool.get_connection(db_name, db_path)
+      with self.schema_catalog_lock:
+         return self.schema_catalog_cache.get_catalog(db_name, db_path, connect)
+
+
    def list_tables_and_columns(self, db_name: str) -> str:
       """
       List tables and columns of a specified database, logging the info.
@@ -173,24 +801,7 @@ class Dataset:
       Returns:
          str: The formatted string of tables and columns information.
       """
-   
-      if self.current_db != db_name:
-         self.load_db(db_name)
-
-      self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-      tables = self.cursor.fetchall()
-
-      res = ""
-      for table in tables:
-         table_name = table[0]
-         res = res + f"Table: {table_name}\n"
-         
-         self.cursor.execute(f"PRAGMA table_info(\"{table_name}\");")
-         columns = self.cursor.fetchall()
-         for column in columns:
-            col_name = column[1]
-            col_type = column[2]
-            res = res + f"  Column: {col_name}, Type: {col_type}\n"         
+      res = self.get_schema_catalog(db_name).get_tables_and_columns()
 
       logging.info(res)
       return res              
@@ -198,7 +809,7 @@ class Dataset:
 
    def get_create_statements(self, db_name: str) -> str:
       """
-      Retrieve and store SQL CREATE statements for all tables in a database.
+      Retrieve SQL CREATE statements for all tables in a database.
 
       Parameters:
          db_name (str): The name of the database to get CREATE statements.
@@ -206,20 +817,12 @@ class Dataset:
       Returns:
          str: The SQL CREATE statements for all tables in the database.
       """
-      if self.current_db != db_name:
-         self.load_db(db_name)
-
-         self.cursor.execute("SELECT sql FROM sqlite_master WHERE type='table';")
-         create_statements = self.cursor.fetchall()
-
-         self.current_database_schema = '\n'.join([statement[0] for statement in create_statements])
-      
-      return self.current_database_schema
+      return self.get_schema_catalog(db_name).get_create_statements()
    
 
    def get_schema_and_sample_data(self, db_name: str) -> str:
       """
-      Retrieve, store, and return the schema and sample data from a database.
+      Retrieve and return the schema and sample data from a database.
 
       Parameters:
          db_name (str): The name of the database to get schema and data.
@@ -227,61 +830,91 @@ class Dataset:
       Returns:
          str: A formatted string containing schema and sample data.
       """
-       
-      if self.current_db != db_name:
-         self.load_db(db_name)      
-      
-         self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-         tables = self.cursor.fetchall()
-         
-         schema_and_sample_data = ""
-
-         for table in tables:
-            table = table[0]  
-            self.cursor.execute(f"SELECT sql FROM sqlite_master WHERE type='table' AND name='{table}';")
-            create_statement = self.cursor.fetchone()[0]
-            
-            schema_and_sample_data += f"{create_statement};\n\n"
-            
-            self.cursor.execute(f"SELECT * FROM \"{table}\" LIMIT 3;")
-            rows = self.cursor.fetchall()
-                     
-            self.cursor.execute(f"PRAGMA table_info(\"{table}\");")
-            columns = self.cursor.fetchall()
-            column_names = [column[1] for column in columns]
-            column_names_line = "\t".join(column_names)
-            
-            schema_and_sample_data += f"Three rows from {table} table:\n"
-            schema_and_sample_data += f"{column_names_line}\n"
-
-            for row in rows:
-                  row_line = "\t".join([str(value) for value in row])
-                  schema_and_sample_data += f"{row_line}\n"
-
-            schema_and_sample_data += "\n"
-
-         schema_and_sample_data += "\n"
-
-         self.current_database_schema = schema_and_sample_data
-    
-      return self.current_database_schema
+      return self.get_schema_catalog(db_name).get_schema_and_sample_data()
+
+
+   def get_budgeted_schema(self, db_name: str, budget: int, model: str, question: str = "",
+                           evidence: str = "", include_descriptions: bool = False) -> BudgetedSchema:
+      """
+      Return the schema and sample data of a database reduced to fit a token budget.
+
+      See utils.token_budget.fit_schema for the order in which sample rows,
+      descriptions and tables are dropped.
+
+      Parameters:
+         db_name (str): The database name.
+         budget (int): The tokens the schema and descriptions may use.
+         model (str): The model whose tokenizer counts the tokens.
+         question (str): The question, to keep the tables most relevant to it.
+         evidence (str): The hint of the question.
+         include_descriptions (bool): Whether to include the BIRD table descriptions.
+
+      Returns:
+         BudgetedSchema: The schema, descriptions, token count and degradation steps.
+      """
+      descriptions = self.get_bird_descriptions(db_name) if include_descriptions else None
+      return fit_schema(self.get_schema_catalog(db_name), budget, model, question, evidence, descriptions)
+
+
+   def get_pruned_schema(self, db_name: str, schema_links: list, include_descriptions: bool = False) -> PrunedSchema:
+      """
+      Return the schema and sample data of only the tables named by schema links and the tables joining them.
+
+      See utils.schema_pruning.prune_schema.
+
+      Parameters:
+         db_name (str): The database name.
+         schema_links (list): The schema links of the question.
+         include_descriptions (bool): Whether to include the BIRD table descriptions.
+
+      Returns:
+         PrunedSchema: The schema, descriptions and kept tables, None if no link names a table.
+      """
+      descriptions = self.get_bird_descriptions(db_name) if include_descriptions else None
+      return prune_schema(self.get_schema_catalog(db_name), schema_links, descriptions)
 
 
    def load_db(self, db_name: str) -> None:
       """
-      Load a database into the class by connecting and setting a cursor.
+      Load a database into the class by fetching a pooled connection and setting a cursor.
+
+      Called before every use of the connection, as the pool may have evicted
+      it or replaced it with an in-memory copy since the last use.
 
       Parameters:
          db_name (str): The name of the database to load.
       """
       db_path = self.get_db_path(db_name)
       logging.debug("DB_path: " + db_path)
-      self.conn = sqlite3.connect(db_path)      
+      self.conn = self.connection_pool.get_connection(db_name, db_path)
       self.cursor = self.conn.cursor()
       self.current_db = db_name
 
 
    def get_db_path(self, db_name: str) -> str:
+      """
+      Return the path of the database file to execute queries on.
+
+      If optimized_database_path is set in the config and contains an optimized
+      copy of the database (see optimize_databases.py), the copy is used,
+      otherwise the original database file.
+
+      Parameters:
+         db_name (str): The name of the database to find the path.
+
+      Returns:
+         str: The path to the database file.
+      """
+      if self.config is not None and self.config.get('optimized_database_path'):
+         optimized_path = os.path.join(
+            self.ROOT_PATH, self.config.optimized_database_path, db_name, db_name + ".sqlite")
+         if os.path.exists(optimized_path):
+            return optimized_path
+
+      return self.get_source_db_path(db_name)
+
+
+   def get_source_db_path(self, db_name: str) -> str:
       """
       Construct and return the path to a specified database file.
 
@@ -330,10 +963,14 @@ class BIRDDataset(Dataset):
    DEV_DATA_PATH = os.path.abspath(
     os.path.join(os.path.dirname( __file__ ), '..', 'data/BIRD/dev/dev.json'))
    
+   DESCRIPTION_CACHE_PATH = os.path.abspath(
+      os.path.join(os.path.dirname( __file__ ), '..', 'cache/bird_descriptions'))
+   
    def __init__(self):
       super().__init__()
 
       self.load_database_names()
+      self.load_description_cache()
 
 
    def load_data(self) -> None:
@@ -347,24 +984,24 @@ class BIRDDataset(Dataset):
       train_data = []
       dev_data = []
       
-      if self.config is not None:         
-         # if self.config.bird_train_domains is not None:
-            # train_data = load_json(self.TRAIN_DATA_PATH)
-            # train_data = [
-            #    data_point for data_point in train_data 
-            #    if data_point['db_id'] in self.config.bird_train_domains
-            # ]
-
-         if self.config.bird_dev_domains is not None:
-            dev_data = load_json(self.DEV_DATA_PATH)
-            dev_data = [
-               data_point for data_point in dev_data 
-               if data_point['db_id'] in self.config.bird_dev_domains
+      if self.config is not None:
+         # Questions are filtered while the file is parsed, so only the selected
+         # questions are ever held in memory
+         difficulties = parse_name_list(self.config.bird_difficulties)
+         train_domains = parse_name_list(self.config.bird_train_domains)
+         dev_domains = parse_name_list(self.config.bird_dev_domains)
+
+         if train_domains is not None and self.config.get('bird_load_train_split'):
+            train_data = [
+               DataPoint.from_bird(data_point) for data_point in iter_json_array(self.TRAIN_DATA_PATH)
+               if data_point['db_id'] in train_domains
             ]
-               
+
+         if dev_domains is not None:
             dev_data = [
-               data_point for data_point in dev_data 
-               if data_point['difficulty'] in self.config.bird_difficulties
+               DataPoint.from_bird(data_point) for data_point in iter_json_array(self.DEV_DATA_PATH) 
+               if data_point['db_id'] in dev_domains
+               and (difficulties is None or data_point.get('difficulty') in difficulties)
             ]
 
       self.data = dev_data + train_data
@@ -374,33 +1011,53 @@ class BIRDDataset(Dataset):
       self.dev_databases = os.listdir(self.DEV_DB_PATH)
       # self.train_databases = os.listdir(self.TRAIN_DB_PATH)
 
+
+   def load_description_cache(self):
+      cache_dir = self.DESCRIPTION_CACHE_PATH
+      if self.config is not None and self.config.get('bird_description_cache') is False:
+         cache_dir = None
+
+      self.description_cache = DescriptionCache(cache_dir)
+
    
-   def load_db(self, db_name: str) -> None:
+   def get_source_db_path(self, db_name: str) -> str:
       """
-      Load a database into the class by connecting and setting a cursor.
+      Construct and return the path to a specified BIRD database file.
 
       Parameters:
-         db_name (str): The name of the database to load.
+         db_name (str): The name of the database to find the path.
+
+      Returns:
+         str: The path to the database file in the dev or train split.
       """
-      db_path = ""
       if db_name in self.dev_databases:
-         db_path = f"{self.DEV_DB_PATH}/{db_name}/{db_name}.sqlite"
+         return f"{self.DEV_DB_PATH}/{db_name}/{db_name}.sqlite"
       else:
-         db_path = f"{self.TRAIN_DB_PATH}/{db_name}/{db_name}.sqlite"
-         
-      self.conn = sqlite3.connect(db_path)      
-      self.cursor = self.conn.cursor()
-      self.current_db = db_name
+         return f"{self.TRAIN_DB_PATH}/{db_name}/{db_name}.sqlite"
    
 
-   def get_bird_table_info(self, db_name):
+   def get_bird_table_info(self, db_name, tables: list = None):
       """
       Given a database name, retrieve the table schema and information 
       from the corresponding bird-bench .csv files.
 
+      The description files of a database are parsed once and cached in memory
+      and in cache/bird_descriptions, later calls only render the parsed model.
+
       :param database_name: str, name of the database
-      :return: dict, where keys are table names and values are a string
-      containing the table information
+      :param tables: list, names of the tables to include, all tables by default
+      :return: str, the description of each table as "Table <name>" followed
+      by the table's .csv contents
+      """
+      return self.get_bird_descriptions(db_name).render(tables)
+
+
+   def get_bird_descriptions(self, db_name) -> DatabaseDescription:
+      """
+      Return the parsed database_description folder of a database.
+
+      :param db_name: str, name of the database
+      :return: DatabaseDescription, the parsed description of every table
       """
 
       description_folder_path = ""
@@ -409,25 +1066,10 @@ class BIRDDataset(Dataset):
       else:
          description_folder_path = self.TRAIN_DB_PATH + f"/{db_name}/database_description"
       
-      if not os.path.exists(description_folder_path):
+      if db_name not in self.description_cache.descriptions and not os.path.exists(description_folder_path):
          raise FileNotFoundError(f"No such file or directory: '{description_folder_path}'")
-      
-      table_info = ""
-      
-      for filename in os.listdir(description_folder_path):
-         if filename.endswith(".csv"):
-            table_name = filename.rstrip(".csv")
-            csv_path = os.path.join(description_folder_path, filename)
-            
-            with open(csv_path, mode='r', encoding='utf-8') as file:
-               file_contents = file.read()                                   
-            
-            table_info += "Table " + table_name + "\n"
-            table_info += file_contents
-      
-         table_info += "\n\n"
 
-      return table_info
+      return self.description_cache.get_description(db_name, description_folder_path)
    
 
    def get_bird_db_info(self, db_path):      
@@ -458,6 +1100,9 @@ class SpiderDataset(Dataset):
    def load_data(self) -> None:
       """
       Load and filter questions specific to the Spider dataset configurations.
+
+      The gold SQL of a Spider question is stored as SQL and its evidence is
+      empty, like for BIRD questions.
       """
 
       if self.TRAIN_DATA_PATH is None or self.DEV_DATA_PATH is None:
@@ -466,43 +1111,25 @@ class SpiderDataset(Dataset):
       train_data = []
       dev_data = []
       
-      if self.config is not None:         
-         if self.config.spider_train_domains is not None:
-            train_data = load_json(self.TRAIN_DATA_PATH)
+      if self.config is not None:
+         train_domains = parse_name_list(self.config.spider_train_domains)
+         dev_domains = parse_name_list(self.config.spider_dev_domains)
+
+         if train_domains is not None:
             train_data = [
-               data_point for data_point in train_data 
-               if data_point['db_id'] in self.config.spider_train_domains
+               DataPoint.from_spider(data_point) for data_point in iter_json_array(self.TRAIN_DATA_PATH) 
+               if data_point['db_id'] in train_domains
             ]
 
-         if self.config.spider_dev_domains is not None:
-            dev_data = load_json(self.DEV_DATA_PATH)
+         if dev_domains is not None:
             dev_data = [
-               data_point for data_point in dev_data 
-               if data_point['db_id'] in self.config.spider_dev_domains
+               DataPoint.from_spider(data_point) for data_point in iter_json_array(self.DEV_DATA_PATH) 
+               if data_point['db_id'] in dev_domains
             ]
-               
 
       self.data = dev_data + train_data
 
 
-   def get_data_point(self, index: int) -> None:
-      """
-      Retrieve a data point from the Spider dataset, adjusting SQL information.
-
-      Parameters:
-         index (int): The index of the desired question.
-
-      Returns:
-         dict: The selected question with modified SQL data.
-      """
-
-      data_point = self.data[index]
-      data_point['SQL'] = data_point['query']
-      data_point['evidence'] = ""
-      del data_point['query']
-      return data_point
-   
-
    def get_train_domains(self):
       train_data = load_json(self.TRAIN_DATA_PATH)
       
@@ -0,0 +1,114 @@
+
+import os
+import asyncio
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from utils.connection_pool import ConnectionPool
+
+
+EvaluationResult = namedtuple("EvaluationResult", [
+    "success",
+    "predicted_outcome",
+    "gold_outcome",
+    "predicted_execution_time",
+    "gold_execution_time"
+])
+
+EvaluationJob = namedtuple("EvaluationJob", ["predicted_sql", "gold_sql", "db_id"])
+
+
+class ParallelEvaluator:
+    """
+    Evaluates predicted SQL against gold SQL for many questions on a pool of threads.
+
+    SQLite releases the GIL while a statement executes, so queries on different
+    threads run concurrently. Every worker thread opens its own read-only
+    connections, while the comparison logic, query budgets and gold result cache
+    are those of the dataset.
+    """
+
+    def __init__(self, dataset, max_workers: int = None):
+        self.dataset = dataset
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.local = threading.local()
+        self.pools = []
+        self.pools_lock = threading.Lock()
+
+
+    def evaluate(self, jobs: list) -> list:
+        """
+        Evaluate a list of jobs and return the results in the same order as the jobs.
+
+        The dataset execution time and outcome counters are updated in job order,
+        so last_* holds the values of the final job and total_* the sums, exactly
+        as if every job had been passed to execute_queries_and_match_data in turn.
+
+        Parameters:
+            jobs (list): (predicted_sql, gold_sql, db_id) tuples.
+
+        Returns:
+            list: One EvaluationResult per job.
+        """
+        jobs = [EvaluationJob(*job) for job in jobs]
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(self.evaluate_job, jobs))
+        finally:
+            self.close()
+
+        for result in results:
+            self.dataset.record_evaluation_result(result)
+
+        return results
+
+
+    async def aevaluate(self, predicted_sql: str, gold_sql: str, db_id: str) -> EvaluationResult:
+        """
+        Evaluate one job on a worker thread, so the event loop keeps running while the queries execute.
+
+        Unlike evaluate, the result is not recorded: pass it to
+        dataset.record_evaluation_result in question order. Call close once the
+        run is done.
+
+        Parameters:
+            predicted_sql (str): The predicted SQL query.
+            gold_sql (str): The golden SQL query.
+            db_id (str): The database the queries run on.
+
+        Returns:
+            EvaluationResult: The match result, query outcomes and execution times.
+        """
+        return await asyncio.to_thread(self.evaluate_job, EvaluationJob(predicted_sql, gold_sql, db_id))
+
+
+    def evaluate_job(self, job: EvaluationJob) -> EvaluationResult:
+        pool = self.get_thread_pool()
+        db_path = self.dataset.get_db_path(job.db_id)
+        conn = pool.get_connection(job.db_id, db_path)
+        return self.dataset.evaluate_queries(conn, job.predicted_sql, job.gold_sql, job.db_id)
+
+
+    def get_thread_pool(self) -> ConnectionPool:
+        """
+        Return the connection pool owned by the calling worker thread.
+        """
+        pool = getattr(self.local, "pool", None)
+        if pool is None:
+            pool = self.dataset.connection_pool.create_worker_pool()
+            self.local.pool = pool
+            with self.pools_lock:
+                self.pools.append(pool)
+        return pool
+
+
+    def close(self) -> None:
+        """
+        Close the connections opened by the worker threads once they have finished.
+        """
+        with self.pools_lock:
+            for pool in self.pools:
+                pool.close_all()
+            self.pools = []
+        self.local = threading.local()
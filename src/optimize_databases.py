@@ -0,0 +1,259 @@
+
+import os
+import re
+import json
+import time
+import sqlite3
+import pathlib
+import argparse
+from collections import Counter
+from datasets import Dataset, get_dataset
+from utils.query_timeout import QueryTimeout, QueryTimeoutError
+from utils.sql_tables import IDENTIFIER, quote, unquote, get_table_aliases
+
+
+JOIN_CONDITION_PATTERN = re.compile(
+    rf'({IDENTIFIER})\.({IDENTIFIER})\s*=\s*({IDENTIFIER})\.({IDENTIFIER})')
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("Write optimized copies of the databases of a dataset and check them against the gold queries")
+    parser.add_argument("--dataset", type=str, default="BIRD",
+                        help="Name of the dataset as registered in datasets.DATASET_LOADERS")
+    parser.add_argument("--output_dir", type=str, default="cache/optimized_databases",
+                        help="Directory, relative to the repository root, the optimized copies are written to. "
+                             "Set optimized_database_path in dataset_config.yaml to the same directory to use them")
+    parser.add_argument("--page_size", type=int, default=8192,
+                        help="Page size of the optimized copies in bytes")
+    parser.add_argument("--min_join_count", type=int, default=1,
+                        help="Index a column joined on by at least this many gold queries")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Executions of each gold query on the original and the copy, the fastest is reported")
+    parser.add_argument("--report_path", type=str, default="results/optimize_databases.json",
+                        help="Where to write the JSON report, relative to the repository root")
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+def find_join_columns(sqls: list, tables: list) -> Counter:
+    """
+    Count how many queries join on each (table, column), resolving table aliases.
+
+    Only equality conditions between qualified columns, such as
+    T1.account_id = T2.account_id, are recognized.
+    """
+    join_columns = Counter()
+
+    for sql in sqls:
+        aliases = get_table_aliases(sql, tables)
+
+        columns = set()
+        for match in JOIN_CONDITION_PATTERN.finditer(sql):
+            for alias, column in ((match.group(1), match.group(2)), (match.group(3), match.group(4))):
+                table = aliases.get(unquote(alias).lower())
+                if table is not None:
+                    columns.add((table, unquote(column)))
+        join_columns.update(columns)
+
+    return join_columns
+
+
+def get_indexed_columns(conn: sqlite3.Connection, table: str) -> set:
+    """
+    Return the lower-cased columns that already lead an index of the table or are its INTEGER PRIMARY KEY.
+    """
+    indexed = set()
+    for index in conn.execute(f"PRAGMA index_list({quote(table)})").fetchall():
+        index_columns = conn.execute(f"PRAGMA index_info({quote(index[1])})").fetchall()
+        if index_columns and index_columns[0][2] is not None:
+            indexed.add(index_columns[0][2].lower())
+
+    columns = conn.execute(f"PRAGMA table_info({quote(table)})").fetchall()
+    primary_key = [column for column in columns if column[5] > 0]
+    if len(primary_key) == 1 and primary_key[0][2].upper() == "INTEGER":
+        indexed.add(primary_key[0][1].lower())
+
+    return indexed
+
+
+def create_indexes(conn: sqlite3.Connection, gold_sqls: list, min_join_count: int) -> list:
+    """
+    Index the declared foreign key columns and the columns the gold queries join on.
+
+    Returns:
+        list: The (table, column) pairs that were indexed.
+    """
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+    table_names = {table.lower(): table for table in tables}
+    table_columns = {
+        table: {column[1].lower(): column[1] for column in conn.execute(f"PRAGMA table_info({quote(table)})")}
+        for table in tables
+    }
+
+    candidates = []
+    for table in tables:
+        for foreign_key in conn.execute(f"PRAGMA foreign_key_list({quote(table)})").fetchall():
+            candidates.append((table, foreign_key[3]))
+            referenced_table = table_names.get(foreign_key[2].lower())
+            if referenced_table is not None and foreign_key[4] is not None:
+                candidates.append((referenced_table, foreign_key[4]))
+
+    for (table, column), count in find_join_columns(gold_sqls, tables).most_common():
+        if count >= min_join_count:
+            candidates.append((table, column))
+
+    created = []
+    for table, column in candidates:
+        column = table_columns[table].get(column.lower())
+        if column is None or column.lower() in get_indexed_columns(conn, table):
+            continue
+
+        index_name = f"optimized_{table}_{column}"
+        conn.execute(f"CREATE INDEX {quote(index_name)} ON {quote(table)} ({quote(column)})")
+        created.append((table, column))
+
+    return created
+
+
+def optimize_database(source_path: str, target_path: str, gold_sqls: list, page_size: int, min_join_count: int) -> list:
+    """
+    Write an optimized copy of a database with VACUUM INTO, then index and ANALYZE it.
+
+    Returns:
+        list: The (table, column) pairs that were indexed.
+    """
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    tmp_path = target_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    source = sqlite3.connect(pathlib.Path(source_path).absolute().as_uri() + "?mode=ro", uri=True)
+    try:
+        # VACUUM INTO writes the copy with the page size set on the source connection
+        source.execute(f"PRAGMA page_size = {int(page_size)}")
+        source.execute("VACUUM INTO ?", (tmp_path,))
+    finally:
+        source.close()
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        created = create_indexes(conn, gold_sqls, min_join_count)
+        conn.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, target_path)
+    return created
+
+
+def run_query(conn: sqlite3.Connection, sql: str, repeats: int, timeout: float = None) -> tuple:
+    """
+    Execute a query repeats times.
+
+    Returns:
+        tuple: The result rows of the last execution, None if the query failed,
+        and the fastest execution time in seconds.
+    """
+    rows = None
+    fastest = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        try:
+            with QueryTimeout(conn, timeout):
+                rows = conn.execute(sql).fetchall()
+        except (QueryTimeoutError, sqlite3.Error):
+            return None, time.perf_counter() - start
+
+        elapsed = time.perf_counter() - start
+        fastest = elapsed if fastest is None else min(fastest, elapsed)
+    return rows, fastest
+
+
+def verify_database(source_path: str, target_path: str, gold_sqls: list, repeats: int, timeout: float = None) -> dict:
+    """
+    Execute the gold queries on the original and the optimized database and compare the results.
+
+    Results are compared as multisets, like predicted and gold results during
+    evaluation. A query that fails on the original database is skipped.
+    """
+    source = sqlite3.connect(pathlib.Path(source_path).absolute().as_uri() + "?mode=ro", uri=True)
+    target = sqlite3.connect(pathlib.Path(target_path).absolute().as_uri() + "?mode=ro", uri=True)
+
+    mismatches = []
+    source_time = 0
+    target_time = 0
+    try:
+        for sql in gold_sqls:
+            source_rows, source_elapsed = run_query(source, sql, repeats, timeout)
+            if source_rows is None:
+                continue
+
+            target_rows, target_elapsed = run_query(target, sql, repeats, timeout)
+            if target_rows is None or Counter(source_rows) != Counter(target_rows):
+                mismatches.append(sql)
+                continue
+
+            source_time += source_elapsed
+            target_time += target_elapsed
+    finally:
+        source.close()
+        target.close()
+
+    return {
+        "mismatches": mismatches,
+        "source_time": source_time,
+        "optimized_time": target_time,
+        "speedup": source_time / target_time if target_time > 0 else None
+    }
+
+
+def main():
+    opt = parse_option()
+    dataset = get_dataset(opt.dataset)
+
+    gold_sqls = {}
+    for i in range(dataset.get_number_of_data_points()):
+        data_point = dataset.get_data_point(i)
+        gold_sqls.setdefault(data_point['db_id'], []).append(data_point['SQL'])
+
+    report = {"dataset": opt.dataset, "page_size": opt.page_size, "databases": {}}
+    for db_id, sqls in gold_sqls.items():
+        source_path = dataset.get_source_db_path(db_id)
+        target_path = os.path.join(Dataset.ROOT_PATH, opt.output_dir, db_id, db_id + ".sqlite")
+
+        created = optimize_database(source_path, target_path, sqls, opt.page_size, opt.min_join_count)
+        verification = verify_database(source_path, target_path, sqls, opt.repeats, dataset.gold_sql_timeout)
+
+        if verification["mismatches"]:
+            # A copy that changes gold denotations must never be evaluated against
+            os.remove(target_path)
+
+        report["databases"][db_id] = {
+            "indexes": [f"{table}.{column}" for table, column in created],
+            "source_size": os.path.getsize(source_path),
+            **verification
+        }
+        print("Domain: ", db_id, " Indexes: ", len(created), " Mismatches: ", len(verification["mismatches"]),
+              " Speedup: ", verification["speedup"])
+
+    source_time = sum(database["source_time"] for database in report["databases"].values())
+    optimized_time = sum(database["optimized_time"] for database in report["databases"].values())
+    report["speedup"] = source_time / optimized_time if optimized_time > 0 else None
+
+    report_path = os.path.join(Dataset.ROOT_PATH, opt.report_path)
+    os.makedirs(os.path.dirname(report_path), exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    print("Total gold execution time: ", source_time, " original, ", optimized_time, " optimized. Speedup: ", report["speedup"])
+    print("Report written to ", report_path)
+
+    dataset.close()
+
+
+if __name__ == "__main__":
+    main()
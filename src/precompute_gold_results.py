@@ -0,0 +1,53 @@
+
+import argparse
+from datasets import get_dataset
+from utils.query_timeout import QueryTimeoutError
+from utils.result_comparison import EXACT
+import sqlite3
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("Execute all gold queries of a dataset and store the results the configured "
+                                     "result_comparison reads in the gold result cache")
+    parser.add_argument("--dataset", type=str, default="BIRD",
+                        help="Name of the dataset as registered in datasets.DATASET_LOADERS")
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+def main():
+    opt = parse_option()
+    dataset = get_dataset(opt.dataset)
+
+    if dataset.gold_result_cache is None:
+        raise ValueError("gold_result_cache must be enabled in dataset_config.yaml")
+
+    no_data_points = dataset.get_number_of_data_points()
+    failed = 0
+    for i in range(no_data_points):
+        data_point = dataset.get_data_point(i)
+        golden_sql = data_point['SQL']
+        db_id = data_point['db_id']
+
+        try:
+            # Exact comparison reads the result rows, the streaming and pushdown modes only the fingerprint
+            if dataset.result_comparison == EXACT:
+                dataset.fetch_gold_result(golden_sql, db_id)
+            else:
+                dataset.fetch_gold_fingerprint(golden_sql, db_id)
+        except (QueryTimeoutError, sqlite3.Error) as err:
+            failed += 1
+            print("Failed to execute gold query ", i, ": ", err)
+
+        print("Percentage done: ", round(i / no_data_points * 100, 2), "% Domain: ", db_id)
+
+    print("Gold result cache: ", dataset.gold_result_cache.get_stats(), " Failed: ", failed)
+    print("Total gold execution time: ", dataset.total_gold_execution_time)
+
+    dataset.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@ from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from langchain.callbacks import get_openai_callback
 from utils.timer import Timer
+from utils.llm_cache import CachedChain, LLMResponseCache
+from sql_agents.zero_shot import get_usage
+from utils.token_counter import get_token_estimate
+from async_runner import AsyncRunner
 import logging
 import numpy as np
 import seaborn as sns
@@ -97,10 +101,17 @@ class Classifier():
     prompt_tokens = 0 
     total_cost = 0
     completion_tokens = 0
+    estimated_prompt_tokens = 0
     last_call_execution_time = 0
     total_call_execution_time = 0
 
-    def __init__(self, llm):        
+    # Part of the LLM response cache key, bump it when a prompt changes meaning
+    PROMPT_VERSION = "1"
+
+    # The answer is a single number
+    ESTIMATED_COMPLETION_TOKENS = 8
+
+    def __init__(self, llm, response_cache=None):        
         self.llm = llm
 
         self.prompt_template = CLASSIFIY_PROMPT
@@ -110,7 +121,7 @@ class Classifier():
             template=CLASSIFIY_PROMPT,
         )
 
-        self.chain = LLMChain(llm=llm, prompt=prompt)
+        self.chain = CachedChain(LLMChain(llm=llm, prompt=prompt), response_cache, self.PROMPT_VERSION)
 
 
     def classify_question(self, question, schema, evidence, gold_query):
@@ -135,6 +146,54 @@ class Classifier():
             return response
 
 
+    async def aclassify_question(self, question, schema, evidence, gold_query):
+        """
+        Async version of classify_question, returns the response and the usage of the call.
+        """
+        with get_openai_callback() as cb, get_token_estimate() as estimate:
+            with Timer() as t:
+                response = await self.chain.arun({
+                    'question': question,
+                    'database_schema': schema,
+                    'evidence': evidence,
+                    'gold_query': gold_query
+                })
+
+            logging.info(f"OpenAI API execution time: {t.elapsed_time:.2f}")
+
+            return response, get_usage(cb, t.elapsed_time, estimate)
+
+
+    def estimate_tokens(self, question, schema, evidence, gold_query):
+        prompt_tokens = self.chain.count_prompt_tokens({
+            'question': question,
+            'database_schema': schema,
+            'evidence': evidence,
+            'gold_query': gold_query
+        })
+        return prompt_tokens + self.ESTIMATED_COMPLETION_TOKENS
+
+
+    def get_schema_budget(self, token_limit, max_response_length, question, evidence, gold_query):
+        prompt_tokens = self.chain.count_prompt_tokens({
+            'question': question,
+            'database_schema': "",
+            'evidence': evidence,
+            'gold_query': gold_query
+        })
+        return token_limit - max_response_length - prompt_tokens
+
+
+    def add_usage(self, usage):
+        self.last_call_execution_time = usage["execution_time"]
+        self.total_call_execution_time += usage["execution_time"]
+        self.total_tokens += usage["total_tokens"]
+        self.prompt_tokens += usage["prompt_tokens"]
+        self.total_cost += usage["total_cost"]
+        self.completion_tokens += usage["completion_tokens"]
+        self.estimated_prompt_tokens += usage["estimated_prompt_tokens"]
+
+
 accepted_faults = [1, 3]
 
 def main():
@@ -159,11 +218,13 @@ def main():
         openai_api_key=api_key, 
         model_name=config.llm_settings.model,
         temperature=config.llm_settings.temperature,
-        request_timeout=config.llm_settings.request_timeout
+        request_timeout=config.llm_settings.request_timeout,
+        max_retries=0 # Retried by the AsyncRunner
     )
 
     dataset = get_dataset("BIRDCorrectedFinancialGoldAnnotated")
-    classifier = Classifier(llm)
+    response_cache = LLMResponseCache.from_config(config)
+    classifier = Classifier(llm, response_cache)
 
     wandb.config['prompt'] = classifier.prompt_template
 
@@ -176,18 +237,38 @@ def main():
     confusion_matrix = np.zeros((4,4))
     annotation_counts = {0: 0, 1: 0, 2: 0, 3: 0}
     
-    for i in range(no_data_points):
+    runner = AsyncRunner.from_config(config)
+
+    budgeted_schemas = {}
+
+    def get_inputs(i):
         data_point = dataset.get_data_point(i)
-        evidence = data_point['evidence']
-        db_id = data_point['db_id']            
         question = data_point['question']
+        evidence = data_point['evidence']
         gold_query = data_point['SQL']
-        difficulty = data_point['difficulty'] if 'difficulty' in data_point else ""
+
+        if i not in budgeted_schemas:
+            budget = classifier.get_schema_budget(
+                config.llm_settings.token_limit, config.llm_settings.max_response_length, question, evidence, gold_query)
+            budgeted_schemas[i] = dataset.get_budgeted_schema(
+                data_point['db_id'], budget, config.llm_settings.model, question, evidence)
+
+        return question, budgeted_schemas[i].schema, evidence, gold_query
+
+    def estimate(i):
+        return 1, classifier.estimate_tokens(*get_inputs(i))
+
+    async def classify(i):
+        return await classifier.aclassify_question(*get_inputs(i))
+
+    def on_result(step, i, result):
+        classified_quality, usage = result
+        classifier.add_usage(usage)
+        budgeted_schemas.pop(i)
+
+        data_point = dataset.get_data_point(i)
         annotated_question_quality = data_point["annotation"]
-        
-        sql_schema = dataset.get_schema_and_sample_data(db_id)
 
-        classified_quality = classifier.classify_question(question, sql_schema, evidence, gold_query)
         classified_quality = int(classified_quality) if classified_quality.isdigit() else None
 
         print('classified_quality: ',classified_quality)
@@ -196,8 +277,22 @@ def main():
             for annotated_quality in annotated_question_quality:  
                 annotation_counts[annotated_quality] +=1
                 confusion_matrix[annotated_quality][classified_quality] += 1
-                
 
+        difficulty = data_point['difficulty'] if 'difficulty' in data_point else ""
+        table.add_data(data_point['question'], classified_quality, difficulty)
+        wandb.log({                      
+            "total_tokens": classifier.total_tokens,
+            "prompt_tokens": classifier.prompt_tokens,
+            "estimated_prompt_tokens": classifier.estimated_prompt_tokens,
+            "completion_tokens": classifier.completion_tokens,
+            "total_cost": classifier.total_cost,
+            "openAPI_call_execution_time": classifier.last_call_execution_time,
+        }, step=step+1)
+    
+        print("Predicted quality: ", classified_quality, " Annotated quality: ", " ".join(map(str, annotated_question_quality)))
+
+    runner.run(list(dataset.get_schedule()), classify, on_result, estimate)
+                
 
     print('confusion matrix:')
     print(confusion_matrix)
@@ -264,17 +359,6 @@ def main():
             # f1 = 2 * ((precision * recall) / (precision + recall))
             # accuracy = (tp + tn) / (tp + tn + fp + fn)
 
-        table.add_data(question, classified_quality, difficulty)
-        wandb.log({                      
-            "total_tokens": classifier.total_tokens,
-            "prompt_tokens": classifier.prompt_tokens,
-            "completion_tokens": classifier.completion_tokens,
-            "total_cost": classifier.total_cost,
-            "openAPI_call_execution_time": classifier.last_call_execution_time,
-        }, step=i+1)
-    
-        print("Predicted quality: ", classified_quality, " Annotated quality: ", " ".join(map(str, annotated_question_quality)))
-        
     weighted_averages = {metric: total / total_instances for metric, total in weighted_sums.items()}
 
     print("Weighted Averages:", weighted_averages)
@@ -289,10 +373,13 @@ def main():
 
     wandb.run.summary["total_tokens"]                       = classifier.total_tokens
     wandb.run.summary["prompt_tokens"]                      = classifier.prompt_tokens
+    wandb.run.summary["estimated_prompt_tokens"]            = classifier.estimated_prompt_tokens
     wandb.run.summary["completion_tokens"]                  = classifier.completion_tokens
     wandb.run.summary["total_cost"]                         = classifier.total_cost
     wandb.run.summary['total_predicted_execution_time']     = dataset.total_predicted_execution_time
     wandb.run.summary['total_openAPI_execution_time']       = classifier.total_call_execution_time
+    wandb.run.summary['llm_response_cache']                 = response_cache.get_stats()
+    wandb.run.summary['async_runner']                       = runner.get_stats()
 
     
     artifact.add(wandb_cm, "ConfusionMatrix_predictions")
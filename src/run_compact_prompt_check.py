@@ -0,0 +1,166 @@
+
+import os
+import sys
+import json
+import argparse
+from langchain.chat_models import ChatOpenAI
+from datasets import Dataset, get_dataset
+from sql_agents.din_sql import DinSQLAgent
+from utils.llm_cache import LLMResponseCache, DEFAULT_CACHE_PATH
+from async_runner import AsyncRunner
+from evaluation import ParallelEvaluator
+from config import api_key
+
+
+BIRD_DATASETS = ("BIRD", "BIRDFixedFinancial", "BIRDExperimentalFinancial", "BIRDFixedFinancialGoldSQL")
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("Check that the compact DIN-SQL prompts keep the accuracy of the original prompts")
+    parser.add_argument("--dataset", type=str, default="BIRDFixedFinancial",
+                        help="Name of the dataset as registered in datasets.DATASET_LOADERS")
+    parser.add_argument("--questions", type=int, default=50,
+                        help="Number of questions of the fixed subset, the first ones in the file order of the dataset")
+    parser.add_argument("--model_name", type=str, default="gpt-3.5-turbo-16k")
+    parser.add_argument("--token_limit", type=int, default=16384)
+    parser.add_argument("--max_response_length", type=int, default=1024)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max_accuracy_drop", type=float, default=0.0,
+                        help="Largest accuracy loss of the compact prompts that still passes the check")
+    parser.add_argument("--llm_cache_path", type=str, default=DEFAULT_CACHE_PATH,
+                        help="LLM response cache, so a rerun of the check does not call the model again")
+    parser.add_argument("--report_only", action="store_true",
+                        help="Only print the tokens of every system prompt, without calling the model")
+    parser.add_argument("--output_path", type=str,
+                        default=os.path.join(Dataset.ROOT_PATH, "results/compact_prompt_check.json"),
+                        help="Where to write the JSON report")
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+def run_variant(opt, dataset, agent, indices, schemas) -> dict:
+    """
+    Generate and evaluate the query of every question with an agent.
+
+    Returns:
+        dict: The success and prompt tokens per question index and the totals.
+    """
+    runner = AsyncRunner(max_concurrency=opt.concurrency)
+    evaluator = ParallelEvaluator(dataset)
+    questions = {}
+
+    def get_inputs(i):
+        data_point = dataset.get_data_point(i)
+        schema = schemas[i]
+        return schema.schema, schema.descriptions, data_point['evidence'], data_point['question']
+
+    # The queries are evaluated on a worker thread, so the calls of the other questions go on meanwhile
+    async def generate(i):
+        predicted_sql, usage = await agent.agenerate_query(*get_inputs(i))
+        data_point = dataset.get_data_point(i)
+        evaluation = await evaluator.aevaluate(predicted_sql, data_point['SQL'], data_point['db_id'])
+        return predicted_sql, usage, evaluation
+
+    def on_result(step, i, result):
+        predicted_sql, usage, evaluation = result
+        dataset.record_evaluation_result(evaluation)
+        success = evaluation.success
+        questions[i] = {
+            "success": success,
+            "prompt_tokens": usage["prompt_tokens"],
+            "estimated_prompt_tokens": usage["estimated_prompt_tokens"],
+            "cached_calls": usage["cached_calls"],
+            "predicted_sql": predicted_sql
+        }
+        print("Question ", step + 1, "/", len(indices), " Success: ", success)
+
+    runner.run(indices, generate, on_result)
+    evaluator.close()
+
+    return {
+        "accuracy": sum(question["success"] for question in questions.values()) / len(indices),
+        "prompt_tokens": sum(question["prompt_tokens"] for question in questions.values()),
+        "estimated_prompt_tokens": sum(question["estimated_prompt_tokens"] for question in questions.values()),
+        # Cached calls use no tokens, so prompt tokens only compare for runs without them
+        "cached_calls": sum(question["cached_calls"] for question in questions.values()),
+        "questions": questions
+    }
+
+
+def main():
+    opt = parse_option()
+
+    llm = ChatOpenAI(
+        openai_api_key=api_key,
+        model_name=opt.model_name,
+        temperature=0,
+        request_timeout=120,
+        max_retries=0 # Retried by the AsyncRunner
+    )
+    response_cache = LLMResponseCache(opt.llm_cache_path)
+    original_agent = DinSQLAgent(llm, response_cache)
+    compact_agent = DinSQLAgent(llm, response_cache, compact_prompts=True)
+
+    template_report = original_agent.get_template_report(opt.model_name)
+    for name, entry in template_report.items():
+        print(f"{name:<16} {entry['tokens']:>6} -> {entry['compact_tokens']:>6} tokens ({entry['saved_ratio']:.1%} saved)")
+    if opt.report_only:
+        return
+
+    dataset = get_dataset(opt.dataset)
+    indices = dataset.get_schedule("file")[:opt.questions]
+    include_descriptions = opt.dataset in BIRD_DATASETS
+
+    # Both variants get the schema fitted to the budget of the original prompts, so only the prompts differ
+    schemas = {}
+    for i in indices:
+        data_point = dataset.get_data_point(i)
+        budget = original_agent.get_schema_budget(
+            opt.token_limit, opt.max_response_length, data_point['question'], data_point['evidence'])
+        schemas[i] = dataset.get_budgeted_schema(data_point['db_id'], budget, opt.model_name,
+                                                 data_point['question'], data_point['evidence'], include_descriptions)
+
+    original = run_variant(opt, dataset, original_agent, indices, schemas)
+    compact = run_variant(opt, dataset, compact_agent, indices, schemas)
+
+    changed = [
+        {"index": i, "question": dataset.get_data_point(i)['question'],
+         "original": original["questions"][i]["success"], "compact": compact["questions"][i]["success"]}
+        for i in indices if original["questions"][i]["success"] != compact["questions"][i]["success"]
+    ]
+    passed = compact["accuracy"] >= original["accuracy"] - opt.max_accuracy_drop
+
+    report = {
+        "dataset": opt.dataset,
+        "questions": indices,
+        "templates": template_report,
+        "original": original,
+        "compact": compact,
+        "prompt_tokens_saved": original["prompt_tokens"] - compact["prompt_tokens"],
+        "changed": changed,
+        "passed": passed
+    }
+
+    output_dir = os.path.dirname(opt.output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(opt.output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    print("Accuracy: ", original["accuracy"], " -> ", compact["accuracy"], " Questions changed: ", len(changed))
+    print("Prompt tokens: ", original["prompt_tokens"], " -> ", compact["prompt_tokens"],
+          " Cached calls: ", original["cached_calls"], " -> ", compact["cached_calls"])
+    print("Report written to ", opt.output_path)
+
+    dataset.close()
+    response_cache.close()
+
+    if not passed:
+        print("FAILED: the compact prompts lose more than ", opt.max_accuracy_drop, " accuracy")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,52 @@ import os
 from datasets import get_dataset
 from langchain.chat_models import ChatOpenAI
 from sql_agents.din_sql import DinSQLAgent
+from utils.llm_cache import LLMResponseCache
+from utils.sql_validator import SQLValidator
+from utils.stage_pipeline import StageStore
+from scheduling import LatencyRecorder
+from async_runner import AsyncRunner
+from evaluation import ParallelEvaluator
 from config import api_key, load_config
 import wandb
 import langchain
 from box import Box
+from collections import Counter
 # langchain.verbose = True
 
 # If you don't want your script to sync to the cloud
 # os.environ["WANDB_MODE"] = "offline"
 
+def get_correction_gate_summary(correction_gate, din_sql_agent, correction_outcomes, skipped_correction_prompt_tokens):
+    """
+    Return the correction gate counters with the tokens and OpenAI time of the run with and without the gate.
+
+    Without the gate every skipped self-correction would have been sent, its
+    prompt tokens are counted and its completion and time taken as the mean
+    of the self-corrections that were sent, and the time of the gate itself
+    is left out.
+    """
+    skipped = correction_outcomes["skipped"]
+    stages = din_sql_agent.stage_ledger.summarize()
+    self_correction = stages.get("self_correction")
+    gate_time = stages["correction_gate"]["total_wall_time"] if "correction_gate" in stages else 0
+    mean_completion_tokens = self_correction["mean_completion_tokens"] if self_correction else 0
+    mean_wall_time = (self_correction["wall_time"]["mean"] or 0) if self_correction else 0
+
+    return {
+        **correction_gate.get_stats(),
+        "skipped": skipped,
+        "sent": correction_outcomes["sent"],
+        "total_tokens": din_sql_agent.total_tokens,
+        "estimated_total_tokens_without_gate": din_sql_agent.total_tokens + skipped_correction_prompt_tokens
+            + skipped * mean_completion_tokens,
+        "openAPI_execution_time": din_sql_agent.total_call_execution_time,
+        "gate_time": gate_time,
+        "estimated_openAPI_execution_time_without_gate": din_sql_agent.total_call_execution_time - gate_time
+            + skipped * mean_wall_time
+    }
+
+
 def main():
     config = {
         # WANDB Experiment information
@@ -25,6 +62,39 @@ def main():
         "model_name": "gpt-3.5-turbo-16k",
         "temperature": 0,
         "request_timeout": 120,
+        # Context window of the model and the tokens reserved for the answer, the schema is reduced to fit the rest
+        "token_limit": 16384,
+        "max_response_length": 1024,
+
+        # Start the generation call alongside the classification: off, predicted (the branch a local
+        # heuristic predicts) or all (easy and non-nested), trading tokens for one round trip
+        "speculation": "off",
+
+        # Give the classification, generation and self-correction only the tables of the schema links
+        # and the tables joining them
+        "schema_pruning": False,
+
+        # Skip the self-correction call for queries that compile, join with keys and return rows on
+        # the local database, with the dry run capped at correction_gate_row_limit rows and
+        # correction_gate_timeout seconds
+        "correction_gate": False,
+        "correction_gate_row_limit": 100,
+        "correction_gate_timeout": 1.0,
+
+        # Render the example schemas of the few-shot prompts compactly, with shortened sample values
+        "compact_prompts": False,
+
+        # Store the output of every DIN-SQL stage, so a crashed run resumes and an ablation of one
+        # prompt reruns only that stage and the stages after it whose inputs changed
+        "stage_checkpoints": False,
+
+        # LLM response cache: read_through, write_only, replay_only or bypass
+        "llm_cache_mode": "write_only",
+
+        # Requests in flight and OpenAI rate limits of the account, None for no limit
+        "concurrency": 1,
+        "requests_per_minute": 3500,
+        "tokens_per_minute": 180000,
 
         # Dataset choice
         # "dataset": "Spider",
@@ -53,67 +123,167 @@ def main():
         openai_api_key=api_key, 
         model_name=config.model_name,
         temperature=config.temperature,
-        request_timeout=config.request_timeout
+        request_timeout=config.request_timeout,
+        max_retries=0 # Retried by the AsyncRunner
     )
 
     dataset = get_dataset(config.dataset)
-    din_sql_agent = DinSQLAgent(llm)
+    response_cache = LLMResponseCache.from_config(config)
+    include_descriptions = (config.dataset == "BIRD" or 
+        config.dataset == "BIRDFixedFinancial" or 
+        config.dataset == "BIRDExperimentalFinancial" or 
+        config.dataset == "BIRDFixedFinancialGoldSQL")
+
+    def prune_schema(db_name, schema_links):
+        return dataset.get_pruned_schema(db_name, schema_links, include_descriptions)
+
+    correction_gate = SQLValidator.from_config(dataset, config) if config.correction_gate else None
+    schema_pruner = prune_schema if config.schema_pruning else None
+    stage_store = StageStore(dataset.get_stage_checkpoint_path()) if config.stage_checkpoints else None
+    din_sql_agent = DinSQLAgent(llm, response_cache, config.speculation, correction_gate, schema_pruner, stage_store,
+                                config.compact_prompts)
     
     no_data_points = dataset.get_number_of_data_points()
     score = 0
     accuracy = 0
-    for i in range(no_data_points):        
+    latency_recorder = LatencyRecorder()
+    runner = AsyncRunner.from_config(config)
+    evaluator = ParallelEvaluator(dataset)
+
+    budgeted_schemas = {}
+    schema_degradations = Counter()
+    speculation_outcomes = Counter()
+    discarded_tokens = 0
+    discarded_cost = 0
+    correction_outcomes = Counter()
+    pruned_questions = 0
+    skipped_correction_prompt_tokens = 0
+
+    def get_inputs(i):
         data_point = dataset.get_data_point(i)
-        evidence = data_point['evidence']
-        golden_sql = data_point['SQL']
-        db_id = data_point['db_id']            
         question = data_point['question']
-        difficulty = data_point['difficulty'] if 'difficulty' in data_point else ""
+        evidence = data_point['evidence']
 
-        sql_schema = dataset.get_schema_and_sample_data(db_id)
+        if i not in budgeted_schemas:
+            budget = din_sql_agent.get_schema_budget(config.token_limit, config.max_response_length, question, evidence)
+            budgeted_schemas[i] = dataset.get_budgeted_schema(
+                data_point['db_id'], budget, config.model_name, question, evidence, include_descriptions)
 
-        if (config.dataset == "BIRD" or 
-            config.dataset == "BIRDFixedFinancial" or 
-            config.dataset == "BIRDExperimentalFinancial" or 
-            config.dataset == "BIRDFixedFinancialGoldSQL"):
+        budgeted_schema = budgeted_schemas[i]
+        return budgeted_schema.schema, budgeted_schema.descriptions, evidence, question
 
-            bird_table_info = dataset.get_bird_db_info(db_id)            
-        else:
-            bird_table_info = ""
+    def estimate(i):
+        return din_sql_agent.LLM_CALLS_PER_QUESTION, din_sql_agent.estimate_tokens(*get_inputs(i))
 
-        # bird_table_info = ""
+    # The queries are evaluated on a worker thread, so the calls of the other questions go on meanwhile
+    async def generate(i):
+        data_point = dataset.get_data_point(i)
+        predicted_sql, usage = await din_sql_agent.agenerate_query(*get_inputs(i), db_name=data_point['db_id'])
+        evaluation = await evaluator.aevaluate(predicted_sql, data_point['SQL'], data_point['db_id'])
+        return predicted_sql, usage, evaluation
+
+    # Called in schedule order, so the totals and wandb steps do not depend on the concurrency
+    def on_result(step, i, result):
+        nonlocal score, accuracy, discarded_tokens, discarded_cost, skipped_correction_prompt_tokens, pruned_questions
+        predicted_sql, usage, evaluation = result
+        din_sql_agent.add_usage(usage)
+        if usage["speculation"] is not None:
+            speculation_outcomes[usage["speculation"]] += 1
+        discarded_tokens += usage["discarded_tokens"]
+        discarded_cost += usage["discarded_cost"]
+        if usage["correction"] is not None:
+            correction_outcomes[usage["correction"]] += 1
+        skipped_correction_prompt_tokens += usage["skipped_correction_prompt_tokens"]
+        if usage["pruned_tables"] is not None:
+            pruned_questions += 1
+        budgeted_schema = budgeted_schemas.pop(i)
+        schema_degradations.update(budgeted_schema.steps)
+
+        data_point = dataset.get_data_point(i)
+        golden_sql = data_point['SQL']
+        db_id = data_point['db_id']            
+        question = data_point['question']
+        difficulty = data_point['difficulty'] if 'difficulty' in data_point else ""
 
-        predicted_sql = din_sql_agent.generate_query(sql_schema, bird_table_info, evidence, question)
-        success = dataset.execute_queries_and_match_data(predicted_sql, golden_sql, db_id)
+        dataset.record_evaluation_result(evaluation)
+        success = evaluation.success
 
         score += success
-        accuracy = score / (i + 1)
+        accuracy = score / (step + 1)
+
+        # Responses from the LLM cache or reused stages say nothing about the latency of the question
+        if not din_sql_agent.last_call_cached and not usage["reused_stages"]:
+            latency_recorder.record(question, din_sql_agent.last_call_execution_time + dataset.last_predicted_execution_time)
 
         table.add_data(question, golden_sql, predicted_sql, success, difficulty)
-        wandb.log({
+        log_data = {
             "success": success,
             "total_tokens": din_sql_agent.total_tokens,
             "prompt_tokens": din_sql_agent.prompt_tokens,
+            "estimated_prompt_tokens": din_sql_agent.estimated_prompt_tokens,
+            "schema_tokens": budgeted_schema.tokens,
+            "dropped_tables": len(budgeted_schema.dropped_tables),
             "completion_tokens": din_sql_agent.completion_tokens,
             "total_cost": din_sql_agent.total_cost,
+            "discarded_tokens": discarded_tokens,
+            "discarded_cost": discarded_cost,
+            "correction_skipped": usage["correction"] == "skipped",
+            "pruned_tables": len(usage["pruned_tables"]) if usage["pruned_tables"] is not None else None,
+            "reused_stages": len(usage["reused_stages"]),
+            "retries": usage["retries"],
+            "skipped_correction_prompt_tokens": skipped_correction_prompt_tokens,
             "openAPI_call_execution_time": din_sql_agent.last_call_execution_time,
+            **{f"stage_time/{stage}": wall_time for stage, wall_time in usage["stages"].items()},
             "predicted_sql_execution_time": dataset.last_predicted_execution_time,
             "gold_sql_execution_time": dataset.last_gold_execution_time
-        }, step=i+1)
+        }
+        if dataset.report_question_index():
+            log_data["question_index"] = i
+        wandb.log(log_data, step=step+1)
     
-        print("Percentage done: ", round(i / no_data_points * 100, 2), "% Domain: ", 
+        print("Percentage done: ", round(step / no_data_points * 100, 2), "% Domain: ", 
               db_id, " Success: ", success, " Accuracy: ", accuracy)
+
+    runner.run(list(dataset.get_schedule()), generate, on_result, estimate)
+    evaluator.close()
+    if correction_gate is not None:
+        correction_gate.close()
         
-    
+    latency_recorder.save(dataset.get_latency_history_path())
+    din_sql_agent.stage_ledger.save(dataset.get_stage_metrics_path())
+    din_sql_agent.stage_ledger.log_to_wandb(wandb)
+
     wandb.run.summary['number_of_questions']                = dataset.get_number_of_data_points()
     wandb.run.summary["accuracy"]                           = score / no_data_points
     wandb.run.summary["total_tokens"]                       = din_sql_agent.total_tokens
     wandb.run.summary["prompt_tokens"]                      = din_sql_agent.prompt_tokens
+    wandb.run.summary["estimated_prompt_tokens"]            = din_sql_agent.estimated_prompt_tokens
+    wandb.run.summary["schema_degradations"]                = dict(schema_degradations)
     wandb.run.summary["completion_tokens"]                  = din_sql_agent.completion_tokens
     wandb.run.summary["total_cost"]                         = din_sql_agent.total_cost
+    wandb.run.summary["cached_calls"]                       = din_sql_agent.cached_calls
+    wandb.run.summary["retried_calls"]                      = din_sql_agent.retries
+    wandb.run.summary["system_prompt_tokens"]               = din_sql_agent.get_template_report(config.model_name)
+    wandb.run.summary["pruned_questions"]                   = pruned_questions
+    wandb.run.summary["speculation"]                        = dict(speculation_outcomes)
+    wandb.run.summary["discarded_tokens"]                   = discarded_tokens
+    wandb.run.summary["discarded_cost"]                     = discarded_cost
+    if correction_gate is not None:
+        wandb.run.summary["correction_gate"]                = get_correction_gate_summary(
+            correction_gate, din_sql_agent, correction_outcomes, skipped_correction_prompt_tokens)
     wandb.run.summary['total_predicted_execution_time']     = dataset.total_predicted_execution_time
     wandb.run.summary['total_gold_execution_time']          = dataset.total_gold_execution_time
+    wandb.run.summary['connection_pool']                    = dataset.get_connection_pool_stats()
+    wandb.run.summary['predicted_sql_outcomes']             = dict(dataset.predicted_outcomes)
+    wandb.run.summary['gold_sql_outcomes']                  = dict(dataset.gold_outcomes)
+    if dataset.gold_result_cache is not None:
+        wandb.run.summary['gold_result_cache']              = dataset.gold_result_cache.get_stats()
     wandb.run.summary['total_openAPI_execution_time']       = din_sql_agent.total_call_execution_time
+    wandb.run.summary['llm_response_cache']                 = response_cache.get_stats()
+    wandb.run.summary['async_runner']                       = runner.get_stats()
+    if stage_store is not None:
+        wandb.run.summary['stage_checkpoints']              = stage_store.get_stats()
+        stage_store.close()
 
     artifact.add(table, "query_results")
     wandb.log_artifact(artifact)
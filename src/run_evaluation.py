@@ -0,0 +1,73 @@
+
+import json
+import argparse
+from datasets import get_dataset
+from evaluation import ParallelEvaluator
+from utils.timer import Timer
+from utils.utils import load_json
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("Score stored predictions against the gold SQL of a dataset")
+    parser.add_argument("--predictions_path", type=str, required=True,
+                        help="JSON list of results with question, predicted_sql, gold_sql and optionally db_id, "
+                             "such as the files written to results/artifacts by download_artifacts.py")
+    parser.add_argument("--dataset", type=str, default="BIRD",
+                        help="Dataset used to look up the database of questions without a db_id")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of evaluation threads, defaults to the number of cores")
+    parser.add_argument("--output_path", type=str, default=None,
+                        help="Where to write the re-scored results")
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+def main():
+    opt = parse_option()
+    dataset = get_dataset(opt.dataset)
+    predictions = load_json(opt.predictions_path)
+
+    question_db_ids = {}
+    for i in range(dataset.get_number_of_data_points()):
+        data_point = dataset.get_data_point(i)
+        question_db_ids[data_point['question']] = data_point['db_id']
+
+    jobs = []
+    for prediction in predictions:
+        db_id = prediction.get('db_id') or question_db_ids[prediction['question']]
+        jobs.append((prediction['predicted_sql'], prediction['gold_sql'], db_id))
+
+    evaluator = ParallelEvaluator(dataset, opt.workers)
+    with Timer() as t:
+        results = evaluator.evaluate(jobs)
+
+    score = sum(result.success for result in results)
+    accuracy = score / len(results) if len(results) > 0 else 0
+
+    print("Number of questions: ", len(results), " Accuracy: ", accuracy)
+    print("Evaluation time: ", round(t.elapsed_time, 2), "s with ", evaluator.max_workers, " workers")
+    print("Total predicted execution time: ", dataset.total_predicted_execution_time)
+    print("Total gold execution time: ", dataset.total_gold_execution_time)
+    print("Predicted SQL outcomes: ", dict(dataset.predicted_outcomes))
+    if dataset.admission_control != "off":
+        print("Admission decisions: ", dict(dataset.admission_counts))
+
+    if opt.output_path is not None:
+        scored = []
+        for prediction, result in zip(predictions, results):
+            scored.append({**prediction,
+                           'success': result.success,
+                           'predicted_outcome': result.predicted_outcome,
+                           'predicted_execution_time': result.predicted_execution_time,
+                           'gold_execution_time': result.gold_execution_time})
+
+        with open(opt.output_path, 'w', encoding='utf-8') as f:
+            json.dump(scored, f, ensure_ascii=False, indent=4)
+
+    dataset.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,13 @@ import os
 from datasets import get_dataset
 from langchain.chat_models import ChatOpenAI
 from sql_agents.few_shot import FewShotAgent
+from utils.llm_cache import LLMResponseCache
+from scheduling import LatencyRecorder
+from async_runner import AsyncRunner
+from evaluation import ParallelEvaluator
 from config import api_key, load_config
 import wandb
+from collections import Counter
 import langchain
 langchain.verbose = False
 
@@ -31,57 +36,118 @@ def main():
         openai_api_key=api_key, 
         model_name=config.llm_settings.model,
         temperature=config.llm_settings.temperature,
-        request_timeout=config.llm_settings.request_timeout
+        request_timeout=config.llm_settings.request_timeout,
+        max_retries=0 # Retried by the AsyncRunner
     )
 
     dataset = get_dataset(config.dataset)    
-    few_shot_agent = FewShotAgent(llm)
+    response_cache = LLMResponseCache.from_config(config)
+    few_shot_agent = FewShotAgent(llm, response_cache)
 
     wandb.config['prompt'] = few_shot_agent.prompt_template
     
     no_data_points = dataset.get_number_of_data_points()
     score = 0
     accuracy = 0
-    for i in range(no_data_points):
+    latency_recorder = LatencyRecorder()
+    runner = AsyncRunner.from_config(config)
+    evaluator = ParallelEvaluator(dataset)
+
+    budgeted_schemas = {}
+    schema_degradations = Counter()
+
+    def get_inputs(i):
         data_point = dataset.get_data_point(i)
+        question = data_point['question']
         evidence = data_point['evidence']
+
+        if i not in budgeted_schemas:
+            budget = few_shot_agent.get_schema_budget(
+                config.llm_settings.token_limit, config.llm_settings.max_response_length, question, evidence)
+            budgeted_schemas[i] = dataset.get_budgeted_schema(
+                data_point['db_id'], budget, config.llm_settings.model, question, evidence)
+
+        return budgeted_schemas[i].schema, question, evidence
+
+    def estimate(i):
+        return few_shot_agent.LLM_CALLS_PER_QUESTION, few_shot_agent.estimate_tokens(*get_inputs(i))
+
+    # The queries are evaluated on a worker thread, so the calls of the other questions go on meanwhile
+    async def generate(i):
+        predicted_sql, usage = await few_shot_agent.agenerate_query(*get_inputs(i))
+        data_point = dataset.get_data_point(i)
+        evaluation = await evaluator.aevaluate(predicted_sql, data_point['SQL'], data_point['db_id'])
+        return predicted_sql, usage, evaluation
+
+    # Called in schedule order, so the totals and wandb steps do not depend on the concurrency
+    def on_result(step, i, result):
+        nonlocal score, accuracy
+        predicted_sql, usage, evaluation = result
+        few_shot_agent.add_usage(usage)
+        budgeted_schema = budgeted_schemas.pop(i)
+        schema_degradations.update(budgeted_schema.steps)
+
+        data_point = dataset.get_data_point(i)
         golden_sql = data_point['SQL']
         db_id = data_point['db_id']            
         question = data_point['question']
         difficulty = data_point['difficulty'] if 'difficulty' in data_point else ""
 
-        sql_schema = dataset.get_schema_and_sample_data(db_id)
-        predicted_sql = few_shot_agent.generate_query(sql_schema, question, evidence)  
-        success = dataset.execute_queries_and_match_data(predicted_sql, golden_sql, db_id)
+        dataset.record_evaluation_result(evaluation)
+        success = evaluation.success
 
         score += success
-        accuracy = score / (i + 1)
+        accuracy = score / (step + 1)
+
+        # A response from the LLM cache says nothing about the latency of the question
+        if not few_shot_agent.last_call_cached:
+            latency_recorder.record(question, few_shot_agent.last_call_execution_time + dataset.last_predicted_execution_time)
 
         table.add_data(question, golden_sql, predicted_sql, success, difficulty)
-        wandb.log({
+        log_data = {
             "accuracy": accuracy,
             "total_tokens": few_shot_agent.total_tokens,
             "prompt_tokens": few_shot_agent.prompt_tokens,
+            "estimated_prompt_tokens": few_shot_agent.estimated_prompt_tokens,
+            "schema_tokens": budgeted_schema.tokens,
+            "dropped_tables": len(budgeted_schema.dropped_tables),
             "completion_tokens": few_shot_agent.completion_tokens,
             "total_cost": few_shot_agent.total_cost,
             "openAPI_call_execution_time": few_shot_agent.last_call_execution_time,
             "predicted_sql_execution_time": dataset.last_predicted_execution_time,
             "gold_sql_execution_time": dataset.last_gold_execution_time
-        }, step=i+1)
+        }
+        if dataset.report_question_index():
+            log_data["question_index"] = i
+        wandb.log(log_data, step=step+1)
     
-        print("Percentage done: ", round(i / no_data_points * 100, 2), "% Domain: ", 
+        print("Percentage done: ", round(step / no_data_points * 100, 2), "% Domain: ", 
               db_id, " Success: ", success, " Accuracy: ", accuracy)
-            
+
+    runner.run(list(dataset.get_schedule()), generate, on_result, estimate)
+    evaluator.close()
+
+    latency_recorder.save(dataset.get_latency_history_path())
 
     wandb.run.summary['number_of_questions']                = no_data_points
     wandb.run.summary["accuracy"]                           = accuracy
     wandb.run.summary["total_tokens"]                       = few_shot_agent.total_tokens
     wandb.run.summary["prompt_tokens"]                      = few_shot_agent.prompt_tokens
+    wandb.run.summary["estimated_prompt_tokens"]            = few_shot_agent.estimated_prompt_tokens
+    wandb.run.summary["schema_degradations"]                = dict(schema_degradations)
     wandb.run.summary["completion_tokens"]                  = few_shot_agent.completion_tokens
     wandb.run.summary["total_cost"]                         = few_shot_agent.total_cost
+    wandb.run.summary["cached_calls"]                       = few_shot_agent.cached_calls
     wandb.run.summary['total_predicted_execution_time']     = dataset.total_predicted_execution_time
     wandb.run.summary['total_gold_execution_time']          = dataset.total_gold_execution_time
+    wandb.run.summary['connection_pool']                    = dataset.get_connection_pool_stats()
+    wandb.run.summary['predicted_sql_outcomes']             = dict(dataset.predicted_outcomes)
+    wandb.run.summary['gold_sql_outcomes']                  = dict(dataset.gold_outcomes)
+    if dataset.gold_result_cache is not None:
+        wandb.run.summary['gold_result_cache']              = dataset.gold_result_cache.get_stats()
     wandb.run.summary['total_openAPI_execution_time']       = few_shot_agent.total_call_execution_time
+    wandb.run.summary['llm_response_cache']                 = response_cache.get_stats()
+    wandb.run.summary['async_runner']                       = runner.get_stats()
 
     artifact.add(table, "query_results")
     wandb.log_artifact(artifact)
@@ -1,49 +1,218 @@
 
 import os
-from datasets import Dataset
+import json
+import time
+import sqlite3
+import argparse
+from datasets import Dataset, get_dataset
+from utils.query_timeout import QueryTimeout, QueryTimeoutError, SUCCESS, ERROR, TIMEOUT
+from utils.stats import summarize
 from utils.utils import load_json
-from langchain.chat_models import ChatOpenAI
-from sql_agents.zero_shot import ZeroShotAgent
-from config import config, api_key
-import wandb
 
-QUESTIONS_PATH = os.path.abspath(
-    os.path.join(os.path.dirname( __file__ ), '../data/questions.json'))
 
-# If you don't want your script to sync to the cloud
-os.environ["WANDB_MODE"] = "offline"
+def parse_option():
+    parser = argparse.ArgumentParser("Benchmark the execution time of the gold queries of a dataset")
+    parser.add_argument("--dataset", type=str, default="BIRD",
+                        help="Name of the dataset as registered in datasets.DATASET_LOADERS")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="Untimed executions of each query before the warm-cache runs")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="Timed warm-cache executions of each query")
+    parser.add_argument("--slowest", type=int, default=10,
+                        help="Number of slowest queries to capture the EXPLAIN QUERY PLAN of")
+    parser.add_argument("--output_path", type=str,
+                        default=os.path.join(Dataset.ROOT_PATH, "results/gold_sql_timing.json"),
+                        help="Where to write the JSON report")
+    parser.add_argument("--baseline_path", type=str, default=None,
+                        help="A report of an earlier run to compare the warm p50 timings against")
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+def time_query(conn: sqlite3.Connection, sql: str, timeout: float = None) -> tuple:
+    """
+    Execute a query once and fetch all rows.
+
+    Returns:
+        tuple: The outcome ("success", "error" or "timeout"), the elapsed seconds and the number of rows.
+    """
+    start = time.perf_counter()
+    try:
+        with QueryTimeout(conn, timeout):
+            rows = conn.execute(sql).fetchall()
+    except QueryTimeoutError:
+        return TIMEOUT, time.perf_counter() - start, None
+    except sqlite3.Error:
+        return ERROR, time.perf_counter() - start, None
+
+    return SUCCESS, time.perf_counter() - start, len(rows)
+
+
+def benchmark_query(dataset: Dataset, sql: str, db_id: str, warmup: int, repeats: int) -> dict:
+    """
+    Measure one cold-cache and repeats warm-cache executions of a query.
+
+    The cold run uses a newly opened connection, so SQLite's page cache is
+    empty; pages may still be in the operating system's file cache. The warm
+    runs use the pooled connection of the dataset after warmup untimed runs.
+    A query that fails or times out is not repeated.
+    """
+    db_path = dataset.get_db_path(db_id)
+    timeout = dataset.gold_sql_timeout
+
+    conn = dataset.connection_pool.connect(db_path)
+    try:
+        outcome, cold_time, row_count = time_query(conn, sql, timeout)
+    finally:
+        conn.close()
+
+    warm_times = []
+    if outcome == SUCCESS:
+        conn = dataset.connection_pool.get_connection(db_id, db_path)
+        for _ in range(warmup):
+            time_query(conn, sql, timeout)
+        for _ in range(repeats):
+            conn = dataset.connection_pool.get_connection(db_id, db_path)
+            _, elapsed, _ = time_query(conn, sql, timeout)
+            warm_times.append(elapsed)
+
+    return {
+        "outcome": outcome,
+        "row_count": row_count,
+        "cold": cold_time,
+        "warm": summarize(warm_times),
+        "warm_times": warm_times
+    }
+
+
+def explain_query_plan(dataset: Dataset, sql: str, db_id: str) -> list:
+    """
+    Return the EXPLAIN QUERY PLAN rows of a query as (id, parent, detail) lists.
+    """
+    conn = dataset.connection_pool.get_connection(db_id, dataset.get_db_path(db_id))
+    try:
+        return [[row[0], row[1], row[3]] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    except sqlite3.Error as err:
+        return [[0, 0, "error: " + str(err)]]
+
+
+def group_summary(queries: list, key: str) -> dict:
+    """
+    Summarize the cold timings and the warm p50 timings of the successful queries per value of key.
+    """
+    groups = {}
+    for query in queries:
+        if query["outcome"] == SUCCESS:
+            groups.setdefault(query[key], []).append(query)
+
+    return {
+        name: {
+            "cold": summarize([query["cold"] for query in group]),
+            "warm": summarize([query["warm"]["p50"] for query in group])
+        }
+        for name, group in sorted(groups.items())
+    }
+
+
+def compare_with_baseline(queries: list, baseline: dict) -> dict:
+    """
+    Compare the warm p50 timing of every query with the same query of a baseline report.
+
+    Returns:
+        dict: The speedup (baseline time / new time) per query index and summarized over all queries.
+    """
+    baseline_queries = {(query["db_id"], query["sql"]): query for query in baseline["queries"]}
+
+    speedups = {}
+    for query in queries:
+        previous = baseline_queries.get((query["db_id"], query["sql"]))
+        if previous is None or query["outcome"] != SUCCESS or previous["outcome"] != SUCCESS:
+            continue
+        if query["warm"]["p50"] > 0:
+            speedups[query["index"]] = previous["warm"]["p50"] / query["warm"]["p50"]
+
+    return {
+        "speedup": summarize(list(speedups.values())),
+        "queries": speedups
+    }
+
 
 def main():
-    wandb.init(
-        project=config.project,
-        config=config,
-        name= config.current_experiment,
-        entity=config.entity
-    )
-
-    wandb.define_metric("gold_sql_execution_time", summary="last")
-    wandb.define_metric("gold_sql_execution_time", summary="mean")
-    
-    llm = ChatOpenAI(
-        openai_api_key=api_key, 
-        model_name=config.llm_settings.model,
-        temperature=config.llm_settings.temperature,
-        request_timeout=config.llm_settings.request_timeout
-    )
-
-    questions = load_json(QUESTIONS_PATH)
-    questions = [question for question in questions if question['db_id'] in config.domains]
-    #questions = [question for question in questions if question['difficulty'] in config.difficulties]
-    
-    data_loader = Dataset()    
-    for i, row in enumerate(questions):        
-        golden_sql = row['SQL']
-        db_id = row['db_id']
-        data_loader.execute_query(golden_sql, db_id)
-
-    wandb.finish()
+    opt = parse_option()
+    if opt.repeats < 1:
+        raise ValueError("repeats must be at least 1")
+
+    dataset = get_dataset(opt.dataset)
+
+    no_data_points = dataset.get_number_of_data_points()
+    queries = []
+    for step, i in enumerate(dataset.get_schedule()):
+        data_point = dataset.get_data_point(i)
+        golden_sql = data_point['SQL']
+        db_id = data_point['db_id']
+
+        timing = benchmark_query(dataset, golden_sql, db_id, opt.warmup, opt.repeats)
+        queries.append({
+            "index": i,
+            "db_id": db_id,
+            "difficulty": data_point.get('difficulty', ""),
+            "sql": golden_sql,
+            **timing
+        })
+
+        print("Percentage done: ", round(step / no_data_points * 100, 2), "% Domain: ", db_id,
+              " Outcome: ", timing["outcome"], " Warm p50: ", timing["warm"]["p50"])
+
+    successful = [query for query in queries if query["outcome"] == SUCCESS]
+    slowest = sorted(successful, key=lambda query: query["warm"]["p50"], reverse=True)[:opt.slowest]
+
+    report = {
+        "dataset": opt.dataset,
+        "settings": {
+            "warmup": opt.warmup,
+            "repeats": opt.repeats,
+            "connection_profile": dataset.connection_pool.profile,
+            "gold_sql_timeout": dataset.gold_sql_timeout
+        },
+        "outcomes": {outcome: sum(query["outcome"] == outcome for query in queries)
+                     for outcome in (SUCCESS, ERROR, TIMEOUT)},
+        "overall": {
+            "cold": summarize([query["cold"] for query in successful]),
+            "warm": summarize([query["warm"]["p50"] for query in successful])
+        },
+        "domains": group_summary(queries, "db_id"),
+        "difficulties": group_summary(queries, "difficulty"),
+        "slowest": [
+            {
+                "index": query["index"],
+                "db_id": query["db_id"],
+                "warm_p50": query["warm"]["p50"],
+                "query_plan": explain_query_plan(dataset, query["sql"], query["db_id"])
+            }
+            for query in slowest
+        ],
+        "queries": queries
+    }
+
+    if opt.baseline_path is not None:
+        report["baseline"] = compare_with_baseline(queries, load_json(opt.baseline_path))
+        print("Speedup over baseline: ", report["baseline"]["speedup"])
+
+    output_dir = os.path.dirname(opt.output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(opt.output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    print("Outcomes: ", report["outcomes"])
+    print("Cold: ", report["overall"]["cold"])
+    print("Warm: ", report["overall"]["warm"])
+    print("Report written to ", opt.output_path)
 
+    dataset.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -5,6 +5,7 @@ from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from langchain.callbacks import get_openai_callback
 from utils.timer import Timer
+from utils.llm_cache import CachedChain, LLMResponseCache
 import logging
 
 from config import api_key, load_config
@@ -204,7 +205,10 @@ class Classifier():
     last_call_execution_time = 0
     total_call_execution_time = 0
 
-    def __init__(self, llm):        
+    # Part of the LLM response cache key, bump it when a prompt changes meaning
+    PROMPT_VERSION = "1"
+
+    def __init__(self, llm, response_cache=None):        
         self.llm = llm
 
         self.reasoning_template = LOGICAL_REASONING_PROMPT
@@ -212,7 +216,7 @@ class Classifier():
             input_variables=["question", "database_schema", "evidence"],
             template=self.reasoning_template,
         )
-        self.reasoning_chain = LLMChain(llm=llm, prompt=prompt)
+        self.reasoning_chain = CachedChain(LLMChain(llm=llm, prompt=prompt), response_cache, self.PROMPT_VERSION)
 
         self.classification_template = QUESTION_CLASSIFICATION_PROMPT
         prompt = PromptTemplate(            
@@ -220,7 +224,7 @@ class Classifier():
             # input_variables=["question", "thoughts"],
             template=self.classification_template,
         )
-        self.classification_chain = LLMChain(llm=llm, prompt=prompt)
+        self.classification_chain = CachedChain(LLMChain(llm=llm, prompt=prompt), response_cache, self.PROMPT_VERSION)
 
 
     def classify_question(self, question, schema, evidence):
@@ -284,7 +288,8 @@ def main():
     )
 
     dataset = get_dataset("BIRDCorrectedFinancialGoldAnnotated")
-    classifier = Classifier(llm)
+    response_cache = LLMResponseCache.from_config(config)
+    classifier = Classifier(llm, response_cache)
 
     no_data_points = dataset.get_number_of_data_points()
 
@@ -293,7 +298,7 @@ def main():
     tn = 0
     fn = 0
     
-    for i in range(no_data_points):
+    for step, i in enumerate(dataset.get_schedule()):
         data_point = dataset.get_data_point(i)
         evidence = data_point['evidence']
         db_id = data_point['db_id']            
@@ -324,7 +329,7 @@ def main():
             "completion_tokens": classifier.completion_tokens,
             "total_cost": classifier.total_cost,
             "openAPI_call_execution_time": classifier.last_call_execution_time,
-        }, step=i+1)
+        }, step=step+1)
     
         print("Predicted quality: ", classified_quality, " Annotated quality: ", " ".join(map(str, annotated_question_quality)))
         
@@ -343,6 +348,7 @@ def main():
     wandb.run.summary["total_cost"]                         = classifier.total_cost
     wandb.run.summary['total_predicted_execution_time']     = dataset.total_predicted_execution_time
     wandb.run.summary['total_openAPI_execution_time']       = classifier.total_call_execution_time
+    wandb.run.summary['llm_response_cache']                 = response_cache.get_stats()
 
     artifact.add(table, "query_results")
     wandb.log_artifact(artifact)
@@ -4,8 +4,13 @@ from datasets import get_dataset
 from langchain.chat_models import ChatOpenAI
 from config import api_key, load_config
 from sql_agents.zero_shot import ZeroShotAgent
+from utils.llm_cache import LLMResponseCache
+from scheduling import LatencyRecorder
+from async_runner import AsyncRunner
+from evaluation import ParallelEvaluator
 import wandb
 from box import Box
+from collections import Counter
 # langchain.verbose = True
 
 # If you don't want your script to sync to the cloud
@@ -24,6 +29,17 @@ def main():
         "model_name": "gpt-3.5-turbo",
         "temperature": 0,
         "request_timeout": 60,
+        # Context window of the model and the tokens reserved for the answer, the schema is reduced to fit the rest
+        "token_limit": 4096,
+        "max_response_length": 1024,
+
+        # LLM response cache: read_through, write_only, replay_only or bypass
+        "llm_cache_mode": "write_only",
+
+        # Requests in flight and OpenAI rate limits of the account, None for no limit
+        "concurrency": 1,
+        "requests_per_minute": 3500,
+        "tokens_per_minute": 90000,
 
         # Dataset choice
         # "dataset": "Spider",
@@ -52,70 +68,123 @@ def main():
         openai_api_key=api_key, 
         model_name=config.model_name,
         temperature=config.temperature,
-        request_timeout=config.request_timeout
+        request_timeout=config.request_timeout,
+        max_retries=0 # Retried by the AsyncRunner
     )
 
     
-    zero_shot_agent = ZeroShotAgent(llm)
+    response_cache = LLMResponseCache.from_config(config)
+    zero_shot_agent = ZeroShotAgent(llm, response_cache)
 
     wandb.config['prompt'] = zero_shot_agent.prompt_template
     
     no_data_points = dataset.get_number_of_data_points()
     score = 0
     accuracy = 0
-    for i in range(no_data_points):
+    latency_recorder = LatencyRecorder()
+    runner = AsyncRunner.from_config(config)
+    evaluator = ParallelEvaluator(dataset)
+
+    budgeted_schemas = {}
+    schema_degradations = Counter()
+
+    def get_inputs(i):
         data_point = dataset.get_data_point(i)
+        question = data_point['question']
         evidence = data_point['evidence']
+
+        if i not in budgeted_schemas:
+            include_descriptions = (config.dataset == "BIRD" or 
+                config.dataset == "BIRDFixedFinancial" or 
+                config.dataset == "BIRDExperimentalFinancial" or 
+                config.dataset == "BIRDFixedFinancialGoldSQL")
+
+            budget = zero_shot_agent.get_schema_budget(config.token_limit, config.max_response_length, question, evidence)
+            budgeted_schemas[i] = dataset.get_budgeted_schema(
+                data_point['db_id'], budget, config.model_name, question, evidence, include_descriptions)
+
+        budgeted_schema = budgeted_schemas[i]
+        return budgeted_schema.schema + budgeted_schema.descriptions, question, evidence
+
+    def estimate(i):
+        return zero_shot_agent.LLM_CALLS_PER_QUESTION, zero_shot_agent.estimate_tokens(*get_inputs(i))
+
+    # The queries are evaluated on a worker thread, so the calls of the other questions go on meanwhile
+    async def generate(i):
+        predicted_sql, usage = await zero_shot_agent.agenerate_query(*get_inputs(i))
+        data_point = dataset.get_data_point(i)
+        evaluation = await evaluator.aevaluate(predicted_sql, data_point['SQL'], data_point['db_id'])
+        return predicted_sql, usage, evaluation
+
+    # Called in schedule order, so the totals and wandb steps do not depend on the concurrency
+    def on_result(step, i, result):
+        nonlocal score, accuracy
+        predicted_sql, usage, evaluation = result
+        zero_shot_agent.add_usage(usage)
+        budgeted_schema = budgeted_schemas.pop(i)
+        schema_degradations.update(budgeted_schema.steps)
+
+        data_point = dataset.get_data_point(i)
         golden_sql = data_point['SQL']
         db_id = data_point['db_id']            
         question = data_point['question']
         difficulty = data_point['difficulty'] if 'difficulty' in data_point else ""
-        
-        sql_schema = dataset.get_schema_and_sample_data(db_id)        
-        
-        if (config.dataset == "BIRD" or 
-            config.dataset == "BIRDFixedFinancial" or 
-            config.dataset == "BIRDExperimentalFinancial" or 
-            config.dataset == "BIRDFixedFinancialGoldSQL"):
-
-            bird_table_info = dataset.get_bird_table_info(db_id)
-            sql_schema = sql_schema + bird_table_info            
-        else:
-            bird_table_info = ""
-        
-        
-
-        predicted_sql = zero_shot_agent.generate_query(sql_schema, question, evidence)   
-        success = dataset.execute_queries_and_match_data(predicted_sql, golden_sql, db_id)
+
+        dataset.record_evaluation_result(evaluation)
+        success = evaluation.success
 
         score += success
-        accuracy = score / (i + 1)
+        accuracy = score / (step + 1)
+
+        # A response from the LLM cache says nothing about the latency of the question
+        if not zero_shot_agent.last_call_cached:
+            latency_recorder.record(question, zero_shot_agent.last_call_execution_time + dataset.last_predicted_execution_time)
 
         table.add_data(question, golden_sql, predicted_sql, success, difficulty)
-        wandb.log({
+        log_data = {
             "accuracy": accuracy,
             "total_tokens": zero_shot_agent.total_tokens,
             "prompt_tokens": zero_shot_agent.prompt_tokens,
+            "estimated_prompt_tokens": zero_shot_agent.estimated_prompt_tokens,
+            "schema_tokens": budgeted_schema.tokens,
+            "dropped_tables": len(budgeted_schema.dropped_tables),
             "completion_tokens": zero_shot_agent.completion_tokens,
             "total_cost": zero_shot_agent.total_cost,
             "openAPI_call_execution_time": zero_shot_agent.last_call_execution_time,
             "predicted_sql_execution_time": dataset.last_predicted_execution_time,
             "gold_sql_execution_time": dataset.last_gold_execution_time
-        }, step=i+1)
+        }
+        if dataset.report_question_index():
+            log_data["question_index"] = i
+        wandb.log(log_data, step=step+1)
     
-        print("Percentage done: ", round(i / no_data_points * 100, 2), "% Domain: ", 
+        print("Percentage done: ", round(step / no_data_points * 100, 2), "% Domain: ", 
               db_id, " Success: ", success, " Accuracy: ", accuracy)
-        
+
+    runner.run(list(dataset.get_schedule()), generate, on_result, estimate)
+    evaluator.close()
     
+    latency_recorder.save(dataset.get_latency_history_path())
+
     wandb.run.summary['number_of_questions']                = dataset.get_number_of_data_points()
     wandb.run.summary["accuracy"]                           = score / no_data_points
     wandb.run.summary["total_tokens"]                       = zero_shot_agent.total_tokens
     wandb.run.summary["prompt_tokens"]                      = zero_shot_agent.prompt_tokens
+    wandb.run.summary["estimated_prompt_tokens"]            = zero_shot_agent.estimated_prompt_tokens
+    wandb.run.summary["schema_degradations"]                = dict(schema_degradations)
     wandb.run.summary["completion_tokens"]                  = zero_shot_agent.completion_tokens
     wandb.run.summary["total_cost"]                         = zero_shot_agent.total_cost
+    wandb.run.summary["cached_calls"]                       = zero_shot_agent.cached_calls
     wandb.run.summary['total_predicted_execution_time']     = dataset.total_predicted_execution_time
     wandb.run.summary['total_gold_execution_time']          = dataset.total_gold_execution_time
+    wandb.run.summary['connection_pool']                    = dataset.get_connection_pool_stats()
+    wandb.run.summary['predicted_sql_outcomes']             = dict(dataset.predicted_outcomes)
+    wandb.run.summary['gold_sql_outcomes']                  = dict(dataset.gold_outcomes)
+    if dataset.gold_result_cache is not None:
+        wandb.run.summary['gold_result_cache']              = dataset.gold_result_cache.get_stats()
     wandb.run.summary['total_openAPI_execution_time']       = zero_shot_agent.total_call_execution_time
+    wandb.run.summary['llm_response_cache']                 = response_cache.get_stats()
+    wandb.run.summary['async_runner']                       = runner.get_stats()
 
     artifact.add(table, "query_results")
     wandb.log_artifact(artifact)
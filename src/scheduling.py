@@ -0,0 +1,94 @@
+
+import os
+import json
+from utils.utils import load_json
+
+
+FILE_ORDER = "file"
+DATABASE_ORDER = "database"
+LONGEST_FIRST_ORDER = "longest_first"
+QUESTION_ORDERS = (FILE_ORDER, DATABASE_ORDER, LONGEST_FIRST_ORDER)
+
+
+def schedule_by_database(data_points: list) -> list:
+    """
+    Order questions so that all questions on the same database are consecutive.
+
+    Databases appear in the order of their first question and the questions of
+    each database keep their file order, so every database is loaded once.
+
+    Parameters:
+        data_points (list): The data points in file order.
+
+    Returns:
+        list: The question indices in scheduled order.
+    """
+    groups = {}
+    for index, data_point in enumerate(data_points):
+        groups.setdefault(data_point['db_id'], []).append(index)
+
+    return [index for indices in groups.values() for index in indices]
+
+
+def schedule_longest_first(data_points: list, latency_history: dict) -> list:
+    """
+    Order questions by their expected latency, longest first.
+
+    Starting the longest questions first keeps a single slow question from
+    finishing last when questions run in parallel. Questions without a recorded
+    latency are expected to take the mean recorded latency. Ties keep the
+    database grouping of schedule_by_database.
+
+    Parameters:
+        data_points (list): The data points in file order.
+        latency_history (dict): Recorded latency in seconds per question text.
+
+    Returns:
+        list: The question indices in scheduled order.
+    """
+    known = [latency_history[data_point['question']] for data_point in data_points
+             if data_point['question'] in latency_history]
+    default_latency = sum(known) / len(known) if known else 0
+
+    grouped = schedule_by_database(data_points)
+    position = {index: i for i, index in enumerate(grouped)}
+
+    def expected_latency(index):
+        return latency_history.get(data_points[index]['question'], default_latency)
+
+    return sorted(grouped, key=lambda index: (-expected_latency(index), position[index]))
+
+
+def load_latency_history(path: str) -> dict:
+    """
+    Load recorded per-question latencies, an empty history if the file does not exist.
+    """
+    if path is None or not os.path.exists(path):
+        return {}
+    return load_json(path)
+
+
+class LatencyRecorder:
+    """
+    Records the latency of each question of a run so later runs can be scheduled by it.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+
+    def record(self, question: str, latency: float) -> None:
+        self.latencies[question] = latency
+
+    def save(self, path: str) -> None:
+        """
+        Merge the recorded latencies into the history file, replacing older values.
+        """
+        history = load_latency_history(path)
+        history.update(self.latencies)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(history, f, ensure_ascii=False, indent=4)
@@ -1,7 +1,6 @@
 import json
 import argparse
 import openai
-import time
 from tqdm import tqdm
 from collections import Counter
 
@@ -12,10 +11,12 @@ import wandb
 import sys
 sys.path.append('/Users/fredrik/code/project/Text-to-SQL-Generation/src')
 from config import api_key, load_config
+from utils.resilient_client import ResilientClient
 
 # add your openai api key
 openai.api_key = os.environ.get('OPENAI_API_KEY')
 log_cost = 0
+api_client = ResilientClient()
 
 def parse_option():
     parser = argparse.ArgumentParser("command line arguments for recall columns")
@@ -32,7 +33,7 @@ def parse_option():
 
 
 def generate_reply(input, sc_num, index):
-    completions = openai.ChatCompletion.create(
+    completions = api_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=input,
         temperature=0.7,
@@ -192,6 +193,7 @@ Explain why you choose each column.
 
 if __name__ == "__main__":
     config = load_config("/Users/fredrik/code/project/Text-to-SQL-Generation/config/c3_config.yaml")
+    api_client = ResilientClient.from_config(config)
 
     wandb.init(
     project=config.project,
@@ -222,14 +224,9 @@ if __name__ == "__main__":
         prompt += "\nQuestion:\n### " + data["question"]
         # print(prompt)
         tabs_cols_all = None
+        # None if a reply could not be parsed, then sample again
         while tabs_cols_all is None:
-            try:
-                tabs_cols_all = generate_reply([{"role": "user", "content": prompt}], sc_num, i)
-            except:
-                print("column_recall")
-                print(f'api error, wait for 3 seconds and retry...')
-                time.sleep(3)
-                pass
+            tabs_cols_all = generate_reply([{"role": "user", "content": prompt}], sc_num, i)
         tab_col_ori = {}
         for table in data['db_schema']:
             tab_col_ori[table['table_name_original'].lower()] = table['column_names_original']
@@ -239,3 +236,6 @@ if __name__ == "__main__":
         # print(res)
         with open(opt.output_recalled_columns_path, 'w') as f:
             json.dump(res, f, indent=2)
+
+    wandb.run.summary["column_recall_api"] = api_client.get_stats()
+    print('API stats: ', api_client.get_stats())
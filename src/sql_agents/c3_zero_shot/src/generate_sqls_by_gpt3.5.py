@@ -19,6 +19,7 @@ import os
 from langchain.chat_models import ChatOpenAI
 from agents.din_sql import DinSQLAgent
 from config import api_key, load_config
+from utils.resilient_client import ResilientClient
 import wandb
 import langchain
 langchain.verbose = False
@@ -27,6 +28,7 @@ langchain.verbose = False
 # add your openai api key
 openai.api_key = os.environ.get('OPENAI_API_KEY')
 log_cost = 0
+api_client = ResilientClient()
 
 spiderDataset=SpiderDataset()
 
@@ -97,7 +99,7 @@ def parse_option():
 
 
 def generate_reply(messages, n,index, type):
-    completions = openai.ChatCompletion.create(
+    completions = api_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=messages,
         n=n,
@@ -183,7 +185,9 @@ def is_valid(sql, db_path):
         return 1
 
 def main():
+    global api_client
     config = load_config("/Users/fredrik/code/project/Text-to-SQL-Generation/config/c3_config.yaml")
+    api_client = ResilientClient.from_config(config)
 
     wandb.init(
     project=config.project,
@@ -245,17 +249,7 @@ def main():
                 messages = chat_prompt.copy()
                 input = item['input_sequence']
                 messages.append({"role": "user", "content": input})
-                reply = None
-                while reply is None:
-                    try:
-                        reply = generate_reply(messages, opt.n, i, type="normal")
-                    except Exception as e:
-                        print("main_file")
-                        print(e)
-                        print(f"api error, wait for 3 seconds and retry...")
-                        time.sleep(3)
-                        pass
-                p_sqls = reply
+                p_sqls = generate_reply(messages, opt.n, i, type="normal")
                 temp = []
                 for p_sql in p_sqls:
                     p_sql = 'SELECT ' + p_sql
@@ -306,6 +300,7 @@ def main():
             print('current accuracy: ', accuracy)
             wandb.log({"accuracy": accuracy}, step=index+1)
         wandb.run.summary["accuracy"] = accuracy
+        wandb.run.summary["text_to_sql_api"] = api_client.get_stats()
         artifact.add(table, "query_results")
         wandb.log_artifact(artifact)
 
@@ -1,7 +1,6 @@
 import json
 import argparse
 import openai
-import time
 from tqdm import tqdm
 from collections import Counter
 import os
@@ -10,11 +9,13 @@ import wandb
 import sys
 sys.path.append('/Users/fredrik/code/project/Text-to-SQL-Generation/src')
 from config import load_config
+from utils.resilient_client import ResilientClient
 
 
 # add your openai api key
 openai.api_key = os.environ.get('OPENAI_API_KEY')
 log_cost = 0
+api_client = ResilientClient()
 
 def parse_option():
     parser = argparse.ArgumentParser("command line arguments for recall tables")
@@ -31,7 +32,7 @@ def parse_option():
 
 def generate_reply(input, sc_num, index):
     
-    completions = openai.ChatCompletion.create(
+    completions = api_client.chat_completion(
         model="gpt-3.5-turbo",
         messages=input,
         # top_p=0.5
@@ -134,6 +135,7 @@ instruction = """Given the database schema and question, perform the following a
 
 if __name__ == "__main__":
     config = load_config("/Users/fredrik/code/project/Text-to-SQL-Generation/config/c3_config.yaml")
+    api_client = ResilientClient.from_config(config)
 
     wandb.init(
     project=config.project,
@@ -159,14 +161,9 @@ if __name__ == "__main__":
         prompt = instruction + "Schema:\n" + schema + "\n"
         prompt += "Question:\n" + data["question"]
         tables_all = None
+        # None if a reply could not be parsed, then sample again
         while tables_all is None:
-            try:
-                tables_all = generate_reply([{"role": "user", "content": prompt}], sc_num, i)
-            except:
-                print("table_recall")
-                print(f'api error, wait for 3 seconds and retry...')
-                time.sleep(3)
-                pass
+            tables_all = generate_reply([{"role": "user", "content": prompt}], sc_num, i)
         tables_ori = []
         for table in data['db_schema']:
             tables_ori.append(table['table_name_original'].lower())
@@ -174,7 +171,8 @@ if __name__ == "__main__":
         info = info_generate(tables, data)
         res.append(info)
 
-    
+    wandb.run.summary["table_recall_api"] = api_client.get_stats()
+    print('API stats: ', api_client.get_stats())
     wandb.finish()
     with open(opt.output_recalled_tables_path, 'w') as f:
         json.dump(res, f, indent=2)
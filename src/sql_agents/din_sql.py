@@ -1,10 +1,13 @@
-
-
 from sql_agents.zero_shot import ZeroShotAgent
 import re
+import asyncio
 from typing import List, Tuple
 from utils.timer import Timer
-from langchain.callbacks import get_openai_callback
+from utils.llm_cache import CachedChain
+from utils.stage_metrics import StageLedger, sum_stage_usage
+from utils.schema_pruning import get_linked_tables
+from utils.stage_pipeline import PipelineStage, StagePipeline, get_question_key
+from utils.prompt_compiler import compile_template, get_template_report
 from langchain.chains import LLMChain
 from langchain.prompts import (
     ChatPromptTemplate,
@@ -1092,156 +1095,448 @@ SQL: {sql_query}
 A: Let's think step by step to find the correct answer."""
 
 
+# Speculative generation modes: start the generation call alongside the classification
+SPECULATION_OFF = "off"
+SPECULATION_PREDICTED = "predicted"  # only the branch predicted by predict_label
+SPECULATION_ALL = "all"  # both the easy and non-nested branches
+
+# Phrasings that usually need a subquery, set operation or comparison with an aggregate
+NESTED_PATTERN = re.compile(
+    r"\b(not in|except|never|none of|neither|without any|more than (?:the )?average|less than (?:the )?average|"
+    r"(?:above|below|higher than|lower than|greater than) (?:the )?average|than the average|"
+    r"more than (?:any|all)|all of the|both .+ and)\b",
+    re.IGNORECASE)
+
+
+def predict_label(question: str, hint: str, schema_links: List[str]) -> str:
+    """
+    Predict the DIN-SQL classification label of a question without calling the model.
+
+    NESTED when the question has a phrasing that usually needs a subquery,
+    NON-NESTED when the schema links span more than one table, EASY otherwise.
+    """
+    if NESTED_PATTERN.search(question or ""):
+        return "NESTED"
+    if len(get_linked_tables(schema_links)) > 1:
+        return "NON-NESTED"
+    return "EASY"
+
+
+# The few-shot system prompts of the stages
+SYSTEM_TEMPLATES = {
+    "schema_linking": SYSTEM_SCHEMA_LINKING_TEMPLATE,
+    "classification": SYSTEM_CLASSIFICATION_TEMPLATE,
+    "easy": SYSTEM_EASY_CLASS_TEMPLATE,
+    "non_nested": SYSTEM_NON_NESTED_CLASS_TEMPLATE,
+    "nested": SYSTEM_NESTED_CLASS_TEMPLATE,
+    "self_correction": SYSTEM_SELF_CORRECTION_PROMPT
+}
+
+
 class DinSQLAgent(ZeroShotAgent):
-    def __init__(self, llm):
+    # Schema linking, classification, generation and self-correction
+    LLM_CALLS_PER_QUESTION = 4
+
+    def __init__(self, llm, response_cache=None, speculation=SPECULATION_OFF, correction_gate=None, schema_pruner=None,
+                 stage_store=None, compact_prompts=False):
+        """
+        Parameters:
+            llm: The chat model of all calls.
+            response_cache (LLMResponseCache): The cache of LLM responses, None for no caching.
+            speculation (str): off, predicted or all, see agenerate_query.
+            correction_gate (SQLValidator): Sends only the queries it finds invalid to the self-correction, None to send all.
+            schema_pruner (callable): Returns the PrunedSchema of a database and schema links for the
+                stages after the schema linking, see Dataset.get_pruned_schema. None to give every stage the full schema.
+            stage_store (StageStore): Checkpoints the output of every LLM stage, None to run every stage.
+            compact_prompts (bool): Render the example schemas of the system prompts compactly, see utils.prompt_compiler.
+        """
         self.llm = llm
-
-        system_schema_linking_prompt = SystemMessagePromptTemplate.from_template(SYSTEM_SCHEMA_LINKING_TEMPLATE)  
+        self.compact_prompts = compact_prompts
+        self.correction_gate = correction_gate
+        self.schema_pruner = schema_pruner
+        # Wall time, tokens and cost of every call, per stage
+        self.stage_ledger = StageLedger()
+
+        if speculation not in (SPECULATION_OFF, SPECULATION_PREDICTED, SPECULATION_ALL):
+            raise ValueError(f"Unknown speculation mode {speculation}, expected off, predicted or all")
+        self.speculation = speculation
+        if speculation == SPECULATION_PREDICTED:
+            self.LLM_CALLS_PER_QUESTION = 5
+        elif speculation == SPECULATION_ALL:
+            self.LLM_CALLS_PER_QUESTION = 6
+
+        system_schema_linking_prompt = SystemMessagePromptTemplate.from_template(self.compile_template(SYSTEM_SCHEMA_LINKING_TEMPLATE))  
         human_schema_linking_prompt = HumanMessagePromptTemplate.from_template(HUMAN_SCHEMA_LINKING_TEMPLATE)
         self.schema_linking_prompt = ChatPromptTemplate.from_messages([system_schema_linking_prompt, human_schema_linking_prompt])
-        self.schema_link_chain = LLMChain(llm=self.llm, prompt=self.schema_linking_prompt)
+        self.schema_link_chain = CachedChain(LLMChain(llm=self.llm, prompt=self.schema_linking_prompt), response_cache, self.PROMPT_VERSION)
 
-        system_classification_prompt = SystemMessagePromptTemplate.from_template(SYSTEM_CLASSIFICATION_TEMPLATE) 
+        system_classification_prompt = SystemMessagePromptTemplate.from_template(self.compile_template(SYSTEM_CLASSIFICATION_TEMPLATE)) 
         human_classification_prompt = HumanMessagePromptTemplate.from_template(HUMAN_CLASSIFICATION_TEMPLATE) 
         self.classification_prompt = ChatPromptTemplate.from_messages([system_classification_prompt, human_classification_prompt])
-        self.classification_chain = LLMChain(llm=self.llm, prompt=self.classification_prompt)
+        self.classification_chain = CachedChain(LLMChain(llm=self.llm, prompt=self.classification_prompt), response_cache, self.PROMPT_VERSION)
 
-        system_easy_prompt = SystemMessagePromptTemplate.from_template(SYSTEM_EASY_CLASS_TEMPLATE) 
+        system_easy_prompt = SystemMessagePromptTemplate.from_template(self.compile_template(SYSTEM_EASY_CLASS_TEMPLATE)) 
         human_easy_prompt = HumanMessagePromptTemplate.from_template(HUMAN_EASY_CLASS_TEMPLATE)  
         self.easy_prompt = ChatPromptTemplate.from_messages([system_easy_prompt, human_easy_prompt])  
-        self.easy_chain = LLMChain(llm=self.llm, prompt=self.easy_prompt)      
+        self.easy_chain = CachedChain(LLMChain(llm=self.llm, prompt=self.easy_prompt), response_cache, self.PROMPT_VERSION)      
 
-        system_medium_prompt = SystemMessagePromptTemplate.from_template(SYSTEM_NON_NESTED_CLASS_TEMPLATE)  
+        system_medium_prompt = SystemMessagePromptTemplate.from_template(self.compile_template(SYSTEM_NON_NESTED_CLASS_TEMPLATE))  
         human_medium_prompt = HumanMessagePromptTemplate.from_template(HUMAN_NON_NESTED_CLASS_TEMPLATE)  
         self.medium_prompt = ChatPromptTemplate.from_messages([system_medium_prompt, human_medium_prompt])  
-        self.medium_chain = LLMChain(llm=self.llm, prompt=self.medium_prompt)      
+        self.medium_chain = CachedChain(LLMChain(llm=self.llm, prompt=self.medium_prompt), response_cache, self.PROMPT_VERSION)      
 
-        system_hard_prompt = SystemMessagePromptTemplate.from_template(SYSTEM_NESTED_CLASS_TEMPLATE)  
+        system_hard_prompt = SystemMessagePromptTemplate.from_template(self.compile_template(SYSTEM_NESTED_CLASS_TEMPLATE))  
         human_hard_prompt = HumanMessagePromptTemplate.from_template(HUMAN_NESTED_CLASS_TEMPLATE)  
         self.hard_prompt = ChatPromptTemplate.from_messages([system_hard_prompt, human_hard_prompt])
-        self.hard_chain = LLMChain(llm=self.llm, prompt=self.hard_prompt)
+        self.hard_chain = CachedChain(LLMChain(llm=self.llm, prompt=self.hard_prompt), response_cache, self.PROMPT_VERSION)
 
-        system_correction_prompt = SystemMessagePromptTemplate.from_template(SYSTEM_SELF_CORRECTION_PROMPT)  
+        system_correction_prompt = SystemMessagePromptTemplate.from_template(self.compile_template(SYSTEM_SELF_CORRECTION_PROMPT))  
         human_correction_prompt = HumanMessagePromptTemplate.from_template(HUMAN_SELF_CORRECTION_PROMPT)  
         self.correction_prompt = ChatPromptTemplate.from_messages([system_correction_prompt, human_correction_prompt])  
-        self.correction_chain = LLMChain(llm=self.llm, prompt=self.correction_prompt)
-
-
-    def generate_query(self, database_schema, column_descriptions, hint, question):
-        # Do schema linking
-        with get_openai_callback() as cb:
-            with Timer() as t:
-                schema_linking = self.schema_link_chain.run(
-                    question=question, 
-                    schema=database_schema, 
-                    hint=hint, 
-                    columns_descriptions=column_descriptions
-                )
-
-                logging.debug("Schema linking LLM Output: \n" + schema_linking)
-
-                schema_links = self.extract_schema_links(schema_linking)
-
-                logging.debug("Schema links: \n" + " ".join(schema_links))
-            
-            self.last_call_execution_time = t.elapsed_time
-            self.total_call_execution_time += t.elapsed_time
-            self.total_tokens += cb.total_tokens
-            self.prompt_tokens += cb.prompt_tokens
-            self.total_cost += cb.total_cost
-            self.completion_tokens += cb.completion_tokens
-        
-        # Do classification
-        with get_openai_callback() as cb:            
-            classification = self.classification_chain.run(
-                question=question,
-                schema=database_schema,
-                hint=hint,
-                columns_descriptions=column_descriptions,
-                schema_links=schema_links)
-            
-            logging.debug("Classification LLM Output: \n" + classification)
-            label, sub_questions = self.extract_label_and_sub_questions(classification)
-            logging.debug("Extracted label: \n" + label)
-            logging.debug("Extracted subquestions: \n" + " ".join(sub_questions))
-
-            self.last_call_execution_time = t.elapsed_time
-            self.total_call_execution_time += t.elapsed_time
-            self.total_tokens += cb.total_tokens
-            self.prompt_tokens += cb.prompt_tokens
-            self.total_cost += cb.total_cost
-            self.completion_tokens += cb.completion_tokens
+        self.correction_chain = CachedChain(LLMChain(llm=self.llm, prompt=self.correction_prompt), response_cache, self.PROMPT_VERSION)
+
+        self.pipeline = StagePipeline(self.get_stages(), stage_store)
+
+
+    def compile_template(self, template: str) -> str:
+        return compile_template(template) if self.compact_prompts else template
+
+
+    def get_template_report(self, model: str = "gpt-3.5-turbo") -> dict:
+        """
+        Return the tokens of each system prompt as written and compiled, see utils.prompt_compiler.get_template_report.
+        """
+        return get_template_report(SYSTEM_TEMPLATES, model)
+
+
+    def get_stages(self) -> list:
+        """
+        Return the stages of a question, in order, as the declarative graph run by the StagePipeline.
+
+        The LLM stages are checkpointed, keyed by their prompt templates, model
+        and the state values they require. Schema pruning and the correction
+        gate read the database and are cheap, so they always run.
+        """
+        prompt_inputs = ("question", "schema", "hint", "columns_descriptions")
+        return [
+            PipelineStage("schema_linking", prompt_inputs, self.run_schema_linking,
+                          lambda state: self.schema_link_chain.get_config()),
+            PipelineStage("schema_pruning", (), self.run_schema_pruning, checkpoint=False),
+            PipelineStage("classification", prompt_inputs + ("schema_links",), self.run_classification,
+                          lambda state: self.classification_chain.get_config()),
+            PipelineStage("sql_generation", prompt_inputs + ("schema_links", "label", "sub_questions"),
+                          self.run_sql_generation,
+                          lambda state: self.get_generation_call(state["label"], [], [])[0].get_config()),
+            PipelineStage("correction_gate", (), self.run_correction_gate, checkpoint=False),
+            PipelineStage("self_correction", prompt_inputs + ("sql_query", "correction_needed"),
+                          self.run_self_correction, lambda state: self.correction_chain.get_config())
+        ]
+
+
+    def generate_query(self, database_schema, column_descriptions, hint, question, db_name=None):
+        """
+        Generate the query of a question with the DIN-SQL stages, adding their usage to the totals of the agent.
+
+        Runs agenerate_query to completion, so it cannot be called from a running event loop.
+        """
+        query, usage = asyncio.run(self.agenerate_query(database_schema, column_descriptions, hint, question, db_name))
+        self.add_usage(usage)
+        return query
         
-        # Do sql generation call (easy, medium or hard)
-        with get_openai_callback() as cb:
-            if "EASY" in label:                    
-                output = self.easy_chain.run(
-                    question=question,
-                    schema=database_schema,
-                    hint=hint,
-                    columns_descriptions=column_descriptions,
-                    schema_links=schema_links)
-                sql_query = self.extract_sql_query(output)
-            elif "NON-NESTED" in label:     
-                output = self.medium_chain.run(
-                    question=question,
-                    schema=database_schema,
-                    hint=hint,
-                    columns_descriptions=column_descriptions,
-                    schema_links=schema_links)
-                sql_query = self.extract_sql_query(output)
-            else:
-                output = self.hard_chain.run(
-                    question=question,
-                    schema=database_schema,
-                    hint=hint,
-                    columns_descriptions=column_descriptions,
-                    schema_links=schema_links,
-                    sub_questions=sub_questions)
-                sql_query = self.extract_sql_query(output)
-
-            logging.debug("LLM SQL Output: \n" + output)
-            if sql_query is not None:
-                logging.debug("Extracted SQL Query: \n" + sql_query)
-
-            self.last_call_execution_time = t.elapsed_time
-            self.total_call_execution_time += t.elapsed_time
-            self.total_tokens += cb.total_tokens
-            self.prompt_tokens += cb.prompt_tokens
-            self.total_cost += cb.total_cost
-            self.completion_tokens += cb.completion_tokens
-
-
-        # Do self-correction step
-        with get_openai_callback() as cb:
-            correction = self.correction_chain.run(
-                question=question,
-                schema=database_schema,
-                columns_descriptions=column_descriptions,
-                hint=hint,
-                sql_query=sql_query)
-            finall_sql = self.extract_revised_sql_query(correction)
-
-            self.last_call_execution_time = t.elapsed_time
-            self.total_call_execution_time += t.elapsed_time
-            self.total_tokens += cb.total_tokens
-            self.prompt_tokens += cb.prompt_tokens
-            self.total_cost += cb.total_cost
-            self.completion_tokens += cb.completion_tokens
 
+    async def agenerate_query(self, database_schema, column_descriptions, hint, question, db_name=None):
+        """
+        Generate the query of a question with the DIN-SQL stages, returning the query and the usage of the calls.
+
+        The stages (see get_stages) are schema linking, schema pruning,
+        classification, SQL generation, the correction gate and the
+        self-correction. With a stage store, the outputs of the LLM stages are
+        checkpointed, and a stage whose prompt and inputs did not change since
+        it was stored is not run again. usage["reused_stages"] lists them.
+
+        The usage holds the wall time of every stage that ran under "stages".
+
+        With the database of the question, the schema pruner reduces the schema
+        of the later stages to the linked tables, and the self-correction call
+        is skipped when the correction gate finds nothing wrong with the
+        generated query. usage["pruned_tables"] lists the tables the later
+        stages were given when the schema was pruned, and is None otherwise.
+
+        With speculation on, the easy and non-nested generation calls, which
+        only need the schema links, are started alongside the classification:
+        the branch predicted by predict_label, or both. The nested call also
+        needs the sub-questions of the classification, so it is never started
+        early. When the classification picks a started branch its result is
+        used and a round trip is saved, the other branches are cancelled or
+        their results discarded. usage["speculation"] is "hit", "miss" or None.
+
+        usage["correction"] is "skipped" when the correction gate let the
+        query through, "sent" when it went to the self-correction with the
+        gate's reasons in usage["correction_reasons"], and None without gate.
+        usage["skipped_correction_prompt_tokens"] estimates the prompt tokens a
+        skipped self-correction would have used.
+        """
+        state = {
+            "question": question,
+            "schema": database_schema,
+            "hint": hint,
+            "columns_descriptions": column_descriptions,
+            "db_name": db_name,
+            # StageUsage of the calls made, and the speculative generation calls in flight
+            "_stages": [],
+            "_speculative": {},
+            "_speculated": set()
+        }
+        with Timer() as t:
+            try:
+                reused_stages = await self.pipeline.arun(get_question_key(db_name, question, hint), state)
+            finally:
+                state["_stages"].extend(await self.discard_speculative_stages(state["_speculative"].values()))
+
+        usage = sum_stage_usage(state["_stages"], t.elapsed_time)
+        usage["reused_stages"] = reused_stages
+        usage["pruned_tables"] = state["pruned_tables"]
+        usage["speculation"] = None
+        if state["_speculated"]:
+            usage["speculation"] = "hit" if state["generation_stage"] in state["_speculated"] else "miss"
+
+        validation = state["validation"]
+        usage["correction"] = None
+        usage["correction_reasons"] = []
+        usage["skipped_correction_prompt_tokens"] = 0
+        if validation is not None:
+            valid, reasons = validation
+            usage["correction"] = "skipped" if valid else "sent"
+            usage["correction_reasons"] = reasons
+            if valid:
+                usage["skipped_correction_prompt_tokens"] = self.correction_chain.count_prompt_tokens(
+                    {**self.get_prompt_inputs(state), "sql_query": state["sql_query"]})
+
+        return self.get_final_query(state["correction"], state["sql_query"]), usage
+
+
+    def get_prompt_inputs(self, state) -> dict:
+        return {name: state[name] for name in ("question", "schema", "hint", "columns_descriptions")}
+
+
+    async def run_schema_linking(self, state) -> dict:
+        with self.stage_ledger.measure("schema_linking") as stage:
+            schema_linking = await self.schema_link_chain.arun(**self.get_prompt_inputs(state))
+        state["_stages"].append(stage)
+        return {"schema_linking": schema_linking, "schema_links": self.get_schema_links(schema_linking)}
+
+
+    async def run_schema_pruning(self, state) -> dict:
+        """
+        Reduce the schema and descriptions to the linked tables with the schema pruner.
+
+        The pruned schema is used only when it is shorter than the schema of
+        the question, which may already have been reduced to fit a token
+        budget.
+        """
+        if self.schema_pruner is None or state["db_name"] is None:
+            return {"pruned_tables": None}
+
+        with self.stage_ledger.measure("schema_pruning") as stage:
+            pruned = self.schema_pruner(state["db_name"], state["schema_links"])
+        state["_stages"].append(stage)
+
+        if pruned is None or len(pruned.schema) + len(pruned.descriptions) >= \
+                len(state["schema"]) + len(state["columns_descriptions"] or ""):
+            return {"pruned_tables": None}
+
+        logging.debug("Pruned schema to: " + ", ".join(pruned.tables))
+        return {"schema": pruned.schema, "columns_descriptions": pruned.descriptions, "pruned_tables": pruned.tables}
+
+
+    async def run_classification(self, state) -> dict:
+        # Speculative generation calls, used or discarded by run_sql_generation
+        for label in self.get_speculative_labels(state["question"], state["hint"], state["schema_links"]):
+            chain, stage_name, generation_inputs = self.get_generation_call(label, state["schema_links"], [])
+            state["_speculative"][stage_name] = asyncio.ensure_future(
+                self.arun_stage(stage_name, chain, {**self.get_prompt_inputs(state), **generation_inputs}))
+        state["_speculated"] = set(state["_speculative"])
+
+        with self.stage_ledger.measure("classification") as stage:
+            classification = await self.classification_chain.arun(
+                **self.get_prompt_inputs(state), schema_links=state["schema_links"])
+        state["_stages"].append(stage)
+        label, sub_questions = self.get_label_and_sub_questions(classification)
+        return {"classification": classification, "label": label, "sub_questions": sub_questions}
+
+
+    async def run_sql_generation(self, state) -> dict:
+        chain, stage_name, generation_inputs = self.get_generation_call(
+            state["label"], state["schema_links"], state["sub_questions"])
+        if stage_name in state["_speculative"]:
+            output, stage = await state["_speculative"].pop(stage_name)
+        else:
+            output, stage = await self.arun_stage(stage_name, chain, {**self.get_prompt_inputs(state), **generation_inputs})
+        state["_stages"].append(stage)
+        return {"generation_stage": stage_name, "sql_output": output, "sql_query": self.get_sql_query(output)}
+
+
+    async def run_correction_gate(self, state) -> dict:
+        """
+        Validate the generated query with the correction gate, when there is one and the database is known.
+
+        The dry run executes the query, so it runs on a worker thread while the other questions go on.
+        """
+        if self.correction_gate is None or state["db_name"] is None:
+            return {"validation": None, "correction_needed": True}
+
+        with self.stage_ledger.measure("correction_gate") as stage:
+            validation = await asyncio.to_thread(self.correction_gate.validate, state["sql_query"], state["db_name"])
+        state["_stages"].append(stage)
+        if not validation.valid:
+            logging.debug("Correction gate: " + ", ".join(validation.reasons))
+        return {"validation": [validation.valid, validation.reasons], "correction_needed": not validation.valid}
+
+
+    async def run_self_correction(self, state) -> dict:
+        if not state["correction_needed"]:
+            return {"correction": ""}
+
+        with self.stage_ledger.measure("self_correction") as stage:
+            correction = await self.correction_chain.arun(**self.get_prompt_inputs(state), sql_query=state["sql_query"])
+        state["_stages"].append(stage)
+        return {"correction": correction}
+
+
+    async def arun_stage(self, stage_name, chain, inputs):
+        """
+        Run a chain as a stage, returning its output and StageUsage.
+        """
+        with self.stage_ledger.measure(stage_name) as stage:
+            output = await chain.arun(**inputs)
+        return output, stage
+
+
+    async def discard_speculative_stages(self, tasks) -> list:
+        """
+        Cancel the unused speculative calls still running and return the StageUsage of those that completed, marked discarded.
+        """
+        tasks = list(tasks)
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+        stages = []
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, BaseException):
+                continue
+            _, stage = result
+            stage.discarded = True
+            stages.append(stage)
+        return stages
+
+
+    def get_speculative_labels(self, question, hint, schema_links) -> List[str]:
+        """
+        Return the labels whose generation call is started alongside the classification.
+        """
+        if self.speculation == SPECULATION_ALL:
+            return ["EASY", "NON-NESTED"]
+        if self.speculation == SPECULATION_PREDICTED:
+            label = predict_label(question, hint, schema_links)
+            return [label] if label != "NESTED" else []
+        return []
+
+
+    def get_schema_links(self, schema_linking):
+        logging.debug("Schema linking LLM Output: \n" + schema_linking)
+        schema_links = self.extract_schema_links(schema_linking)
+        logging.debug("Schema links: \n" + " ".join(schema_links))
+        return schema_links
+
+    def get_label_and_sub_questions(self, classification):
+        logging.debug("Classification LLM Output: \n" + classification)
+        label, sub_questions = self.extract_label_and_sub_questions(classification)
+        logging.debug("Extracted label: \n" + str(label))
+        logging.debug("Extracted subquestions: \n" + " ".join(sub_questions))
+        return label, sub_questions
+
+    def get_generation_call(self, label, schema_links, sub_questions):
+        """
+        Return the chain, stage name and extra inputs of the generation call for a classification label.
+        """
+        label = label or ""
+        if "EASY" in label:
+            return self.easy_chain, "easy", {"schema_links": schema_links}
+        elif "NON-NESTED" in label:
+            return self.medium_chain, "non_nested", {"schema_links": schema_links}
+        else:
+            return self.hard_chain, "nested", {"schema_links": schema_links, "sub_questions": sub_questions}
+
+    def get_sql_query(self, output):
+        logging.debug("LLM SQL Output: \n" + output)
+        sql_query = self.extract_sql_query(output)
+        if sql_query is not None:
+            logging.debug("Extracted SQL Query: \n" + sql_query)
+        return sql_query
+
+    def get_final_query(self, correction, sql_query):
+        finall_sql = self.extract_revised_sql_query(correction)
         if finall_sql is not None:
             one_liner_sql_query = finall_sql.replace('\n', ' ').replace('\r', ' ')
+        elif sql_query is not None:
+            one_liner_sql_query = sql_query.replace('\n', ' ').replace('\r', ' ')
         else:
-            if sql_query is not None:
-                one_liner_sql_query = sql_query.replace('\n', ' ').replace('\r', ' ')
-            else:
-                one_liner_sql_query = "SELECT * FROM table LIMIT 1;" # no query generated, placeholder to avoid errors
+            one_liner_sql_query = "SELECT * FROM table LIMIT 1;" # no query generated, placeholder to avoid errors
 
-        
         logging.debug("Final sql query: " + one_liner_sql_query)
-
         return one_liner_sql_query
-        
+
+
+    def estimate_tokens(self, database_schema, column_descriptions, hint, question):
+        """
+        Estimate the tokens of a generate_query call without calling the model.
+
+        Schema links, sub-questions and the SQL query are not known beforehand, so
+        the generation is counted with the medium prompt and every call with
+        ESTIMATED_COMPLETION_TOKENS for the parts the model writes. With
+        speculation on, the generation calls that may be started early are
+        counted as well.
+        """
+        inputs = {
+            "question": question,
+            "schema": database_schema,
+            "hint": hint,
+            "columns_descriptions": column_descriptions,
+            "schema_links": [],
+            "sql_query": ""
+        }
+        chains = [self.schema_link_chain, self.classification_chain, self.medium_chain, self.correction_chain]
+        # Speculative generation calls, the predicted branch is counted with the medium prompt too
+        if self.speculation == SPECULATION_PREDICTED:
+            chains.append(self.medium_chain)
+        elif self.speculation == SPECULATION_ALL:
+            chains.extend([self.easy_chain, self.medium_chain])
+        prompt_tokens = sum(chain.count_prompt_tokens(inputs) for chain in chains)
+        return prompt_tokens + self.LLM_CALLS_PER_QUESTION * self.ESTIMATED_COMPLETION_TOKENS
+
+
+    def get_schema_budget(self, token_limit, max_response_length, question, hint):
+        """
+        Return the tokens the schema and column descriptions may use together in the prompts of a question.
+
+        The schema goes into all four prompts, so the budget is set by the
+        longest prompt without schema.
+        """
+        inputs = {
+            "question": question,
+            "schema": "",
+            "hint": hint,
+            "columns_descriptions": "",
+            "schema_links": [],
+            "sub_questions": [],
+            "sql_query": ""
+        }
+        prompt_tokens = max(chain.count_prompt_tokens(inputs) for chain in (
+            self.schema_link_chain, self.classification_chain, self.easy_chain,
+            self.medium_chain, self.hard_chain, self.correction_chain))
+        return token_limit - max_response_length - prompt_tokens
+
 
     def extract_schema_links(self, input_text: str) -> List[str]:
         pattern = r'Schema_links:\s*\[(.*?)\]'
@@ -1,6 +1,7 @@
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from sql_agents.zero_shot import ZeroShotAgent
+from utils.llm_cache import CachedChain
 
 FEW_SHOT_PROMPT = """
 "Database schema in the form of CREATE_TABLE statements:
@@ -29,7 +30,7 @@ DO NOT return anything else except the SQL query."
 
 class FewShotAgent(ZeroShotAgent):
 
-    def __init__(self, llm):        
+    def __init__(self, llm, response_cache=None):        
         self.llm = llm
 
         self.prompt_template = FEW_SHOT_PROMPT
@@ -38,5 +39,5 @@ class FewShotAgent(ZeroShotAgent):
             template=self.prompt_template,
         )
 
-        self.chain = LLMChain(llm=llm, prompt=prompt)
+        self.chain = CachedChain(LLMChain(llm=llm, prompt=prompt), response_cache, self.PROMPT_VERSION)
 
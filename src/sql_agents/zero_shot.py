@@ -4,6 +4,8 @@ from langchain.chains import LLMChain
 from langchain.callbacks import get_openai_callback
 from sql_agents.base_agent import BaseAgent
 from utils.timer import Timer
+from utils.llm_cache import CachedChain
+from utils.token_counter import get_token_estimate
 import logging
 
 ZERO_SHOT_PROMPT = """
@@ -21,15 +23,43 @@ Hint: {evidence}
 DO NOT return anything else except the SQL query.
 """
 
+
+def get_usage(cb, execution_time, estimate=None):
+    """
+    Return the billed token usage of an OpenAI callback, the local prompt token estimate and the execution time as a dict.
+    """
+    return {
+        "total_tokens": cb.total_tokens,
+        "prompt_tokens": cb.prompt_tokens,
+        "completion_tokens": cb.completion_tokens,
+        "total_cost": cb.total_cost,
+        "estimated_prompt_tokens": estimate.prompt_tokens if estimate is not None else 0,
+        "cached_calls": estimate.cached_calls if estimate is not None else 0,
+        "retries": estimate.retries if estimate is not None else 0,
+        "execution_time": execution_time
+    }
+
+
 class ZeroShotAgent(BaseAgent):
     total_tokens = 0
     prompt_tokens = 0 
     total_cost = 0
     completion_tokens = 0
+    estimated_prompt_tokens = 0
     last_call_execution_time = 0
     total_call_execution_time = 0
+    last_call_cached = False
+    cached_calls = 0
+    retries = 0
 
-    def __init__(self, llm):        
+    # Part of the LLM response cache key, bump it when a prompt changes meaning
+    PROMPT_VERSION = "1"
+
+    # Used to schedule questions against requests-per-minute and tokens-per-minute budgets
+    LLM_CALLS_PER_QUESTION = 1
+    ESTIMATED_COMPLETION_TOKENS = 256
+
+    def __init__(self, llm, response_cache=None):        
         self.llm = llm
 
         self.prompt_template = ZERO_SHOT_PROMPT
@@ -38,7 +68,7 @@ class ZeroShotAgent(BaseAgent):
             template=ZERO_SHOT_PROMPT,
         )
 
-        self.chain = LLMChain(llm=llm, prompt=prompt)
+        self.chain = CachedChain(LLMChain(llm=llm, prompt=prompt), response_cache, self.PROMPT_VERSION)
 
     def generate_query(self, database_schema, question, evidence):
         with get_openai_callback() as cb:
@@ -59,5 +89,66 @@ class ZeroShotAgent(BaseAgent):
             self.completion_tokens += cb.completion_tokens
 
             return response
-        
-    
\ No newline at end of file
+
+
+    async def agenerate_query(self, database_schema, question, evidence):
+        """
+        Async version of generate_query, returns the query and the usage of the call.
+
+        The usage is not added to the totals of the agent, so concurrent calls can
+        be added with add_usage in question order.
+        """
+        with get_openai_callback() as cb, get_token_estimate() as estimate:
+            with Timer() as t:
+                response = await self.chain.arun({
+                    'database_schema': database_schema,
+                    'question': question,
+                    "evidence": evidence
+                })
+
+            logging.info(f"OpenAI API execution time: {t.elapsed_time:.2f}")
+
+            return response, get_usage(cb, t.elapsed_time, estimate)
+
+
+    def estimate_tokens(self, database_schema, question, evidence):
+        """
+        Estimate the tokens of a generate_query call without calling the model.
+        """
+        prompt_tokens = self.chain.count_prompt_tokens({
+            'database_schema': database_schema,
+            'question': question,
+            "evidence": evidence
+        })
+        return prompt_tokens + self.ESTIMATED_COMPLETION_TOKENS
+
+
+    def get_schema_budget(self, token_limit, max_response_length, question, evidence):
+        """
+        Return the tokens the database schema may use in the prompt of a question.
+
+        The budget is what remains of the model's context after the prompt
+        without schema and max_response_length tokens for the answer.
+        """
+        prompt_tokens = self.chain.count_prompt_tokens({
+            'database_schema': "",
+            'question': question,
+            "evidence": evidence
+        })
+        return token_limit - max_response_length - prompt_tokens
+
+
+    def add_usage(self, usage):
+        """
+        Add the usage returned by an async call to the totals of the agent.
+        """
+        self.last_call_execution_time = usage["execution_time"]
+        self.total_call_execution_time += usage["execution_time"]
+        self.total_tokens += usage["total_tokens"]
+        self.prompt_tokens += usage["prompt_tokens"]
+        self.total_cost += usage["total_cost"]
+        self.completion_tokens += usage["completion_tokens"]
+        self.estimated_prompt_tokens += usage["estimated_prompt_tokens"]
+        self.last_call_cached = usage["cached_calls"] > 0
+        self.cached_calls += usage["cached_calls"]
+        self.retries += usage["retries"]
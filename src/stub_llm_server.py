@@ -0,0 +1,471 @@
+"""
+A local stand-in for the OpenAI chat completions API.
+
+Point ChatOpenAI and openai.ChatCompletion.create at it by setting the
+OPENAI_API_BASE environment variable to http://<host>:<port>/v1 before
+starting a run script, any OPENAI_API_KEY is accepted.
+"""
+
+import json
+import math
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from async_runner import TokenBucket
+from utils.token_counter import count_message_tokens, count_tokens
+
+
+def parse_option():
+    parser = argparse.ArgumentParser("Serve scripted, recorded or proxied chat completions with simulated latency, errors and rate limits")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--response", type=str, action="append", default=None,
+                        help="Scripted response, repeat the option to cycle through several responses")
+    parser.add_argument("--responses_path", type=str, default=None,
+                        help="JSON file with a list of scripted responses")
+    parser.add_argument("--cassette", type=str, default=None,
+                        help="JSON lines cassette to replay, requests are matched on model and messages")
+    parser.add_argument("--record_cassette", type=str, default=None,
+                        help="Append every served completion to this JSON lines cassette")
+    parser.add_argument("--upstream", type=str, default=None,
+                        help="Forward requests to this API base, e.g. https://api.openai.com/v1, to record a cassette")
+    parser.add_argument("--latency", type=str, default="constant:0",
+                        help="Latency distribution in seconds: constant:S, uniform:A,B, normal:MEAN,STD, "
+                             "lognormal:MU,SIGMA or exponential:MEAN. Replaced cassette latencies unless --replay_latency")
+    parser.add_argument("--latency_per_token", type=float, default=0,
+                        help="Extra seconds per completion token")
+    parser.add_argument("--replay_latency", action="store_true",
+                        help="Replay cassette entries with their recorded latency")
+    parser.add_argument("--error_rate_429", type=float, default=0,
+                        help="Fraction of requests answered with a 429 rate limit error")
+    parser.add_argument("--error_rate_500", type=float, default=0,
+                        help="Fraction of requests answered with a 500 server error")
+    parser.add_argument("--requests_per_minute", type=int, default=None,
+                        help="Answer requests over this rate with 429, like the OpenAI rate limits")
+    parser.add_argument("--tokens_per_minute", type=int, default=None,
+                        help="Answer requests over this many prompt and completion tokens per minute with 429")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of the latency and error sampling")
+
+    opt = parser.parse_args()
+
+    return opt
+
+
+class LatencyDistribution:
+    """
+    Samples simulated latencies in seconds from a spec such as "uniform:0.2,1.5".
+    """
+
+    KINDS = ("constant", "uniform", "normal", "lognormal", "exponential")
+
+    def __init__(self, spec: str = "constant:0"):
+        kind, _, params = spec.partition(":")
+        if kind not in self.KINDS:
+            raise ValueError(f"Latency distribution must be one of {', '.join(self.KINDS)}, got {spec}")
+
+        self.kind = kind
+        self.params = [float(param) for param in params.split(",") if param]
+        expected = {"constant": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}[kind]
+        if len(self.params) != expected:
+            raise ValueError(f"{kind} latency takes {expected} parameters, got {spec}")
+
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "constant":
+            latency = self.params[0]
+        elif self.kind == "uniform":
+            latency = rng.uniform(*self.params)
+        elif self.kind == "normal":
+            latency = rng.gauss(*self.params)
+        elif self.kind == "lognormal":
+            latency = rng.lognormvariate(*self.params)
+        else:
+            latency = rng.expovariate(1 / self.params[0]) if self.params[0] > 0 else 0
+        return max(0.0, latency)
+
+
+def get_request_key(model: str, messages: list) -> str:
+    """
+    Return the key cassette entries are matched on.
+    """
+    content = json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """
+    Recorded completions, replayed for requests with the same model and messages.
+
+    Each line of the file is a JSON object with the model, messages, choices
+    (the response texts), usage and latency of a call. Several entries for the
+    same request are replayed in order, the last one is repeated.
+    """
+
+    def __init__(self, path: str = None):
+        self.entries = {}
+        self.positions = {}
+        self.lock = threading.Lock()
+
+        if path is not None:
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        key = get_request_key(entry["model"], entry["messages"])
+                        self.entries.setdefault(key, []).append(entry)
+
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.entries.values())
+
+
+    def lookup(self, model: str, messages: list) -> dict:
+        """
+        Return the next recorded entry for a request, None if it was not recorded.
+        """
+        key = get_request_key(model, messages)
+        with self.lock:
+            entries = self.entries.get(key)
+            if not entries:
+                return None
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+            return entries[min(position, len(entries) - 1)]
+
+
+class StubError(Exception):
+    """
+    An error answered with an OpenAI style error body.
+    """
+
+    def __init__(self, status: int, message: str, error_type: str, code: str = None, retry_after: float = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.error_type = error_type
+        self.code = code
+        self.retry_after = retry_after
+
+
+    def to_json(self) -> dict:
+        return {"error": {"message": self.message, "type": self.error_type, "param": None, "code": self.code}}
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    An HTTP server answering POST /v1/chat/completions like the OpenAI API.
+
+    Completions come from, in order of preference, the cassette, the upstream
+    API and the scripted responses. Every request first passes the simulated
+    rate limits and error injection, then waits the sampled latency. Use it
+    in-process with a with statement, which serves on a background thread:
+
+        with StubLLMServer(responses=["SELECT 1"]) as server:
+            llm = ChatOpenAI(openai_api_base=server.api_base, openai_api_key="stub")
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, responses: list = None, cassette: Cassette = None,
+                 record_path: str = None, upstream: str = None, latency: str = "constant:0",
+                 latency_per_token: float = 0, replay_latency: bool = False, error_rate_429: float = 0,
+                 error_rate_500: float = 0, requests_per_minute: int = None, tokens_per_minute: int = None,
+                 seed: int = None):
+        super().__init__((host, port), StubLLMHandler)
+
+        self.responses = responses if responses else (None if cassette is not None or upstream else ["SELECT 1"])
+        self.cassette = cassette if cassette is not None else Cassette()
+        self.record_path = record_path
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.latency = LatencyDistribution(latency)
+        self.latency_per_token = latency_per_token
+        self.replay_latency = replay_latency
+        self.error_rate_429 = error_rate_429
+        self.error_rate_500 = error_rate_500
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.response_position = 0
+        self.completion_count = 0
+        self.stats = {"requests": 0, "completions": 0, "rate_limited": 0, "server_errors": 0,
+                      "cassette_hits": 0, "upstream_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.thread = None
+
+
+    @property
+    def api_base(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+    def start(self) -> "StubLLMServer":
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+    def __enter__(self) -> "StubLLMServer":
+        return self.start()
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+    def count(self, stat: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[stat] += amount
+
+
+    def admit(self, prompt_tokens: int, max_tokens: int) -> None:
+        """
+        Apply the simulated rate limits and error injection to a request.
+
+        Raises:
+            StubError: A 429 or 500 error to answer the request with.
+        """
+        with self.lock:
+            now = time.monotonic()
+            for bucket, amount, name in ((self.requests, 1, "requests"), (self.tokens, prompt_tokens + max_tokens, "tokens")):
+                if bucket is None:
+                    continue
+                bucket.refill(now)
+                wait = bucket.get_wait_time(amount)
+                if wait > 0:
+                    self.stats["rate_limited"] += 1
+                    raise StubError(429, f"Rate limit reached for {name} per min. Please try again in {wait:.3f}s.",
+                                    "requests" if name == "requests" else "tokens", "rate_limit_exceeded", wait)
+
+            draw = self.rng.random()
+            if draw < self.error_rate_429:
+                self.stats["rate_limited"] += 1
+                raise StubError(429, "Rate limit reached (injected by the stub server).", "requests", "rate_limit_exceeded", 1)
+            if draw < self.error_rate_429 + self.error_rate_500:
+                self.stats["server_errors"] += 1
+                raise StubError(500, "The server had an error while processing your request (injected by the stub server).",
+                                "server_error")
+
+            for bucket, amount in ((self.requests, 1), (self.tokens, prompt_tokens + max_tokens)):
+                if bucket is not None:
+                    bucket.consume(amount)
+
+
+    def next_responses(self, n: int) -> list:
+        with self.lock:
+            texts = []
+            for _ in range(n):
+                texts.append(self.responses[self.response_position % len(self.responses)])
+                self.response_position += 1
+            return texts
+
+
+    def sample_latency(self) -> float:
+        with self.lock:
+            return self.latency.sample(self.rng)
+
+
+    def call_upstream(self, body: dict, authorization: str) -> tuple:
+        """
+        Forward a request to the upstream API, returning the response texts, usage and latency.
+        """
+        request = urllib.request.Request(
+            self.upstream + "/chat/completions",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Authorization": authorization or ""})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=600) as response:
+                data = json.loads(response.read())
+        except urllib.error.HTTPError as err:
+            raise StubError(err.code, err.read().decode("utf-8", "replace"), "upstream_error")
+        latency = time.perf_counter() - start
+
+        self.count("upstream_calls")
+        choices = [choice["message"]["content"] for choice in data["choices"]]
+        return choices, data.get("usage"), latency
+
+
+    def record(self, model: str, messages: list, choices: list, usage: dict, latency: float) -> None:
+        if self.record_path is None:
+            return
+        line = json.dumps({"model": model, "messages": messages, "choices": choices,
+                           "usage": usage, "latency": latency}, ensure_ascii=False)
+        with self.lock:
+            with open(self.record_path, "a") as f:
+                f.write(line + "\n")
+
+
+    def complete(self, body: dict, authorization: str = None) -> dict:
+        """
+        Return the chat completion response body of a request body.
+
+        Raises:
+            StubError: If the request is invalid, rate limited or hit by an injected error.
+        """
+        self.count("requests")
+        if body.get("stream"):
+            raise StubError(400, "Streaming is not supported by the stub server.", "invalid_request_error")
+
+        model = body.get("model", "gpt-3.5-turbo")
+        messages = body.get("messages")
+        if not isinstance(messages, list) or not messages:
+            raise StubError(400, "'messages' is a required property", "invalid_request_error")
+        n = int(body.get("n") or 1)
+
+        prompt_tokens = count_message_tokens([(message.get("role"), message.get("content") or "") for message in messages], model)
+        self.admit(prompt_tokens, int(body.get("max_tokens") or 0))
+
+        start = time.perf_counter()
+        entry = self.cassette.lookup(model, messages)
+        recorded_latency = None
+        usage = None
+        if entry is not None:
+            self.count("cassette_hits")
+            choices = [entry["choices"][index % len(entry["choices"])] for index in range(n)]
+            usage = entry.get("usage")
+            recorded_latency = entry.get("latency")
+        elif self.upstream is not None:
+            choices, usage, recorded_latency = self.call_upstream(body, authorization)
+        elif self.responses is not None:
+            choices = self.next_responses(n)
+        else:
+            raise StubError(400, "No cassette entry for this request.", "invalid_request_error", "cassette_miss")
+
+        if usage is None:
+            completion_tokens = sum(count_tokens(choice, model) for choice in choices)
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                     "total_tokens": prompt_tokens + completion_tokens}
+
+        # Upstream calls already took their real latency
+        if entry is None and self.upstream is not None:
+            latency = recorded_latency
+        elif entry is not None and self.replay_latency and recorded_latency is not None:
+            latency = recorded_latency
+        else:
+            latency = self.sample_latency() + self.latency_per_token * usage["completion_tokens"]
+        time.sleep(max(0.0, latency - (time.perf_counter() - start)))
+
+        self.record(model, messages, choices, usage, recorded_latency if recorded_latency is not None else latency)
+        self.count("completions")
+        self.count("prompt_tokens", usage["prompt_tokens"])
+        self.count("completion_tokens", usage["completion_tokens"])
+
+        with self.lock:
+            self.completion_count += 1
+            completion_id = f"chatcmpl-stub-{self.completion_count}"
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": index,
+                "message": {"role": "assistant", "content": choice},
+                "finish_reason": "stop"
+            } for index, choice in enumerate(choices)],
+            "usage": usage
+        }
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status: int, data: dict, headers: dict = None) -> None:
+        content = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+    def do_GET(self):
+        if self.path.rstrip("/") in ("/stats", "/v1/stats"):
+            with self.server.lock:
+                self.send_json(200, dict(self.server.stats))
+        else:
+            self.send_json(404, StubError(404, f"Unknown path {self.path}", "invalid_request_error").to_json())
+
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length)
+
+        if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_json(404, StubError(404, f"Unknown path {self.path}", "invalid_request_error").to_json())
+            return
+
+        try:
+            body = json.loads(raw_body or b"{}")
+            self.send_json(200, self.server.complete(body, self.headers.get("Authorization")))
+        except json.JSONDecodeError:
+            self.send_json(400, StubError(400, "The request body is not valid JSON.", "invalid_request_error").to_json())
+        except StubError as err:
+            headers = {"Retry-After": str(math.ceil(err.retry_after))} if err.retry_after is not None else None
+            self.send_json(err.status, err.to_json(), headers)
+
+
+    def log_message(self, format, *args):
+        logging.debug("Stub LLM server: " + format % args)
+
+
+def main():
+    opt = parse_option()
+
+    responses = list(opt.response or [])
+    if opt.responses_path is not None:
+        with open(opt.responses_path) as f:
+            responses += json.load(f)
+
+    cassette = Cassette(opt.cassette) if opt.cassette is not None else None
+
+    server = StubLLMServer(
+        host=opt.host,
+        port=opt.port,
+        responses=responses,
+        cassette=cassette,
+        record_path=opt.record_cassette,
+        upstream=opt.upstream,
+        latency=opt.latency,
+        latency_per_token=opt.latency_per_token,
+        replay_latency=opt.replay_latency,
+        error_rate_429=opt.error_rate_429,
+        error_rate_500=opt.error_rate_500,
+        requests_per_minute=opt.requests_per_minute,
+        tokens_per_minute=opt.tokens_per_minute,
+        seed=opt.seed
+    )
+
+    if cassette is not None:
+        print(f"Replaying {len(cassette)} recorded completions from {opt.cassette}")
+    print(f"Serving chat completions on {server.api_base}, set OPENAI_API_BASE={server.api_base} to use it")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Stats: ", json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
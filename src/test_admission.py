@@ -0,0 +1,47 @@
+
+import sqlite3
+import unittest
+from utils.admission import explain_query_plan, estimate_plan_cost, cap_query
+from utils.sql_tables import get_table_aliases
+
+
+class TestAdmission(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = sqlite3.connect(":memory:")
+        cls.conn.execute("CREATE TABLE account (account_id INTEGER PRIMARY KEY, district_id INTEGER)")
+        cls.conn.execute("CREATE TABLE trans (trans_id INTEGER PRIMARY KEY, account_id INTEGER, amount REAL)")
+        cls.conn.executemany("INSERT INTO account VALUES (?, ?)", [(i, i % 7) for i in range(1, 101)])
+        cls.conn.executemany("INSERT INTO trans VALUES (?, ?, ?)", [(i, i % 100 + 1, i) for i in range(1, 1001)])
+        cls.row_counts = {"account": 4500, "trans": 1000000}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def estimate(self, sql):
+        aliases = get_table_aliases(sql, list(self.row_counts))
+        return estimate_plan_cost(explain_query_plan(self.conn, sql), self.row_counts, aliases)
+
+
+    def test_cross_join_multiplies_full_scans(self):
+        cost = self.estimate("SELECT COUNT(*) FROM account AS T1, trans AS T2")
+        self.assertGreaterEqual(cost.cost, 4500 * 1000000)
+        self.assertCountEqual(cost.full_scans, ["account", "trans"])
+
+    def test_index_join_is_cheap(self):
+        cost = self.estimate("SELECT T2.amount FROM trans AS T2 INNER JOIN account AS T1 ON T1.account_id = T2.account_id")
+        self.assertLess(cost.cost, 3 * 1000000)
+
+    def test_correlated_subquery_runs_per_outer_row(self):
+        cost = self.estimate("SELECT (SELECT COUNT(*) FROM trans t WHERE t.amount > a.district_id) FROM account a")
+        self.assertGreaterEqual(cost.cost, 4500 * 1000000)
+
+    def test_cap_query(self):
+        rows = self.conn.execute(cap_query("SELECT * FROM trans; -- all", 5)).fetchall()
+        self.assertEqual(len(rows), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
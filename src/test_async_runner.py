@@ -0,0 +1,189 @@
+
+import time
+import asyncio
+import unittest
+import openai
+from langchain.chat_models.fake import FakeListChatModel
+from async_runner import AsyncRunner, RateLimiter, AdaptiveConcurrency
+from utils.resilient_client import acall_with_retries
+from utils.token_counter import get_token_estimate
+from sql_agents.zero_shot import ZeroShotAgent
+from sql_agents.din_sql import DinSQLAgent
+
+
+class FlakyChatModel(FakeListChatModel):
+    """
+    Answers with the responses in turn, and with rate limit errors for the first attempts of one of them.
+    """
+    fail_at: int = -1
+    failures: int = 0
+    calls: int = 0
+
+    def _call(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        if self.i == self.fail_at and self.failures > 0:
+            self.failures -= 1
+            raise openai.error.RateLimitError("Rate limit reached", http_status=429)
+        return super()._call(messages, stop, run_manager, **kwargs)
+
+
+class TestAsyncRunner(unittest.TestCase):
+
+    def run_items(self, runner, items, call, estimate=None):
+        results = []
+        runner.run(items, call, lambda step, item, result: results.append((step, item, result)), estimate)
+        return results
+
+
+    def test_results_are_in_item_order(self):
+        async def call(item):
+            await asyncio.sleep(0.01 * (5 - item))
+            return item * 10
+
+        results = self.run_items(AsyncRunner(max_concurrency=5), list(range(5)), call)
+        self.assertEqual(results, [(step, step, step * 10) for step in range(5)])
+
+    def test_concurrency_limit(self):
+        in_flight = [0, 0]
+
+        async def call(item):
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+            await asyncio.sleep(0.05)
+            in_flight[0] -= 1
+
+        start = time.perf_counter()
+        self.run_items(AsyncRunner(max_concurrency=4), list(range(8)), call)
+        self.assertEqual(in_flight[1], 4)
+        self.assertLess(time.perf_counter() - start, 0.3)
+
+    def test_rate_limited_calls_are_retried(self):
+        attempts = {}
+
+        async def send(item):
+            attempts[item] = attempts.get(item, 0) + 1
+            if item == 1 and attempts[item] < 3:
+                raise openai.error.RateLimitError("Rate limit reached", http_status=429)
+            return item
+
+        async def call(item):
+            return await acall_with_retries(lambda: send(item))
+
+        runner = AsyncRunner(max_concurrency=4, initial_backoff=0.01)
+        results = self.run_items(runner, [0, 1, 2], call)
+        self.assertEqual([result for _, _, result in results], [0, 1, 2])
+        self.assertEqual(runner.rate_limited, 2)
+        self.assertLess(runner.concurrency.limit, 4)
+
+    def test_only_the_failed_call_is_retried(self):
+        attempts = {"first": 0, "second": 0}
+
+        async def send(name):
+            attempts[name] += 1
+            if name == "second" and attempts[name] < 3:
+                raise openai.error.ServiceUnavailableError("overloaded")
+            return name
+
+        async def call(item):
+            with get_token_estimate() as estimate:
+                first = await acall_with_retries(lambda: send("first"))
+                second = await acall_with_retries(lambda: send("second"))
+            return first, second, estimate.retries
+
+        runner = AsyncRunner(initial_backoff=0.01)
+        results = self.run_items(runner, [0], call)
+        self.assertEqual(results[0][2], ("first", "second", 2))
+        self.assertEqual(attempts, {"first": 1, "second": 3})
+        self.assertEqual(runner.retries, 2)
+
+    def test_calls_outside_a_runner_are_not_retried(self):
+        async def send():
+            raise openai.error.RateLimitError("Rate limit reached", http_status=429)
+
+        with self.assertRaises(openai.error.RateLimitError):
+            asyncio.run(acall_with_retries(send))
+
+    def test_other_errors_are_raised(self):
+        async def call(item):
+            raise ValueError("bad item")
+
+        with self.assertRaises(ValueError):
+            self.run_items(AsyncRunner(max_concurrency=2), [0, 1], call)
+
+        async def send():
+            raise openai.error.InvalidRequestError("bad request", None, http_status=400)
+
+        async def call_llm(item):
+            return await acall_with_retries(send)
+
+        runner = AsyncRunner(initial_backoff=0.01)
+        with self.assertRaises(openai.error.InvalidRequestError):
+            self.run_items(runner, [0], call_llm)
+        self.assertEqual(runner.retries, 0)
+
+
+    def test_token_budget_delays_calls(self):
+        async def acquire():
+            limiter = RateLimiter(tokens_per_minute=6000)
+            await limiter.acquire(tokens=6000)
+            start = time.perf_counter()
+            await limiter.acquire(tokens=10)
+            return time.perf_counter() - start
+
+        self.assertGreaterEqual(asyncio.run(acquire()), 0.09)
+
+    def test_aimd(self):
+        concurrency = AdaptiveConcurrency(8)
+        concurrency.on_rate_limit()
+        concurrency.on_rate_limit()
+        self.assertEqual(concurrency.limit, 2)
+        for _ in range(2):
+            concurrency.on_success()
+        self.assertAlmostEqual(concurrency.limit, 2.9, places=1)
+
+
+    def test_agent_runs_concurrently(self):
+        agent = ZeroShotAgent(FakeListChatModel(responses=["SELECT 1"]))
+
+        async def call(item):
+            return await agent.agenerate_query("CREATE TABLE t (a)", "question " + str(item), "")
+
+        results = self.run_items(AsyncRunner(max_concurrency=3), list(range(3)), call,
+                                 lambda item: (1, agent.estimate_tokens("CREATE TABLE t (a)", "question", "")))
+        for _, _, (response, usage) in results:
+            self.assertEqual(response, "SELECT 1")
+            agent.add_usage(usage)
+        self.assertGreater(agent.total_call_execution_time, 0)
+
+    def test_din_sql_retries_only_the_rate_limited_stage(self):
+        responses = [
+            "Schema_links: [account.account_id]",
+            'Label: "EASY"',
+            "SQL: SELECT account_id FROM account",
+            "Revised_SQL: SELECT account.account_id FROM account"
+        ]
+        # The self-correction, the last of the four calls, is rate limited twice
+        agent = DinSQLAgent(FlakyChatModel(responses=responses, fail_at=3, failures=2))
+
+        async def call(item):
+            return await agent.agenerate_query("CREATE TABLE account (account_id INTEGER)", "", "", "Which accounts?")
+
+        runner = AsyncRunner(initial_backoff=0.01)
+        (_, _, (query, usage)), = self.run_items(runner, [0], call)
+        self.assertEqual(query, "SELECT account.account_id FROM account")
+        self.assertEqual(agent.llm.calls, 6)
+        self.assertEqual(usage["retries"], 2)
+
+        summary = agent.stage_ledger.summarize()
+        self.assertEqual(summary["schema_linking"]["calls"], 1)
+        self.assertEqual(summary["schema_linking"]["retries"], 0)
+        self.assertEqual(summary["self_correction"]["retries"], 2)
+        # Every attempt of the self-correction was sent, so all three count in its prompt token estimate
+        correction_tokens = agent.correction_chain.count_prompt_tokens({
+            "question": "Which accounts?", "schema": "CREATE TABLE account (account_id INTEGER)", "hint": "",
+            "columns_descriptions": "", "sql_query": "SELECT account_id FROM account"})
+        self.assertEqual(summary["self_correction"]["estimated_prompt_tokens"], 3 * correction_tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()
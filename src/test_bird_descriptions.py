@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+from utils.bird_descriptions import DescriptionCache, parse_description_folder
+
+
+def render_like_the_original(description_folder_path):
+    # The rendering of BIRDDataset.get_bird_table_info before the descriptions were cached
+    table_info = ""
+    for filename in os.listdir(description_folder_path):
+        if filename.endswith(".csv"):
+            table_name = filename.rstrip(".csv")
+            with open(os.path.join(description_folder_path, filename), mode='r', encoding='utf-8') as file:
+                file_contents = file.read()
+            table_info += "Table " + table_name + "\n"
+            table_info += file_contents
+        table_info += "\n\n"
+    return table_info
+
+
+class TestBirdDescriptions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.tmp_dir.name, "database_description")
+        os.makedirs(self.folder)
+        files = {
+            "trans.csv": "\ufefforiginal_column_name,column_name,column_description\r\n"
+                         "trans_id,transaction id,\"the id, unique\"\r\n\r\n",
+            "account.csv": "original_column_name,column_name,column_description\n"
+                           "account_id , account id,  the id of the account  \n",
+            "district.csv": "original_column_name,column_name,column_description\n"
+                            "A2,district_name,\"name of\nthe district\"",
+            "notes.txt": "not a description"
+        }
+        for filename, text in files.items():
+            with open(os.path.join(self.folder, filename), "w", encoding="utf-8", newline="") as f:
+                f.write(text)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def test_rendering_matches_the_original(self):
+        description = parse_description_folder("financial", self.folder)
+        self.assertEqual(description.render(), render_like_the_original(self.folder))
+
+    def test_columns_are_parsed(self):
+        description = parse_description_folder("financial", self.folder)
+        self.assertEqual(description.tables["trans"].header[0], "original_column_name")
+        self.assertEqual(description.tables["trans"].columns[0].column_description, "the id, unique")
+        self.assertEqual(description.tables["account"].columns[0].original_column_name, "account_id")
+
+    def test_selected_tables_are_rendered_in_file_order(self):
+        description = parse_description_folder("financial", self.folder)
+        rendered = description.render(["district", "account"])
+        self.assertNotIn("transaction id", rendered)
+        expected = [name for name in os.listdir(self.folder) if name in ("district.csv", "account.csv")]
+        self.assertLess(rendered.index("Table " + expected[0][:-4]), rendered.index("Table " + expected[1][:-4]))
+
+    def test_cache_reparses_changed_folders(self):
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        cache = DescriptionCache(cache_dir)
+        rendered = cache.get_description("financial", self.folder).render()
+        self.assertEqual(cache.files_parsed, 3)
+
+        cache = DescriptionCache(cache_dir)
+        self.assertEqual(cache.get_description("financial", self.folder).render(), rendered)
+        self.assertEqual(cache.files_parsed, 0)
+
+        with open(os.path.join(self.folder, "loan.csv"), "w", encoding="utf-8") as f:
+            f.write("original_column_name,column_name\nloan_id,loan id\n")
+        cache = DescriptionCache(cache_dir)
+        self.assertIn("Table loan\n", cache.get_description("financial", self.folder).render())
+        self.assertEqual(cache.files_parsed, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from box import Box
+from datasets import Dataset
+from utils.connection_pool import ConnectionPool, HOT_PROFILE
+
+
+class TemporaryDataset(Dataset):
+
+    def __init__(self, base_db_path, config):
+        self.BASE_DB_PATH = base_db_path
+        self.test_config = config
+        super().__init__()
+
+    def load_config(self):
+        self.config = Box(self.test_config)
+
+    def load_data(self):
+        self.data = []
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for db_name in ("bank", "shop", "school"):
+            os.makedirs(os.path.join(self.tmp_dir.name, db_name))
+            conn = sqlite3.connect(self.get_db_path(db_name))
+            conn.execute("CREATE TABLE account (account_id INTEGER PRIMARY KEY, balance REAL)")
+            conn.executemany("INSERT INTO account VALUES (?, ?)", [(1, 10.0), (2, 20.0)])
+            conn.commit()
+            conn.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_db_path(self, db_name):
+        return os.path.join(self.tmp_dir.name, db_name, db_name + ".sqlite")
+
+
+    def test_least_recently_used_is_evicted(self):
+        pool = ConnectionPool(max_open_databases=2)
+        bank = pool.get_connection("bank", self.get_db_path("bank"))
+        pool.get_connection("shop", self.get_db_path("shop"))
+        self.assertIs(pool.get_connection("bank", self.get_db_path("bank")), bank)
+        pool.get_connection("school", self.get_db_path("school"))
+
+        self.assertEqual(list(pool.connections), ["bank", "school"])
+        self.assertEqual(pool.get_stats()["evictions"], 1)
+        self.assertEqual(pool.get_stats()["hits"], 1)
+        self.assertEqual(pool.get_stats()["misses"], 3)
+        pool.close_all()
+        self.assertEqual(pool.get_stats()["open_connections"], 0)
+
+    def test_promoted_database_keeps_the_file_connection_open(self):
+        pool = ConnectionPool(profile=HOT_PROFILE, hot_min_requests=2)
+        source = pool.get_connection("bank", self.get_db_path("bank"))
+        promoted = pool.get_connection("bank", self.get_db_path("bank"))
+
+        self.assertIsNot(promoted, source)
+        self.assertEqual(pool.get_stats()["in_memory_databases"], 1)
+        self.assertEqual(source.execute("SELECT count(*) FROM account").fetchone(), (2,))
+        self.assertEqual(promoted.execute("SELECT count(*) FROM account").fetchone(), (2,))
+
+        pool.close_all()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            source.execute("SELECT 1")
+
+    def test_dataset_evaluates_after_promotion(self):
+        dataset = TemporaryDataset(self.tmp_dir.name, {
+            "connection_profile": HOT_PROFILE, "hot_min_requests": 3, "schema_catalog_cache": False})
+        gold_sql = "SELECT balance FROM account WHERE account_id = 1"
+
+        self.assertEqual(dataset.execute_queries_and_match_data(gold_sql, gold_sql, "bank"), 1)
+        for _ in range(3):
+            dataset.get_schema_and_sample_data("bank")
+        self.assertEqual(dataset.get_connection_pool_stats()["in_memory_databases"], 1)
+
+        self.assertEqual(dataset.execute_queries_and_match_data(gold_sql, gold_sql, "bank"), 1)
+        self.assertEqual(dataset.last_predicted_outcome, "success")
+        self.assertEqual(dataset.fetch_gold_result(gold_sql, "bank"), [(10.0,)])
+        dataset.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+
+import pickle
+import unittest
+from utils.data_point import DataPoint
+
+
+class TestDataPoint(unittest.TestCase):
+
+    def test_spider_record_is_normalized(self):
+        record = {"db_id": "concert_singer", "question": "How many singers?",
+                  "query": "SELECT count(*) FROM singer", "query_toks": ["SELECT"], "question_toks": ["How"]}
+        data_point = DataPoint.from_spider(record)
+
+        self.assertEqual(data_point['SQL'], "SELECT count(*) FROM singer")
+        self.assertEqual(data_point['evidence'], "")
+        self.assertEqual(data_point['SQL'], data_point.SQL)
+        self.assertNotIn('difficulty', data_point)
+        self.assertEqual(data_point.get('difficulty', ""), "")
+        self.assertIn('query', record)
+
+    def test_data_point_is_immutable(self):
+        data_point = DataPoint("q", "e", "SELECT 1", "financial", "simple", [1, 2])
+        with self.assertRaises(AttributeError):
+            data_point.SQL = "SELECT 2"
+        with self.assertRaises(AttributeError):
+            data_point.extra = 1
+        self.assertEqual(data_point['annotation'], (1, 2))
+
+    def test_data_point_pickles(self):
+        data_point = DataPoint("q", "e", "SELECT 1", "financial", "simple", [3])
+        self.assertEqual(pickle.loads(pickle.dumps(data_point)), data_point)
+
+
+if __name__ == "__main__":
+    unittest.main()
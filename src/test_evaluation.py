@@ -0,0 +1,87 @@
+import os
+import asyncio
+import sqlite3
+import tempfile
+import unittest
+from evaluation import ParallelEvaluator
+from utils.query_timeout import SUCCESS, ERROR, TIMEOUT
+from test_connection_pool import TemporaryDataset
+from test_query_timeout import ENDLESS_SQL
+
+
+class TestParallelEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        for db_name in ("bank", "shop"):
+            os.makedirs(os.path.join(self.tmp_dir.name, db_name))
+            conn = sqlite3.connect(os.path.join(self.tmp_dir.name, db_name, db_name + ".sqlite"))
+            conn.execute("CREATE TABLE item (item_id INTEGER PRIMARY KEY, price REAL)")
+            conn.executemany("INSERT INTO item VALUES (?, ?)", [(i, float(i % 4)) for i in range(1, 51)])
+            conn.commit()
+            conn.close()
+        self.dataset = TemporaryDataset(self.tmp_dir.name, {"schema_catalog_cache": False})
+        self.jobs = [
+            ("SELECT price FROM item WHERE item_id < 5", "SELECT price FROM item WHERE item_id < 5", "bank"),
+            ("SELECT price FROM item WHERE item_id < 5 ORDER BY price", "SELECT price FROM item WHERE item_id < 5", "shop"),
+            ("SELECT price FROM item WHERE item_id < 6", "SELECT price FROM item WHERE item_id < 5", "bank"),
+            ("SELECT cost FROM item", "SELECT price FROM item", "shop"),
+        ] * 5
+
+    def tearDown(self):
+        self.dataset.close()
+        self.tmp_dir.cleanup()
+
+
+    def test_results_match_sequential_evaluation(self):
+        results = ParallelEvaluator(self.dataset, max_workers=4).evaluate(self.jobs)
+        parallel_outcomes = dict(self.dataset.predicted_outcomes)
+        sequential = [self.dataset.execute_queries_and_match_data(*job) for job in self.jobs]
+
+        self.assertEqual([result.success for result in results], sequential)
+        self.assertEqual([result.success for result in results[:4]], [1, 1, 0, 0])
+        self.assertEqual(results[3].predicted_outcome, ERROR)
+        self.assertEqual(parallel_outcomes, {SUCCESS: 15, ERROR: 5})
+
+    def test_counters_follow_job_order(self):
+        ParallelEvaluator(self.dataset, max_workers=3).evaluate(self.jobs)
+        self.assertEqual(self.dataset.last_predicted_outcome, ERROR)
+        self.assertEqual(sum(self.dataset.gold_outcomes.values()), len(self.jobs) - 5)
+
+    def test_worker_connections_are_closed(self):
+        evaluator = ParallelEvaluator(self.dataset, max_workers=2)
+        evaluator.evaluate(self.jobs)
+        self.assertEqual(evaluator.pools, [])
+        self.assertEqual(self.dataset.get_connection_pool_stats()["open_connections"], 0)
+
+    def test_async_evaluation_does_not_block_the_event_loop(self):
+        self.dataset.predicted_sql_timeout = 0.3
+        evaluator = ParallelEvaluator(self.dataset)
+
+        async def evaluate():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticker = asyncio.ensure_future(tick())
+            result = await evaluator.aevaluate(ENDLESS_SQL, "SELECT 1", "bank")
+            ticker.cancel()
+            return result, ticks
+
+        result, ticks = asyncio.run(evaluate())
+        evaluator.close()
+        self.assertEqual(result.predicted_outcome, TIMEOUT)
+        self.assertGreater(ticks, 10)
+
+        # The result is only recorded when the caller passes it on
+        self.assertEqual(sum(self.dataset.predicted_outcomes.values()), 0)
+        self.dataset.record_evaluation_result(result)
+        self.assertEqual(self.dataset.last_predicted_outcome, TIMEOUT)
+
+
+if __name__ == "__main__":
+    unittest.main()
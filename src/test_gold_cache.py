@@ -0,0 +1,74 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from utils.gold_cache import GoldResultCache, normalize_sql
+from utils.result_comparison import STREAMING
+from test_connection_pool import TemporaryDataset
+
+
+class TestGoldResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, "gold_results")
+        os.makedirs(os.path.join(self.tmp_dir.name, "bank"))
+        self.db_path = os.path.join(self.tmp_dir.name, "bank", "bank.sqlite")
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE account (account_id INTEGER PRIMARY KEY, balance REAL)")
+        conn.executemany("INSERT INTO account VALUES (?, ?)", [(1, 10.0), (2, 20.0)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def test_normalized_queries_share_an_entry(self):
+        self.assertEqual(normalize_sql("SELECT  *\n FROM account ;"), "SELECT * FROM account")
+        self.assertEqual(normalize_sql("SELECT 'a  b'"), "SELECT 'a  b'")
+
+        cache = GoldResultCache(self.cache_dir)
+        cache.put("bank", self.db_path, "SELECT * FROM account", [(1, 10.0)])
+        self.assertEqual(cache.get("bank", self.db_path, "SELECT *  FROM account;"), [(1, 10.0)])
+        self.assertIsNone(cache.get("bank", self.db_path, "SELECT *  FROM account;", kind="fingerprint"))
+        self.assertEqual(cache.get_stats()["hits"], 1)
+
+    def test_changed_database_invalidates_its_entries(self):
+        cache = GoldResultCache(self.cache_dir)
+        cache.put("bank", self.db_path, "SELECT 1", [(1,)])
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT INTO account VALUES (3, 30.0)")
+        conn.commit()
+        conn.close()
+
+        self.assertIsNone(GoldResultCache(self.cache_dir).get("bank", self.db_path, "SELECT 1"))
+
+    def test_copies_of_a_database_keep_their_entries(self):
+        copy_path = os.path.join(self.tmp_dir.name, "optimized.sqlite")
+        shutil.copy(self.db_path, copy_path)
+
+        cache = GoldResultCache(self.cache_dir)
+        cache.put("bank", self.db_path, "SELECT 1", [(1,)])
+        cache.put("bank", copy_path, "SELECT 1", [(2,)])
+
+        for path, rows in ((self.db_path, [(1,)]), (copy_path, [(2,)]), (self.db_path, [(1,)])):
+            self.assertEqual(GoldResultCache(self.cache_dir).get("bank", path, "SELECT 1"), rows)
+
+    def test_dataset_fetches_the_fingerprint_streaming_reads(self):
+        dataset = TemporaryDataset(self.tmp_dir.name, {
+            "gold_result_cache": True, "gold_result_cache_path": self.cache_dir,
+            "result_comparison": STREAMING, "schema_catalog_cache": False})
+        gold_sql = "SELECT balance FROM account"
+
+        fingerprint = dataset.fetch_gold_fingerprint(gold_sql, "bank")
+        self.assertEqual(fingerprint.row_count, 2)
+        self.assertEqual(dataset.execute_queries_and_match_data(gold_sql, gold_sql, "bank"), 1)
+        self.assertEqual(dataset.gold_result_cache.get_stats()["hits"], 1)
+        dataset.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from run_gold_sql_timing import time_query, benchmark_query, explain_query_plan, group_summary, compare_with_baseline
+from utils.query_timeout import SUCCESS, ERROR, TIMEOUT
+from utils.stats import percentile, summarize
+from test_connection_pool import TemporaryDataset
+from test_query_timeout import ENDLESS_SQL
+
+
+def timed_query(index, db_id, outcome, cold, warm_p50, difficulty="simple"):
+    return {"index": index, "db_id": db_id, "sql": "SELECT " + str(index), "difficulty": difficulty,
+            "outcome": outcome, "cold": cold, "warm": {"p50": warm_p50}}
+
+
+class TestStats(unittest.TestCase):
+
+    def test_percentile_interpolates(self):
+        values = [4, 1, 3, 2]
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 50), 2.5)
+        self.assertEqual(percentile(values, 100), 4)
+        self.assertAlmostEqual(percentile(list(range(101)), 95), 95)
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize(self):
+        summary = summarize([1.0, 2.0, 3.0, 10.0])
+        self.assertEqual(summary["count"], 4)
+        self.assertEqual(summary["mean"], 4.0)
+        self.assertEqual(summary["p50"], 2.5)
+        self.assertEqual(summary["max"], 10.0)
+        self.assertLessEqual(summary["p95"], summary["p99"])
+        self.assertEqual(summarize([]), {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None})
+
+
+class TestGoldSqlTiming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.tmp_dir.name, "bank"))
+        conn = sqlite3.connect(os.path.join(self.tmp_dir.name, "bank", "bank.sqlite"))
+        conn.execute("CREATE TABLE account (account_id INTEGER PRIMARY KEY, balance REAL)")
+        conn.executemany("INSERT INTO account VALUES (?, ?)", [(i, float(i)) for i in range(10)])
+        conn.commit()
+        conn.close()
+        self.dataset = TemporaryDataset(self.tmp_dir.name, {"gold_sql_timeout": 0.05, "schema_catalog_cache": False})
+
+    def tearDown(self):
+        self.dataset.close()
+        self.tmp_dir.cleanup()
+
+
+    def test_time_query_outcomes(self):
+        conn = sqlite3.connect(":memory:")
+        outcome, elapsed, row_count = time_query(conn, "SELECT 1 UNION ALL SELECT 2")
+        self.assertEqual((outcome, row_count), (SUCCESS, 2))
+        self.assertGreaterEqual(elapsed, 0)
+        self.assertEqual(time_query(conn, "SELECT * FROM missing")[0], ERROR)
+        self.assertEqual(time_query(conn, ENDLESS_SQL, 0.05)[0], TIMEOUT)
+        conn.close()
+
+    def test_benchmark_query(self):
+        result = benchmark_query(self.dataset, "SELECT * FROM account", "bank", warmup=1, repeats=3)
+        self.assertEqual(result["outcome"], SUCCESS)
+        self.assertEqual(result["row_count"], 10)
+        self.assertEqual(len(result["warm_times"]), 3)
+        self.assertEqual(result["warm"]["count"], 3)
+
+        # Failing queries are not repeated
+        result = benchmark_query(self.dataset, ENDLESS_SQL, "bank", warmup=1, repeats=3)
+        self.assertEqual(result["outcome"], TIMEOUT)
+        self.assertEqual(result["warm_times"], [])
+
+    def test_explain_query_plan(self):
+        plan = explain_query_plan(self.dataset, "SELECT * FROM account WHERE account_id = 1", "bank")
+        self.assertIn("account", plan[0][2])
+        self.assertTrue(explain_query_plan(self.dataset, "SELECT * FROM missing", "bank")[0][2].startswith("error: "))
+
+    def test_group_summary_skips_failed_queries(self):
+        queries = [
+            timed_query(0, "bank", SUCCESS, 1.0, 0.5),
+            timed_query(1, "bank", SUCCESS, 3.0, 1.5),
+            timed_query(2, "shop", SUCCESS, 2.0, 1.0, "challenging"),
+            timed_query(3, "shop", TIMEOUT, 5.0, None),
+        ]
+        summary = group_summary(queries, "db_id")
+        self.assertEqual(list(summary), ["bank", "shop"])
+        self.assertEqual(summary["bank"]["cold"]["mean"], 2.0)
+        self.assertEqual(summary["bank"]["warm"]["p50"], 1.0)
+        self.assertEqual(summary["shop"]["cold"]["count"], 1)
+        self.assertEqual(list(group_summary(queries, "difficulty")), ["challenging", "simple"])
+
+    def test_compare_with_baseline(self):
+        baseline = {"queries": [
+            timed_query(0, "bank", SUCCESS, 1.0, 2.0),
+            timed_query(1, "bank", SUCCESS, 1.0, 1.0),
+            timed_query(2, "bank", ERROR, 1.0, None),
+        ]}
+        queries = [
+            timed_query(0, "bank", SUCCESS, 1.0, 0.5),
+            timed_query(1, "bank", SUCCESS, 1.0, 2.0),
+            timed_query(2, "bank", SUCCESS, 1.0, 1.0),
+            timed_query(3, "bank", SUCCESS, 1.0, 1.0),
+        ]
+        comparison = compare_with_baseline(queries, baseline)
+        self.assertEqual(comparison["queries"], {0: 4.0, 1: 0.5})
+        self.assertEqual(comparison["speedup"]["count"], 2)
+        self.assertEqual(comparison["speedup"]["max"], 4.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+
+import os
+import asyncio
+import tempfile
+from box import Box
+import unittest
+from langchain.chains import LLMChain
+from langchain.prompts import PromptTemplate
+from langchain.chat_models.fake import FakeListChatModel
+from utils.llm_cache import LLMResponseCache, CachedChain, LLMCacheMiss, REPLAY_ONLY, WRITE_ONLY
+from utils.token_counter import get_token_estimate
+
+
+class TestLLMResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "responses.sqlite")
+        self.prompt = PromptTemplate(input_variables=["question"], template="Question: {question}")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_chain(self, cache, responses, prompt_version="1"):
+        llm = FakeListChatModel(responses=responses)
+        return CachedChain(LLMChain(llm=llm, prompt=self.prompt), cache, prompt_version)
+
+
+    def test_read_through_reuses_responses(self):
+        cache = LLMResponseCache(self.path)
+        chain = self.make_chain(cache, ["SELECT 1", "SELECT 2"])
+
+        self.assertEqual(chain.run(question="a"), "SELECT 1")
+        self.assertEqual(chain.run(question="a"), "SELECT 1")
+        self.assertEqual(chain.run({"question": "b"}), "SELECT 2")
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_prompt_version_is_part_of_the_key(self):
+        cache = LLMResponseCache(self.path)
+        self.make_chain(cache, ["SELECT 1"], "1").run(question="a")
+        self.assertEqual(self.make_chain(cache, ["SELECT 2"], "2").run(question="a"), "SELECT 2")
+
+    def test_replay_only_fails_on_miss(self):
+        self.make_chain(LLMResponseCache(self.path, mode=WRITE_ONLY), ["SELECT 1"]).run(question="a")
+
+        chain = self.make_chain(LLMResponseCache(self.path, mode=REPLAY_ONLY), ["SELECT 2"])
+        self.assertEqual(chain.run(question="a"), "SELECT 1")
+        with self.assertRaises(LLMCacheMiss):
+            chain.run(question="b")
+
+    def test_cache_hits_are_counted_apart(self):
+        chain = self.make_chain(LLMResponseCache(self.path), ["SELECT 1", "SELECT 2"])
+        with get_token_estimate() as estimate:
+            chain.run(question="a")
+            asyncio.run(chain.arun(question="a"))
+
+        self.assertEqual((estimate.calls, estimate.cached_calls), (1, 1))
+
+    def test_experiment_runs_write_only_by_default(self):
+        cache = LLMResponseCache.from_config(Box({"llm_cache_path": self.path}))
+        chain = self.make_chain(cache, ["SELECT 1", "SELECT 2"])
+
+        self.assertEqual(cache.mode, WRITE_ONLY)
+        self.assertEqual(chain.run(question="a"), "SELECT 1")
+        self.assertEqual(chain.run(question="a"), "SELECT 2")
+        cache.close()
+
+    def test_eviction_keeps_the_cache_under_its_size(self):
+        cache = LLMResponseCache(self.path, max_bytes=200)
+        chain = self.make_chain(cache, ["x" * 100] * 5)
+        for question in "abcde":
+            chain.run(question=question)
+
+        self.assertGreater(cache.evictions, 0)
+        self.assertIsNotNone(cache.get(cache.conn.execute(
+            "SELECT key FROM responses ORDER BY last_used_at DESC LIMIT 1").fetchone()[0]))
+        self.assertLessEqual(cache.conn.execute("SELECT SUM(size) FROM responses").fetchone()[0], 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
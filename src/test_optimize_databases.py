@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from optimize_databases import optimize_database, verify_database, find_join_columns
+from utils.schema_catalog import SchemaCatalog
+
+
+GOLD_SQLS = [
+    "SELECT T2.amount FROM account AS T1 INNER JOIN trans AS T2 ON T1.account_id = T2.account_id WHERE T1.district_id = 1",
+    "SELECT COUNT(*) FROM trans WHERE amount > 100",
+    "SELECT * FROM missing_table"
+]
+
+
+class TestOptimizeDatabases(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.source_path = os.path.join(self.tmp_dir.name, "financial.sqlite")
+        self.target_path = os.path.join(self.tmp_dir.name, "optimized", "financial", "financial.sqlite")
+        conn = sqlite3.connect(self.source_path)
+        conn.execute("CREATE TABLE account (account_id INTEGER PRIMARY KEY, district_id INTEGER)")
+        conn.execute("CREATE TABLE trans (trans_id INTEGER PRIMARY KEY, account_id INTEGER, amount REAL)")
+        conn.executemany("INSERT INTO account VALUES (?, ?)", [(i, i % 5) for i in range(1, 101)])
+        conn.executemany("INSERT INTO trans VALUES (?, ?, ?)", [(i, i % 100 + 1, float(i)) for i in range(1, 1001)])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def test_join_columns_resolve_aliases(self):
+        join_columns = find_join_columns(GOLD_SQLS, ["account", "trans"])
+        self.assertEqual(join_columns[("account", "account_id")], 1)
+        self.assertEqual(join_columns[("trans", "account_id")], 1)
+
+    def test_optimized_copy_is_indexed_and_analyzed(self):
+        created = optimize_database(self.source_path, self.target_path, GOLD_SQLS, 4096, 1)
+
+        # account.account_id is the INTEGER PRIMARY KEY and needs no index
+        self.assertEqual(created, [("trans", "account_id")])
+        self.assertFalse(os.path.exists(self.target_path + ".tmp"))
+        conn = sqlite3.connect(self.target_path)
+        self.assertEqual(conn.execute("PRAGMA page_size").fetchone(), (4096,))
+        self.assertIsNotNone(conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone())
+        conn.close()
+
+    def test_catalog_hides_the_analyze_statistics(self):
+        optimize_database(self.source_path, self.target_path, GOLD_SQLS, 4096, 1)
+        conn = sqlite3.connect(self.target_path)
+        catalog = SchemaCatalog("financial", "1", lambda: conn)
+
+        self.assertEqual(catalog.get_table_names(), ["account", "trans"])
+        self.assertNotIn("sqlite_stat1", catalog.get_schema_and_sample_data())
+        self.assertEqual(catalog.get_row_counts(), {"account": 100, "trans": 1000})
+        conn.close()
+
+    def test_verify_matches_the_original(self):
+        optimize_database(self.source_path, self.target_path, GOLD_SQLS, 4096, 1)
+        verification = verify_database(self.source_path, self.target_path, GOLD_SQLS, 1)
+
+        self.assertEqual(verification["mismatches"], [])
+        self.assertGreater(verification["source_time"], 0)
+
+    def test_verify_reports_changed_results(self):
+        optimize_database(self.source_path, self.target_path, GOLD_SQLS, 4096, 1)
+        conn = sqlite3.connect(self.target_path)
+        conn.execute("DELETE FROM trans WHERE amount > 990")
+        conn.commit()
+        conn.close()
+
+        verification = verify_database(self.source_path, self.target_path, GOLD_SQLS, 1)
+        self.assertEqual(verification["mismatches"], GOLD_SQLS[:2])
+
+
+if __name__ == "__main__":
+    unittest.main()
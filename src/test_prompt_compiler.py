@@ -0,0 +1,73 @@
+import unittest
+from langchain.prompts import PromptTemplate
+from utils.prompt_compiler import compile_template, compile_sample_row, get_template_report
+from sql_agents.din_sql import SYSTEM_TEMPLATES
+
+
+TEMPLATE = """Schema of the database with sample rows and column descriptions:
+#
+CREATE TABLE users (
+        Id INTEGER PRIMARY KEY,
+        WebsiteUrl TEXT
+)
+/*
+2 rows from users table:
+Id	WebsiteUrl
+1  <p>http://www.example.com/some/very/long/path/to/a/page.html</p>
+2	A rather long description of a user that goes on and on
+*/
+Table: users
+Column Id: the id of the user
+Table: posts
+Column Id: the id of the user
+Column Body: the body of the post
+
+Q: "{question}"
+A: Let's think step by step."""
+
+
+class TestPromptCompiler(unittest.TestCase):
+
+    def test_keeps_input_variables_and_text(self):
+        compiled = compile_template(TEMPLATE)
+        self.assertEqual(PromptTemplate.from_template(compiled).input_variables, ["question"])
+        self.assertIn('Q: "{question}"\nA: Let\'s think step by step.', compiled)
+        self.assertIn("2 rows from users table:\nId\tWebsiteUrl\n", compiled)
+        self.assertIn("\n  Id INTEGER PRIMARY KEY,\n", compiled)
+
+    def test_shortens_sample_cells(self):
+        self.assertEqual(compile_sample_row("1  <p>http://www.example.com/some/page.html</p>"),
+                         "1\thttp://www.example.com/...")
+        compiled = compile_template(TEMPLATE)
+        self.assertIn("2\tA rather long description of a u...", compiled)
+        self.assertNotIn("<p>", compiled)
+
+    def test_value_glued_to_a_url_keeps_its_cell(self):
+        row = ("3       It's Winter     2006    http://mubi.com/films/its-winter        en      21      "
+               "https://images.mubicdn.net/images/film/3/cache-7929-1481539519/image-w1280.jpg82      "
+               "Rafi Pitts      http://mubi.com/cast/rafi-pitts")
+        self.assertEqual(compile_sample_row(row).split("\t"), [
+            "3", "It's Winter", "2006", "http://mubi.com/...", "en", "21",
+            "https://images.mubicdn.net/...", "82", "Rafi Pitts", "http://mubi.com/..."])
+        self.assertEqual(
+            compile_sample_row("https://a.net/image-w320.jpg?1564112978https://b.net/image-w320.jpg?1564675204"),
+            "https://a.net/...\thttps://b.net/...")
+
+    def test_dedupes_repeated_columns(self):
+        compiled = compile_template(TEMPLATE)
+        self.assertIn("Table: users\nColumn Id: the id of the user\n", compiled)
+        self.assertIn("Table: posts\nColumn Id: same as users.Id\nColumn Body: the body of the post", compiled)
+
+    def test_din_sql_templates(self):
+        for name, template in SYSTEM_TEMPLATES.items():
+            self.assertEqual(
+                set(PromptTemplate.from_template(compile_template(template)).input_variables),
+                set(PromptTemplate.from_template(template).input_variables), name)
+        report = get_template_report(SYSTEM_TEMPLATES)
+        self.assertEqual(set(report), set(SYSTEM_TEMPLATES) | {"total"})
+        self.assertGreater(report["total"]["saved"], 0)
+        self.assertLess(report["total"]["compact_tokens"], report["total"]["tokens"])
+
+
+if __name__ == '__main__':
+    unittest.main()
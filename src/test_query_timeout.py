@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from utils.query_timeout import QueryTimeout, QueryTimeoutError, TIMEOUT
+from test_connection_pool import TemporaryDataset
+
+
+ENDLESS_SQL = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c"
+
+
+class TestQueryTimeout(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.conn.close()
+
+
+    def test_long_query_is_interrupted(self):
+        with self.assertRaises(QueryTimeoutError):
+            with QueryTimeout(self.conn, 0.05) as budget:
+                self.conn.execute(ENDLESS_SQL).fetchall()
+        self.assertTrue(budget.timed_out)
+
+        # The progress handler is removed, so the connection is usable again
+        self.assertEqual(self.conn.execute("SELECT 1").fetchall(), [(1,)])
+
+    def test_no_budget(self):
+        with QueryTimeout(self.conn, None) as budget:
+            rows = self.conn.execute("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 1000) "
+                                     "SELECT COUNT(*) FROM c").fetchall()
+        self.assertEqual(rows, [(1000,)])
+        self.assertFalse(budget.timed_out)
+
+    def test_other_errors_are_kept(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            with QueryTimeout(self.conn, 10):
+                self.conn.execute("SELECT * FROM missing_table")
+
+
+class TestDatasetBudgets(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.tmp_dir.name, "bank"))
+        conn = sqlite3.connect(os.path.join(self.tmp_dir.name, "bank", "bank.sqlite"))
+        conn.execute("CREATE TABLE account (account_id INTEGER PRIMARY KEY)")
+        conn.commit()
+        conn.close()
+        self.dataset = TemporaryDataset(self.tmp_dir.name, {
+            "predicted_sql_timeout": 0.05, "gold_sql_timeout": 0.05, "schema_catalog_cache": False})
+
+    def tearDown(self):
+        self.dataset.close()
+        self.tmp_dir.cleanup()
+
+
+    def test_predicted_query_times_out(self):
+        self.assertEqual(self.dataset.execute_queries_and_match_data(ENDLESS_SQL, "SELECT 1", "bank"), 0)
+        self.assertEqual(self.dataset.last_predicted_outcome, TIMEOUT)
+
+    def test_gold_query_times_out(self):
+        self.assertEqual(self.dataset.execute_queries_and_match_data("SELECT 1", ENDLESS_SQL, "bank"), 0)
+        self.assertEqual(self.dataset.last_gold_outcome, TIMEOUT)
+        self.assertEqual(self.dataset.gold_outcomes[TIMEOUT], 1)
+        with self.assertRaises(QueryTimeoutError):
+            self.dataset.fetch_gold_result(ENDLESS_SQL, "bank")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+
+import unittest
+import openai
+from stub_llm_server import StubLLMServer, Cassette
+from utils.resilient_client import ResilientClient, DeadlineExceeded, is_retryable_error, get_retry_after
+
+
+class TestResilientClient(unittest.TestCase):
+
+    def create(self, client, server):
+        return client.chat_completion(model="gpt-3.5-turbo", messages=[{"role": "user", "content": "question"}],
+                                      api_base=server.api_base, api_key="stub")
+
+
+    def test_error_classification(self):
+        self.assertTrue(is_retryable_error(openai.error.RateLimitError("slow down", http_status=429)))
+        self.assertTrue(is_retryable_error(openai.error.APIError("server error", http_status=500)))
+        self.assertFalse(is_retryable_error(openai.error.InvalidRequestError("bad request", None, http_status=400)))
+        self.assertFalse(is_retryable_error(KeyError("choices")))
+
+    def test_retry_after(self):
+        self.assertEqual(get_retry_after(openai.error.RateLimitError("x", headers={"retry-after": "2"})), 2)
+        self.assertEqual(get_retry_after(openai.error.RateLimitError("Please try again in 120ms.")), 0.12)
+        self.assertIsNone(get_retry_after(openai.error.RateLimitError("x")))
+
+
+    def test_retries_until_success(self):
+        client = ResilientClient(initial_backoff=0.01)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise openai.error.ServiceUnavailableError("overloaded")
+            return "ok"
+
+        self.assertEqual(client.call(flaky), "ok")
+        self.assertEqual(client.get_stats()["retries_by_error"], {"ServiceUnavailableError": 2})
+
+    def test_fatal_errors_are_not_retried(self):
+        client = ResilientClient(initial_backoff=0.01)
+        with StubLLMServer(cassette=Cassette()) as server:
+            with self.assertRaises(openai.error.InvalidRequestError):
+                self.create(client, server)
+        self.assertEqual(client.get_stats()["retries"], 0)
+        self.assertEqual(client.get_stats()["failures"], 1)
+
+    def test_deadline(self):
+        client = ResilientClient(initial_backoff=0.01, deadline=0.5)
+        with StubLLMServer(error_rate_429=1) as server:
+            with self.assertRaises(DeadlineExceeded):
+                self.create(client, server)
+
+    def test_server_errors_are_retried(self):
+        client = ResilientClient(initial_backoff=0.01)
+        with StubLLMServer(responses=["SELECT 1"], error_rate_500=0.5, seed=3) as server:
+            for _ in range(5):
+                self.assertEqual(self.create(client, server).choices[0].message.content, "SELECT 1")
+        self.assertEqual(client.get_stats()["calls"], 5)
+        self.assertGreater(client.get_stats()["retries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+
+import sqlite3
+import unittest
+from collections import Counter
+from utils.result_comparison import fingerprint_rows, fingerprint_query, count_query_rows
+
+
+class TestResultComparison(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = sqlite3.connect(":memory:")
+        cls.conn.execute("CREATE TABLE trans (trans_id INTEGER, account_id INTEGER, amount REAL)")
+        cls.conn.executemany("INSERT INTO trans VALUES (?, ?, ?)",
+                             [(i, i % 7, float(i % 3)) for i in range(1, 1001)])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+
+    def test_fingerprint_is_order_independent(self):
+        ascending = fingerprint_query(self.conn, "SELECT account_id FROM trans ORDER BY trans_id", batch_size=64)
+        descending = fingerprint_query(self.conn, "SELECT account_id FROM trans ORDER BY trans_id DESC", batch_size=7)
+        self.assertEqual(ascending, descending)
+
+    def test_fingerprint_matches_counter_semantics(self):
+        rows_a = [(1, "a"), (1, "a"), (2.0, None)]
+        rows_b = [(2, None), (True, "a"), (1.0, "a")]
+        self.assertEqual(Counter(rows_a) == Counter(rows_b), fingerprint_rows(rows_a) == fingerprint_rows(rows_b))
+        self.assertNotEqual(fingerprint_rows(rows_a), fingerprint_rows(rows_a[:2]))
+
+    def test_duplicates_change_the_fingerprint(self):
+        self.assertNotEqual(fingerprint_rows([(1,), (1,), (2,)]), fingerprint_rows([(1,), (2,), (2,)]))
+
+    def test_streaming_stops_at_row_limit(self):
+        fingerprint = fingerprint_query(self.conn, "SELECT * FROM trans", batch_size=10, row_limit=25)
+        self.assertTrue(fingerprint.truncated)
+        self.assertEqual(fingerprint.row_count, 30)
+
+    def test_count_query_rows(self):
+        self.assertEqual(count_query_rows(self.conn, "SELECT * FROM trans WHERE account_id = 0; -- comment"), 142)
+
+
+if __name__ == "__main__":
+    unittest.main()
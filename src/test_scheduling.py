@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from scheduling import schedule_by_database, schedule_longest_first, load_latency_history, LatencyRecorder
+from test_connection_pool import TemporaryDataset
+
+
+DATA_POINTS = [
+    {"db_id": "bank", "question": "q0"},
+    {"db_id": "shop", "question": "q1"},
+    {"db_id": "bank", "question": "q2"},
+    {"db_id": "school", "question": "q3"},
+    {"db_id": "shop", "question": "q4"},
+]
+
+
+class TestScheduling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.history_path = os.path.join(self.tmp_dir.name, "results", "latency_history.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def test_questions_are_grouped_by_database(self):
+        self.assertEqual(schedule_by_database(DATA_POINTS), [0, 2, 1, 4, 3])
+        self.assertEqual(schedule_by_database([]), [])
+
+    def test_longest_questions_come_first(self):
+        history = {"q0": 1.0, "q1": 5.0, "q3": 2.0, "q4": 2.0}
+        # q2 is expected to take the mean of 2.5 seconds, ties keep the database order
+        self.assertEqual(schedule_longest_first(DATA_POINTS, history), [1, 2, 4, 3, 0])
+        self.assertEqual(schedule_longest_first(DATA_POINTS, {}), schedule_by_database(DATA_POINTS))
+
+    def test_recorded_latencies_are_merged_into_the_history(self):
+        self.assertEqual(load_latency_history(self.history_path), {})
+        self.assertEqual(load_latency_history(None), {})
+
+        recorder = LatencyRecorder()
+        recorder.record("q0", 1.0)
+        recorder.record("q1", 2.0)
+        recorder.save(self.history_path)
+
+        recorder = LatencyRecorder()
+        recorder.record("q1", 3.0)
+        recorder.save(self.history_path)
+        self.assertEqual(load_latency_history(self.history_path), {"q0": 1.0, "q1": 3.0})
+
+    def test_dataset_schedule(self):
+        dataset = TemporaryDataset(self.tmp_dir.name, {
+            "latency_history_path": self.history_path, "schema_catalog_cache": False})
+        dataset.data = DATA_POINTS
+
+        self.assertEqual(dataset.get_schedule(), [0, 1, 2, 3, 4])
+        self.assertEqual(dataset.get_schedule("database"), [0, 2, 1, 4, 3])
+
+        recorder = LatencyRecorder()
+        recorder.record("q3", 10.0)
+        recorder.record("q0", 1.0)
+        recorder.save(dataset.get_latency_history_path())
+        self.assertEqual(dataset.get_schedule("longest_first"), [3, 2, 1, 4, 0])
+
+        with self.assertRaises(ValueError):
+            dataset.get_schedule("random")
+        dataset.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from utils.schema_catalog import SchemaCatalogCache
+
+
+class TestSchemaCatalogCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, "schema_catalog")
+        self.db_paths = {}
+        self.connections = {}
+        for db_name in ("bank", "shop"):
+            self.db_paths[db_name] = os.path.join(self.tmp_dir.name, db_name + ".sqlite")
+            conn = sqlite3.connect(self.db_paths[db_name])
+            conn.execute("CREATE TABLE item (item_id INTEGER PRIMARY KEY, name TEXT)")
+            conn.executemany("INSERT INTO item VALUES (?, ?)", [(i, "item " + str(i)) for i in range(5)])
+            conn.commit()
+            self.connections[db_name] = conn
+        self.connect_calls = 0
+
+    def tearDown(self):
+        for conn in self.connections.values():
+            conn.close()
+        self.tmp_dir.cleanup()
+
+
+    def get_catalog(self, cache, db_name):
+        def connect():
+            self.connect_calls += 1
+            return self.connections[db_name]
+        return cache.get_catalog(db_name, self.db_paths[db_name], connect)
+
+    def test_information_is_computed_once(self):
+        cache = SchemaCatalogCache(cache_dir=None)
+        schema = self.get_catalog(cache, "bank").get_create_statements()
+        self.assertIn("CREATE TABLE item", schema)
+
+        calls = self.connect_calls
+        self.assertEqual(self.get_catalog(cache, "bank").get_create_statements(), schema)
+        self.assertEqual(self.connect_calls, calls)
+        self.assertEqual(cache.get_stats()["hits"], 1)
+        self.assertEqual(cache.get_stats()["misses"], 1)
+
+    def test_renderings_are_cached_independently(self):
+        catalog = self.get_catalog(SchemaCatalogCache(cache_dir=None), "bank")
+        create_statements = catalog.get_create_statements()
+        with_samples = catalog.get_schema_and_sample_data()
+        self.assertNotEqual(create_statements, with_samples)
+        self.assertIn("item 1", with_samples)
+        self.assertEqual(catalog.get_create_statements(), create_statements)
+
+    def test_schema_change_invalidates_the_catalog(self):
+        cache = SchemaCatalogCache(cache_dir=None)
+        self.assertEqual(self.get_catalog(cache, "bank").get_table_names(), ["item"])
+
+        self.connections["bank"].execute("CREATE TABLE customer (customer_id INTEGER PRIMARY KEY)")
+        self.connections["bank"].commit()
+        os.utime(self.db_paths["bank"], ns=(0, 0))
+        self.assertEqual(self.get_catalog(cache, "bank").get_table_names(), ["item", "customer"])
+        self.assertEqual(cache.get_stats()["misses"], 2)
+
+    def test_catalogs_are_reloaded_from_disk(self):
+        schema = self.get_catalog(SchemaCatalogCache(cache_dir=self.cache_dir), "bank").get_create_statements()
+
+        cache = SchemaCatalogCache(cache_dir=self.cache_dir)
+        catalog = self.get_catalog(cache, "bank")
+        calls = self.connect_calls
+        self.assertEqual(catalog.get_create_statements(), schema)
+        self.assertEqual(self.connect_calls, calls)
+        self.assertEqual(cache.get_stats()["disk_hits"], 1)
+
+    def test_corrupt_catalog_file_is_ignored(self):
+        os.makedirs(self.cache_dir)
+        with open(os.path.join(self.cache_dir, "bank.pkl"), "wb") as f:
+            f.write(b"not a pickle")
+        cache = SchemaCatalogCache(cache_dir=self.cache_dir)
+        self.assertEqual(self.get_catalog(cache, "bank").get_table_names(), ["item"])
+        self.assertEqual(cache.get_stats()["disk_hits"], 0)
+
+    def test_least_recently_used_catalog_is_evicted(self):
+        cache = SchemaCatalogCache(max_bytes=1, cache_dir=None)
+        self.get_catalog(cache, "bank").get_schema_and_sample_data()
+        self.get_catalog(cache, "shop").get_schema_and_sample_data()
+        self.assertEqual(list(cache.catalogs), ["shop"])
+
+        cache = SchemaCatalogCache(cache_dir=None)
+        self.get_catalog(cache, "bank")
+        self.get_catalog(cache, "shop")
+        self.get_catalog(cache, "bank")
+        self.assertEqual(list(cache.catalogs), ["shop", "bank"])
+
+    def test_only_the_analyze_tables_are_hidden(self):
+        conn = self.connections["bank"]
+        conn.execute("CREATE TABLE account (account_id INTEGER PRIMARY KEY AUTOINCREMENT, balance REAL)")
+        conn.execute("INSERT INTO account (balance) VALUES (10.0)")
+        # "_" is a LIKE wildcard, this name must not match sqlite_stat%
+        conn.execute("CREATE TABLE sqlitexstats (stat TEXT)")
+        conn.commit()
+        # The CREATE statements as they were listed before the optimized copies
+        baseline = "\n".join(row[0] for row in conn.execute("SELECT sql FROM sqlite_master WHERE type='table';"))
+
+        conn.execute("ANALYZE")
+        conn.commit()
+        catalog = self.get_catalog(SchemaCatalogCache(cache_dir=None), "bank")
+        self.assertEqual(catalog.get_table_names(), ["item", "account", "sqlite_sequence", "sqlitexstats"])
+        self.assertEqual(catalog.get_create_statements(), baseline)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from utils.schema_catalog import SchemaCatalog
+from utils.schema_pruning import prune_schema, connect_tables, get_join_graph
+
+
+class TestSchemaPruning(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "financial.sqlite")
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE district (district_id INTEGER PRIMARY KEY, A2 TEXT)")
+        conn.execute("CREATE TABLE account (account_id INTEGER PRIMARY KEY, district_id INTEGER, "
+                     "FOREIGN KEY (district_id) REFERENCES district (district_id))")
+        conn.execute("CREATE TABLE trans (trans_id INTEGER PRIMARY KEY, account_id INTEGER, amount REAL, "
+                     "FOREIGN KEY (account_id) REFERENCES account (account_id))")
+        conn.execute("CREATE TABLE loan (loan_id INTEGER PRIMARY KEY, account_id INTEGER, "
+                     "FOREIGN KEY (account_id) REFERENCES account (account_id))")
+        conn.execute("CREATE TABLE card (card_id INTEGER PRIMARY KEY, type TEXT)")
+        conn.execute("INSERT INTO district VALUES (1, 'Prague')")
+        conn.commit()
+        self.conn = conn
+        self.catalog = SchemaCatalog("financial", "1", lambda: self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp_dir.cleanup()
+
+    def test_bridge_tables(self):
+        pruned = prune_schema(self.catalog, ["trans.amount", "district.A2 = 'Prague'"])
+        self.assertEqual(pruned.tables, ["district", "account", "trans"])
+        self.assertEqual(pruned.bridge_tables, ["account"])
+        self.assertIn("CREATE TABLE account", pruned.schema)
+        self.assertIn("Prague", pruned.schema)
+        self.assertNotIn("CREATE TABLE loan", pruned.schema)
+
+    def test_unlinked_and_unknown_tables(self):
+        self.assertIsNone(prune_schema(self.catalog, ["Prague", "balance.amount"]))
+        self.assertEqual(prune_schema(self.catalog, ["card.type", "loan.loan_id"]).tables, ["loan", "card"])
+
+    def test_connect_tables(self):
+        graph = get_join_graph(self.catalog)
+        self.assertEqual(connect_tables(["loan", "trans"], graph), ["loan", "account", "trans"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+
+import os
+import asyncio
+import sqlite3
+import tempfile
+import threading
+import unittest
+from utils.connection_pool import ConnectionPool
+from utils.schema_catalog import SchemaCatalogCache
+from utils.sql_validator import (
+    SQLValidator, COMPILE_ERROR, UNKNOWN_IDENTIFIER, MISSING_JOIN_KEY, EMPTY_RESULT, NULL_RESULT, NOT_A_SELECT,
+    has_join_without_condition
+)
+
+
+class FakeDataset:
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection_pool = ConnectionPool()
+        self.schema_catalog_cache = SchemaCatalogCache(cache_dir=None)
+        self.schema_catalog_lock = threading.Lock()
+
+    def get_db_path(self, db_name):
+        return self.db_path
+
+
+class TestSQLValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(self.tmp_dir.name, "bank.sqlite")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE account (account_id INTEGER PRIMARY KEY, district_id INTEGER)")
+        conn.execute("CREATE TABLE district (district_id INTEGER PRIMARY KEY, name TEXT)")
+        conn.executemany("INSERT INTO account VALUES (?, ?)", [(1, 1), (2, 2)])
+        conn.executemany("INSERT INTO district VALUES (?, ?)", [(1, "Prague"), (2, "Brno")])
+        conn.commit()
+        conn.close()
+        self.dataset = FakeDataset(db_path)
+        self.validator = SQLValidator(self.dataset)
+
+    def tearDown(self):
+        self.validator.close()
+        self.dataset.connection_pool.close_all()
+        self.tmp_dir.cleanup()
+
+    def validate(self, sql):
+        return self.validator.validate(sql, "bank")
+
+    def test_valid_query(self):
+        result = self.validate("SELECT T1.account_id FROM account AS T1 INNER JOIN district AS T2 "
+                               "ON T1.district_id = T2.district_id WHERE T2.name = 'Prague'")
+        self.assertTrue(result.valid)
+        self.assertEqual(result.reasons, [])
+
+    def test_invalid_queries(self):
+        self.assertEqual(self.validate("SELECT * FROM table LIMIT 1;").reasons, [COMPILE_ERROR])
+        self.assertEqual(self.validate("SELECT balance FROM account").reasons, [COMPILE_ERROR])
+        self.assertEqual(self.validate("DELETE FROM account").reasons, [NOT_A_SELECT])
+        self.assertEqual(self.validate(None).reasons, [NOT_A_SELECT])
+        self.assertIn(UNKNOWN_IDENTIFIER, self.validate('SELECT account_id FROM account WHERE "District_Name" = 1').reasons)
+        self.assertIn(MISSING_JOIN_KEY, self.validate("SELECT name FROM account JOIN district").reasons)
+        self.assertEqual(self.validate("SELECT name FROM district WHERE name = 'Pilsen'").reasons, [EMPTY_RESULT])
+        self.assertEqual(self.validate("SELECT MAX(name) FROM district WHERE name = 'Pilsen'").reasons, [NULL_RESULT])
+        self.assertEqual(self.validator.get_stats()["valid"], 0)
+
+    def test_validation_on_worker_threads(self):
+        async def validate_concurrently():
+            return await asyncio.gather(*[
+                asyncio.to_thread(self.validate, sql) for sql in (
+                    "SELECT name FROM district WHERE name = 'Brno'",
+                    'SELECT account_id FROM account WHERE "District_Name" = 1',
+                    "SELECT name FROM district WHERE name = 'Pilsen'")
+            ])
+
+        results = asyncio.run(validate_concurrently())
+        self.assertTrue(results[0].valid)
+        self.assertIn(UNKNOWN_IDENTIFIER, results[1].reasons)
+        self.assertEqual(results[2].reasons, [EMPTY_RESULT])
+
+        # The threads used their own read-only connections, closed with the validator
+        self.assertEqual(len(self.dataset.connection_pool.connections), 0)
+        pools = list(self.validator.pools)
+        self.assertGreater(len(pools), 0)
+        self.validator.close()
+        self.assertTrue(all(len(pool.connections) == 0 for pool in pools))
+
+    def test_join_conditions(self):
+        self.assertFalse(has_join_without_condition("SELECT * FROM a JOIN b USING (id) JOIN c ON b.id = c.id"))
+        self.assertFalse(has_join_without_condition("SELECT * FROM a NATURAL JOIN b"))
+        self.assertTrue(has_join_without_condition("SELECT * FROM a JOIN b ON a.id = b.id JOIN c WHERE c.x = 1"))
+        self.assertTrue(has_join_without_condition("SELECT * FROM a, b"))
+        self.assertFalse(has_join_without_condition("SELECT * FROM a, b WHERE a.id = b.id"))
+        self.assertTrue(has_join_without_condition("SELECT * FROM a, b ORDER BY a.id"))
+        self.assertFalse(has_join_without_condition("SELECT * FROM a ORDER BY a.id, a.name"))
+        self.assertFalse(has_join_without_condition("SELECT x, COUNT(*) FROM a GROUP BY x, y LIMIT 1, 2"))
+        self.assertFalse(has_join_without_condition("SELECT * FROM (SELECT a, b FROM c) AS t ORDER BY a, b"))
+
+    def test_single_table_order_by_is_valid(self):
+        result = self.validate("SELECT account_id, district_id FROM account ORDER BY district_id, account_id")
+        self.assertTrue(result.valid)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+
+import os
+import json
+import time
+import asyncio
+import tempfile
+import unittest
+from langchain.chat_models import ChatOpenAI
+from stub_llm_server import StubLLMServer
+from sql_agents.din_sql import DinSQLAgent, predict_label
+from utils.stage_metrics import StageLedger
+from utils.sql_validator import ValidationResult
+from utils.schema_pruning import PrunedSchema
+
+
+RESPONSES = [
+    "Schema_links: [account.account_id]",
+    'Label: "EASY"',
+    "SQL: SELECT account_id FROM account",
+    "Revised_SQL: SELECT account.account_id FROM account"
+]
+
+
+class TestStageLedger(unittest.TestCase):
+
+    def test_failed_attempts_are_counted_as_retries(self):
+        ledger = StageLedger()
+        with ledger.measure("classification"):
+            pass
+        with self.assertRaises(ValueError):
+            with ledger.measure("classification"):
+                raise ValueError()
+
+        summary = ledger.summarize()["classification"]
+        self.assertEqual(summary["calls"], 1)
+        self.assertEqual(summary["retries"], 1)
+        self.assertEqual(summary["wall_time"]["count"], 1)
+        self.assertIn("p99", summary["wall_time"])
+
+    def test_din_sql_stages(self):
+        with StubLLMServer(responses=RESPONSES) as server:
+            llm = ChatOpenAI(openai_api_base=server.api_base, openai_api_key="stub", max_retries=0)
+            agent = DinSQLAgent(llm)
+            query = agent.generate_query("CREATE TABLE account (account_id INTEGER)", "", "", "Which accounts?")
+            _, usage = asyncio.run(agent.agenerate_query("CREATE TABLE account (account_id INTEGER)", "", "", "Which accounts?"))
+
+        self.assertEqual(query, "SELECT account.account_id FROM account")
+        summary = agent.stage_ledger.summarize()
+        self.assertEqual(list(summary), ["schema_linking", "classification", "easy", "self_correction"])
+        self.assertTrue(all(stage["calls"] == 2 for stage in summary.values()))
+
+        # The usage of a question is the sum of its stages, and the totals of the agent the sum of the questions
+        self.assertEqual(list(usage["stages"]), list(summary))
+        self.assertEqual(usage["total_tokens"] * 2, sum(stage["prompt_tokens"] + stage["completion_tokens"] for stage in summary.values()))
+        self.assertEqual(agent.total_tokens, usage["total_tokens"])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "results", "stage_metrics.json")
+            agent.stage_ledger.save(path)
+            with open(path) as f:
+                self.assertEqual(len(json.load(f)["records"]), 8)
+
+
+class FakeChain:
+
+    def __init__(self, output, latency=0.2):
+        self.output = output
+        self.latency = latency
+        self.calls = 0
+
+    async def arun(self, **inputs):
+        self.calls += 1
+        self.inputs = inputs
+        await asyncio.sleep(self.latency)
+        return self.output
+
+    def count_prompt_tokens(self, inputs):
+        return 100
+
+    def get_config(self):
+        return {"output": self.output}
+
+
+class FakeGate:
+
+    def __init__(self, valid):
+        self.valid = valid
+
+    def validate(self, sql, db_name):
+        return ValidationResult(self.valid, [] if self.valid else ["empty_result"])
+
+
+class TestSpeculation(unittest.TestCase):
+
+    def create_agent(self, speculation, label):
+        agent = DinSQLAgent(ChatOpenAI(openai_api_key="stub"), speculation=speculation)
+        agent.schema_link_chain = FakeChain("Schema_links: [account.account_id]")
+        agent.classification_chain = FakeChain(f'Label: "{label}"')
+        agent.easy_chain = FakeChain("SQL: SELECT 1")
+        agent.medium_chain = FakeChain("SQL: SELECT 2", latency=1)
+        agent.hard_chain = FakeChain("SQL: SELECT 3")
+        agent.correction_chain = FakeChain("The query is correct.")
+        return agent
+
+    def generate(self, agent, db_name=None):
+        start = time.perf_counter()
+        query, usage = asyncio.run(agent.agenerate_query(
+            "CREATE TABLE account (account_id INTEGER)", "", "", "Which accounts?", db_name=db_name))
+        return query, usage, time.perf_counter() - start
+
+    def test_predict_label(self):
+        self.assertEqual(predict_label("How many accounts?", "", ["account.account_id"]), "EASY")
+        self.assertEqual(predict_label("How many loans?", "", ["account.account_id = loan.account_id"]), "NON-NESTED")
+        self.assertEqual(predict_label("Which clients never took a loan?", "", ["client.client_id"]), "NESTED")
+
+    def test_hit_saves_a_round_trip(self):
+        query, usage, elapsed = self.generate(self.create_agent("predicted", "EASY"))
+        self.assertEqual(query, "SELECT 1")
+        self.assertEqual(usage["speculation"], "hit")
+        self.assertLess(elapsed, 0.75)
+
+    def test_miss_cancels_the_speculative_call(self):
+        agent = self.create_agent("all", "EASY")
+        query, usage, elapsed = self.generate(agent)
+        self.assertEqual(query, "SELECT 1")
+        self.assertEqual(usage["speculation"], "hit")
+        self.assertLess(elapsed, 0.75)
+        self.assertEqual(agent.stage_ledger.summarize()["non_nested"]["discarded"], 1)
+
+        agent = self.create_agent("predicted", "NON-NESTED")
+        query, usage, _ = self.generate(agent)
+        self.assertEqual(query, "SELECT 2")
+        self.assertEqual(usage["speculation"], "miss")
+        self.assertEqual(list(usage["stages"]), ["schema_linking", "classification", "non_nested", "self_correction"])
+        self.assertEqual(agent.stage_ledger.summarize()["easy"]["discarded"], 1)
+
+    def test_correction_gate(self):
+        agent = self.create_agent("off", "EASY")
+        agent.correction_gate = FakeGate(valid=True)
+        query, usage, _ = self.generate(agent, db_name="bank")
+        self.assertEqual(query, "SELECT 1")
+        self.assertEqual(usage["correction"], "skipped")
+        self.assertEqual(agent.correction_chain.calls, 0)
+        self.assertIn("correction_gate", usage["stages"])
+
+        agent.correction_gate = FakeGate(valid=False)
+        _, usage, _ = self.generate(agent, db_name="bank")
+        self.assertEqual(usage["correction"], "sent")
+        self.assertEqual(usage["correction_reasons"], ["empty_result"])
+        self.assertEqual(agent.correction_chain.calls, 1)
+
+    def test_schema_pruning(self):
+        agent = self.create_agent("off", "EASY")
+        agent.schema_pruner = lambda db_name, schema_links: PrunedSchema("CREATE TABLE a (b)", "", ["a"], [])
+        _, usage, _ = self.generate(agent, db_name="bank")
+        self.assertEqual(usage["pruned_tables"], ["a"])
+        self.assertEqual(agent.classification_chain.inputs["schema"], "CREATE TABLE a (b)")
+        self.assertEqual(agent.correction_chain.inputs["schema"], "CREATE TABLE a (b)")
+
+        # A pruned schema longer than the given one is not used
+        agent.schema_pruner = lambda db_name, schema_links: PrunedSchema("CREATE TABLE a (b)" * 10, "", ["a"], [])
+        _, usage, _ = self.generate(agent, db_name="bank")
+        self.assertIsNone(usage["pruned_tables"])
+
+    def test_off(self):
+        agent = self.create_agent("off", "EASY")
+        _, usage, _ = self.generate(agent)
+        self.assertIsNone(usage["speculation"])
+        self.assertEqual(agent.medium_chain.calls + agent.easy_chain.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
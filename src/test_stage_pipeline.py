@@ -0,0 +1,99 @@
+
+import os
+import asyncio
+import tempfile
+import unittest
+from langchain.chat_models import ChatOpenAI
+from sql_agents.din_sql import DinSQLAgent
+from utils.stage_pipeline import StageStore, StagePipeline, PipelineStage
+from test_stage_metrics import FakeChain
+
+
+class TestStageStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "results", "stages.jsonl")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_reload_skips_truncated_line(self):
+        store = StageStore(self.path)
+        store.put("q1", "schema_linking", "a", {"schema_links": ["account.account_id"]})
+        store.put("q1", "schema_linking", "a", {"schema_links": ["loan.loan_id"]})
+        store.close()
+        with open(self.path, 'a') as f:
+            f.write('{"question": "q2", "sta')
+
+        store = StageStore(self.path)
+        self.assertEqual(store.get("q1", "schema_linking", "a"), {"schema_links": ["loan.loan_id"]})
+        self.assertIsNone(store.get("q1", "schema_linking", "b"))
+        self.assertEqual(store.get_stats()["stored"], 1)
+        store.close()
+
+    def test_pipeline_reruns_changed_stages(self):
+        calls = []
+
+        def stage(name, output):
+            async def run(state):
+                calls.append(name)
+                return {name: output(state)}
+            return run
+
+        def create_pipeline(store, suffix):
+            return StagePipeline([
+                PipelineStage("first", ("question",), stage("first", lambda state: state["question"].upper())),
+                PipelineStage("second", ("first",), stage("second", lambda state: state["first"] + suffix),
+                              lambda state: {"suffix": suffix})
+            ], store)
+
+        store = StageStore(self.path)
+        state = {"question": "q"}
+        self.assertEqual(asyncio.run(create_pipeline(store, "!").arun("q", state)), [])
+        self.assertEqual(state["second"], "Q!")
+
+        state = {"question": "q"}
+        self.assertEqual(asyncio.run(create_pipeline(store, "?").arun("q", state)), ["first"])
+        self.assertEqual(state["second"], "Q?")
+        self.assertEqual(calls, ["first", "second", "second"])
+        store.close()
+
+
+class TestDinSQLCheckpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "stages.jsonl")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def create_agent(self, store, correction):
+        agent = DinSQLAgent(ChatOpenAI(openai_api_key="stub"), stage_store=store)
+        agent.schema_link_chain = FakeChain("Schema_links: [account.account_id]", latency=0)
+        agent.classification_chain = FakeChain('Label: "EASY"', latency=0)
+        agent.easy_chain = FakeChain("SQL: SELECT account_id FROM account", latency=0)
+        agent.correction_chain = FakeChain(correction, latency=0)
+        return agent
+
+    def test_resume_with_new_correction_prompt(self):
+        store = StageStore(self.path)
+        agent = self.create_agent(store, "Revised_SQL: SELECT 1")
+        query, usage = asyncio.run(agent.agenerate_query("CREATE TABLE account (account_id)", "", "", "Which accounts?"))
+        self.assertEqual(query, "SELECT 1")
+        self.assertEqual(usage["reused_stages"], [])
+        store.close()
+
+        store = StageStore(self.path)
+        agent = self.create_agent(store, "Revised_SQL: SELECT 2")
+        query, usage = asyncio.run(agent.agenerate_query("CREATE TABLE account (account_id)", "", "", "Which accounts?"))
+        self.assertEqual(query, "SELECT 2")
+        self.assertEqual(usage["reused_stages"], ["schema_linking", "classification", "sql_generation"])
+        self.assertEqual(list(usage["stages"]), ["self_correction"])
+        self.assertEqual(agent.schema_link_chain.calls + agent.classification_chain.calls + agent.easy_chain.calls, 0)
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import json
+import tempfile
+import unittest
+from box import Box
+from datasets import BIRDDataset
+from utils.utils import iter_json_array, parse_name_list
+
+
+class TemporaryBIRDDataset(BIRDDataset):
+
+    def __init__(self, tmp_dir, config):
+        self.BASE_DB_PATH = tmp_dir
+        self.DEV_DB_PATH = tmp_dir
+        self.TRAIN_DATA_PATH = os.path.join(tmp_dir, "train.json")
+        self.DEV_DATA_PATH = os.path.join(tmp_dir, "dev.json")
+        self.test_config = config
+        super().__init__()
+
+    def load_config(self):
+        self.config = Box(self.test_config)
+
+
+def write_json(path, value):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(value, f, indent=2)
+
+
+def bird_record(db_id, difficulty, question):
+    return {"db_id": db_id, "question": question, "evidence": "", "SQL": "SELECT 1", "difficulty": difficulty}
+
+
+class TestIterJsonArray(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "data.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def test_elements_match_json_load_for_any_chunk_size(self):
+        value = [
+            {"question": "Which [bracket], \"quoted\" or , comma?", "ids": [1, 2, [3]]},
+            "a string with ] and ,",
+            12.5, None, True, {"unicode": "café ü"}, []
+        ]
+        write_json(self.path, value)
+        for chunk_size in (1, 2, 7, 65536):
+            self.assertEqual(list(iter_json_array(self.path, chunk_size)), value)
+
+    def test_numbers_split_across_chunks_are_not_truncated(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("[123456789,  987654321 ]")
+        self.assertEqual(list(iter_json_array(self.path, 3)), [123456789, 987654321])
+
+    def test_empty_array(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("  [ \n ]  ")
+        self.assertEqual(list(iter_json_array(self.path)), [])
+
+    def test_invalid_files_raise(self):
+        for text in ('{"a": 1}', '[1, 2', '[{"a": }]'):
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(text)
+            with self.assertRaises(ValueError):
+                list(iter_json_array(self.path, 4))
+
+
+class TestParseNameList(unittest.TestCase):
+
+    def test_lists_and_block_strings(self):
+        self.assertEqual(parse_name_list(["financial", " card_games "]), {"financial", "card_games"})
+        self.assertEqual(parse_name_list("financial\n\n  card_games\n"), {"financial", "card_games"})
+
+    def test_empty_values(self):
+        self.assertIsNone(parse_name_list(None))
+        self.assertIsNone(parse_name_list(""))
+        self.assertIsNone(parse_name_list([]))
+
+
+class TestBIRDLoading(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        write_json(os.path.join(self.tmp_dir.name, "dev.json"), [
+            bird_record("financial", "simple", "q0"),
+            bird_record("card_games", "simple", "q1"),
+            bird_record("financial", "challenging", "q2"),
+            bird_record("financial", "simple", "q3"),
+        ])
+        write_json(os.path.join(self.tmp_dir.name, "train.json"), [bird_record("financial", "", "t0")])
+        self.config = {
+            "bird_difficulties": ["simple", "challenging"],
+            "bird_train_domains": ["financial"],
+            "bird_dev_domains": ["financial"],
+            "bird_description_cache": False,
+            "schema_catalog_cache": False
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+    def test_questions_are_filtered_while_loading(self):
+        dataset = TemporaryBIRDDataset(self.tmp_dir.name, self.config)
+        self.assertEqual([data_point['question'] for data_point in dataset.data], ["q0", "q2", "q3"])
+
+        self.config["bird_difficulties"] = "simple"
+        dataset = TemporaryBIRDDataset(self.tmp_dir.name, self.config)
+        self.assertEqual([data_point['question'] for data_point in dataset.data], ["q0", "q3"])
+
+    def test_train_split_is_behind_a_flag(self):
+        self.config["bird_load_train_split"] = True
+        dataset = TemporaryBIRDDataset(self.tmp_dir.name, self.config)
+        self.assertEqual([data_point['question'] for data_point in dataset.data], ["q0", "q2", "q3", "t0"])
+
+    def test_indexes(self):
+        self.config["bird_dev_domains"] = ["financial", "card_games"]
+        dataset = TemporaryBIRDDataset(self.tmp_dir.name, self.config)
+
+        self.assertEqual(dataset.get_indices(), [0, 1, 2, 3])
+        self.assertEqual(dataset.get_indices(db_id="financial"), [0, 2, 3])
+        self.assertEqual(dataset.get_indices(difficulty="simple"), [0, 1, 3])
+        self.assertEqual(dataset.get_indices(db_id="financial", difficulty="simple"), [0, 3])
+        self.assertEqual(dataset.get_indices(db_id="missing"), [])
+        self.assertEqual([(index, data_point['question']) for index, data_point
+                          in dataset.iter_data_points(db_id="card_games")], [(1, "q1")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+
+import os
+import json
+import time
+import tempfile
+import unittest
+import openai
+from langchain.chat_models import ChatOpenAI
+from langchain.schema import HumanMessage
+from stub_llm_server import StubLLMServer, Cassette
+
+
+class TestStubLLMServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def create(self, server, content="question", **kwargs):
+        return openai.ChatCompletion.create(
+            model="gpt-3.5-turbo", messages=[{"role": "user", "content": content}],
+            api_base=server.api_base, api_key="stub", **kwargs)
+
+
+    def test_scripted_responses_with_n(self):
+        with StubLLMServer(responses=["SELECT 1", "SELECT 2"]) as server:
+            completion = self.create(server, n=3)
+
+        self.assertEqual([choice.message.content for choice in completion.choices], ["SELECT 1", "SELECT 2", "SELECT 1"])
+        self.assertEqual(completion["usage"]["total_tokens"],
+                         completion["usage"]["prompt_tokens"] + completion["usage"]["completion_tokens"])
+
+    def test_chat_openai(self):
+        with StubLLMServer(responses=["SELECT 1"]) as server:
+            llm = ChatOpenAI(openai_api_base=server.api_base, openai_api_key="stub", max_retries=0)
+            self.assertEqual(llm([HumanMessage(content="question")]).content, "SELECT 1")
+
+    def test_injected_errors(self):
+        with StubLLMServer(error_rate_429=1) as server:
+            with self.assertRaises(openai.error.RateLimitError):
+                self.create(server)
+        with StubLLMServer(error_rate_500=1) as server:
+            with self.assertRaises(openai.error.APIError):
+                self.create(server)
+            self.assertEqual(server.stats["server_errors"], 1)
+
+    def test_requests_per_minute(self):
+        with StubLLMServer(requests_per_minute=2) as server:
+            self.create(server)
+            self.create(server)
+            with self.assertRaises(openai.error.RateLimitError):
+                self.create(server)
+
+
+    def test_record_and_replay_cassette(self):
+        path = os.path.join(self.tmp_dir.name, "cassette.jsonl")
+        with StubLLMServer(responses=["SELECT 1"], record_path=path, latency="constant:0.2") as server:
+            self.create(server, "recorded")
+
+        with open(path) as f:
+            self.assertEqual(json.loads(f.readline())["latency"], 0.2)
+
+        with StubLLMServer(cassette=Cassette(path), replay_latency=True) as server:
+            start = time.perf_counter()
+            completion = self.create(server, "recorded")
+            self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+            self.assertEqual(completion.choices[0].message.content, "SELECT 1")
+
+            with self.assertRaises(openai.error.InvalidRequestError):
+                self.create(server, "not recorded")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+
+import sqlite3
+import unittest
+from utils.schema_catalog import SchemaCatalog
+from utils.bird_descriptions import DatabaseDescription, TableDescription
+from utils.token_counter import count_tokens
+from utils.token_budget import fit_schema, rank_tables, DROP_SAMPLE_ROWS, DROP_DESCRIPTIONS, DROP_TABLES
+
+
+class TestTokenBudget(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.conn = sqlite3.connect(":memory:")
+        cls.conn.execute("CREATE TABLE client (client_id INTEGER PRIMARY KEY, gender TEXT, birth_date TEXT)")
+        cls.conn.execute("CREATE TABLE district (district_id INTEGER PRIMARY KEY, district_name TEXT, region TEXT)")
+        cls.conn.execute("CREATE TABLE loan (loan_id INTEGER PRIMARY KEY, account_id INTEGER, amount REAL)")
+        for table in ("client", "district", "loan"):
+            cls.conn.executemany(f"INSERT INTO {table} VALUES (?, ?, ?)",
+                                 [(i, "value " * 20, "other " * 20) for i in range(3)])
+
+        header = ["original_column_name", "column_name", "column_description"]
+        cls.descriptions = DatabaseDescription("financial", {
+            table: TableDescription(table, header, [["id", "id", "the identifier of the " + table + " " * 50]])
+            for table in ("client", "district", "loan")
+        })
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+
+    def setUp(self):
+        self.catalog = SchemaCatalog("financial", "test", lambda: self.conn)
+
+    def fit(self, budget):
+        return fit_schema(self.catalog, budget, question="What is the loan amount of female clients?",
+                          descriptions=self.descriptions)
+
+
+    def test_fits_without_degradation(self):
+        budgeted = self.fit(100000)
+        self.assertEqual(budgeted.steps, [])
+        self.assertEqual(budgeted.schema, self.catalog.get_schema_and_sample_data())
+        self.assertEqual(budgeted.descriptions, self.descriptions.render())
+
+    def test_degradation_order(self):
+        full = self.fit(100000).tokens
+
+        budgeted = self.fit(full - 1)
+        self.assertEqual(budgeted.steps, [DROP_SAMPLE_ROWS])
+        self.assertNotIn("Three rows", budgeted.schema)
+        self.assertTrue(budgeted.descriptions)
+
+        create_statements = sum(count_tokens(self.catalog.render_schema_and_sample_data([table], False))
+                                for table in self.catalog.get_table_names())
+        budgeted = self.fit(create_statements)
+        self.assertEqual(budgeted.steps, [DROP_SAMPLE_ROWS, DROP_DESCRIPTIONS])
+        self.assertEqual(budgeted.descriptions, "")
+        self.assertEqual(budgeted.tokens, create_statements)
+
+    def test_least_relevant_tables_are_dropped_first(self):
+        self.assertEqual(rank_tables(self.catalog, "What is the loan amount of female clients?"),
+                         ["loan", "client", "district"])
+
+        budgeted = self.fit(1)
+        self.assertEqual(budgeted.steps, [DROP_SAMPLE_ROWS, DROP_DESCRIPTIONS, DROP_TABLES])
+        self.assertEqual(budgeted.dropped_tables, ["district", "client"])
+        self.assertIn("CREATE TABLE loan", budgeted.schema)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+
+import re
+import sqlite3
+from collections import namedtuple
+from utils.result_comparison import TRAILING_TERMINATOR_PATTERN
+
+
+ADMIT = "admit"
+REJECT = "reject"
+CAP = "cap"
+SLOW_LANE = "slow_lane"
+ADMISSION_POLICIES = ("off", REJECT, CAP, SLOW_LANE)
+
+# Predicted outcome of a query refused by the admission gate
+REJECTED = "rejected"
+
+TABLE_ACCESS_PATTERN = re.compile(r"^(SCAN|SEARCH)( TABLE)? (\S+)")
+
+
+PlanCost = namedtuple("PlanCost", ["cost", "full_scans"])
+
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str) -> list:
+    """
+    Compile a query and return its EXPLAIN QUERY PLAN rows as (id, parent, detail) tuples.
+
+    Raises:
+        sqlite3.Error: If the query does not compile.
+    """
+    return [(row[0], row[1], row[3]) for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+
+
+def estimate_plan_cost(plan: list, row_counts: dict, aliases: dict) -> PlanCost:
+    """
+    Estimate how many rows a query plan visits.
+
+    Tables at the same level of the plan are nested loops, so the rows of every
+    full table scan multiply the rows of the loops around it, while an index
+    search is counted as one row per outer row. A correlated subquery runs once
+    per row of the loops around it, every other subquery once. Scans of
+    subqueries and of tables without a row count count as one row.
+
+    Parameters:
+        plan (list): The (id, parent, detail) rows of EXPLAIN QUERY PLAN.
+        row_counts (dict): The number of rows per table.
+        aliases (dict): The table name per lower-cased name or alias used in the query.
+
+    Returns:
+        PlanCost: The estimated number of visited rows and the full-scanned tables.
+    """
+    children = {}
+    for node_id, parent, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+
+    full_scans = []
+
+    def scope_cost(parent: int, outer_rows: int) -> int:
+        loop_rows = outer_rows
+        cost = 0
+        for node_id, detail in children.get(parent, []):
+            match = TABLE_ACCESS_PATTERN.match(detail)
+            if match is not None:
+                table = aliases.get(match.group(3).lower())
+                if match.group(1) == "SCAN" and table is not None:
+                    full_scans.append(table)
+                    loop_rows *= max(row_counts.get(table, 1), 1)
+                cost += loop_rows
+            elif detail.startswith("CORRELATED"):
+                cost += scope_cost(node_id, loop_rows)
+            else:
+                cost += scope_cost(node_id, 1)
+        return cost
+
+    return PlanCost(scope_cost(0, 1), full_scans)
+
+
+def cap_query(sql: str, row_limit: int) -> str:
+    """
+    Wrap a query so that it returns at most row_limit rows.
+    """
+    inner_sql = TRAILING_TERMINATOR_PATTERN.sub("", sql.strip())
+    # The newline keeps a trailing line comment from swallowing the closing parenthesis
+    return f"SELECT * FROM (\n{inner_sql}\n) LIMIT {int(row_limit)}"
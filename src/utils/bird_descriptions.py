@@ -0,0 +1,228 @@
+
+import io
+import os
+import csv
+import pickle
+import logging
+import tempfile
+from collections import namedtuple
+
+
+# Part of the key of persisted descriptions, increased when the parsed model changes
+DESCRIPTION_VERSION = 2
+
+
+ColumnDescription = namedtuple("ColumnDescription", [
+    "original_column_name",
+    "column_name",
+    "column_description",
+    "data_format",
+    "value_description"
+])
+
+
+class TableDescription:
+    """
+    The parsed database_description CSV file of one table.
+
+    header holds the header row of the file and rows every following row, as
+    read by the csv module. columns gives the same rows as ColumnDescriptions.
+    text is the content of the file as read, which is what the prompts show.
+    """
+
+    def __init__(self, table_name: str, header: list, rows: list, text: str = None):
+        self.table_name = table_name
+        self.header = header
+        self.rows = rows
+        self.text = text
+
+    @property
+    def columns(self) -> list:
+        columns = []
+        for row in self.rows:
+            padded = (list(row) + [""] * len(ColumnDescription._fields))[:len(ColumnDescription._fields)]
+            columns.append(ColumnDescription(*[value.strip() for value in padded]))
+        return columns
+
+    def render(self) -> str:
+        """
+        Return the text of the description file, or CSV text of the rows for a description built in code.
+        """
+        if self.text is not None:
+            return self.text
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(self.header)
+        writer.writerows(self.rows)
+        return buffer.getvalue()
+
+
+class DatabaseDescription:
+    """
+    The parsed database_description folder of one BIRD database.
+
+    filenames lists the files of the folder in directory order, tables are
+    rendered in that order. Without filenames the order of tables is used.
+    """
+
+    def __init__(self, db_name: str, tables: dict, filenames: list = None):
+        self.db_name = db_name
+        self.tables = tables
+        self.filenames = filenames if filenames is not None else [table + ".csv" for table in tables]
+        self.renderings = {}
+
+    def render(self, tables: list = None) -> str:
+        """
+        Render the descriptions of the given tables, all tables by default.
+
+        The rendering is the one the prompts have always used: for each file
+        of the folder in directory order, "Table <name>" and the unchanged text
+        of a CSV file, then a blank line. Renderings of all tables are cached.
+
+        Parameters:
+            tables (list): Names of the tables to render, None for all tables.
+
+        Returns:
+            str: The rendered table descriptions.
+        """
+        if tables is None and "all" in self.renderings:
+            return self.renderings["all"]
+
+        table_info = ""
+        for filename in self.filenames:
+            if not filename.endswith(".csv"):
+                # Every file of the folder used to add a blank line, CSV or not
+                if tables is None:
+                    table_info += "\n\n"
+                continue
+
+            table_name = filename[:-len(".csv")]
+            if tables is not None and table_name not in tables:
+                continue
+
+            # The name is shown as filename.rstrip(".csv") always showed it, which also strips
+            # trailing c, s and v letters (trans.csv is "Table tran"), so prompts match earlier runs
+            table_info += "Table " + filename.rstrip(".csv") + "\n"
+            table_info += self.tables[table_name].render()
+            table_info += "\n\n"
+
+        if tables is None:
+            self.renderings["all"] = table_info
+        return table_info
+
+    def __getstate__(self):
+        return {"db_name": self.db_name, "tables": self.tables, "filenames": self.filenames, "renderings": {}}
+
+
+def read_description_file(csv_path: str) -> tuple:
+    """
+    Read the header, rows and text of a description CSV file.
+
+    Most files are UTF-8, but a few BIRD files are Latin-1 encoded, so Latin-1
+    is used when UTF-8 decoding fails. The text is read like a plain
+    open(csv_path).read(), while the rows leave out a byte order mark.
+    """
+    for encoding in ("utf-8", "latin-1"):
+        try:
+            with open(csv_path, mode="r", encoding=encoding) as file:
+                text = file.read()
+            break
+        except UnicodeDecodeError:
+            logging.debug("Description file is not " + encoding + ": " + csv_path)
+
+    rows = list(csv.reader(io.StringIO(text.lstrip("\ufeff"))))
+    rows = [row for row in rows if any(value.strip() for value in row)]
+    if not rows:
+        return [], [], text
+    return rows[0], rows[1:], text
+
+
+def get_folder_signature(description_folder_path: str) -> tuple:
+    """
+    Return the names, sizes and modification times of the files in a folder, in directory order.
+    """
+    signature = []
+    for filename in os.listdir(description_folder_path):
+        stat = os.stat(os.path.join(description_folder_path, filename))
+        signature.append((filename, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def parse_description_folder(db_name: str, description_folder_path: str) -> DatabaseDescription:
+    """
+    Parse every table description CSV file of a database, keeping the directory order of the files.
+    """
+    filenames = os.listdir(description_folder_path)
+    tables = {}
+    for filename in filenames:
+        if filename.endswith(".csv"):
+            table_name = filename[:-len(".csv")]
+            header, rows, text = read_description_file(os.path.join(description_folder_path, filename))
+            tables[table_name] = TableDescription(table_name, header, rows, text)
+
+    return DatabaseDescription(db_name, tables, filenames)
+
+
+class DescriptionCache:
+    """
+    Caches parsed database descriptions in memory and on disk.
+
+    On disk each database is stored in cache_dir/<db_name>.pkl together with the
+    signature of its description folder and DESCRIPTION_VERSION, so a changed,
+    added or removed file causes the folder to be parsed again. Pass cache_dir=None to keep the
+    descriptions in memory only.
+    """
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir
+        self.descriptions = {}
+        self.files_parsed = 0
+
+
+    def get_description(self, db_name: str, description_folder_path: str) -> DatabaseDescription:
+        if db_name in self.descriptions:
+            return self.descriptions[db_name]
+
+        signature = get_folder_signature(description_folder_path)
+        description = self.load(db_name, signature)
+
+        if description is None:
+            description = parse_description_folder(db_name, description_folder_path)
+            self.files_parsed += len(description.tables)
+            self.save(db_name, signature, description)
+
+        self.descriptions[db_name] = description
+        return description
+
+
+    def get_path(self, db_name: str) -> str:
+        return os.path.join(self.cache_dir, db_name + ".pkl")
+
+
+    def load(self, db_name: str, signature: tuple):
+        if self.cache_dir is None or not os.path.exists(self.get_path(db_name)):
+            return None
+
+        try:
+            with open(self.get_path(db_name), "rb") as f:
+                stored = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError) as err:
+            logging.warning("DescriptionCache.load() ignoring corrupt descriptions of " + db_name + ": " + str(err))
+            return None
+
+        if stored.get("version") != DESCRIPTION_VERSION or stored.get("signature") != signature:
+            return None
+        return stored["description"]
+
+
+    def save(self, db_name: str, signature: tuple, description: DatabaseDescription) -> None:
+        if self.cache_dir is None:
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"version": DESCRIPTION_VERSION, "signature": signature, "description": description},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.get_path(db_name))
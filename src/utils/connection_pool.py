@@ -0,0 +1,205 @@
+
+import os
+import sqlite3
+import logging
+import pathlib
+from collections import OrderedDict, Counter
+
+
+DEFAULT_PROFILE = "default"
+READ_ONLY_PROFILE = "read_only"
+HOT_PROFILE = "hot"
+CONNECTION_PROFILES = (DEFAULT_PROFILE, READ_ONLY_PROFILE, HOT_PROFILE)
+
+
+class ConnectionPool:
+    """
+    A pool of open SQLite connections keyed by database id.
+
+    At most max_open_databases connections are kept open at the same time.
+    When the pool is full the least recently used connection is closed and
+    evicted to make room for the new one. check_same_thread is passed on to
+    sqlite3.connect and must be False if the pool is closed from another thread
+    than it is used on.
+
+    The profile selects how databases are opened:
+        default    read-write with the SQLite default pragmas, or read-only
+                   (mode=ro) if read_only is set
+        read_only  immutable read-only URIs (mode=ro&immutable=1), so SQLite
+                   skips all locking, with the mmap_size, cache_size (in KiB)
+                   and temp_store=MEMORY pragmas set
+        hot        as read_only, but a database requested hot_min_requests
+                   times is copied into an in-memory database with the backup
+                   API, as long as all in-memory copies fit hot_memory_budget bytes
+    Connections of the read_only and hot profiles set PRAGMA query_only, so
+    neither the files nor the in-memory copies can be modified. A file
+    connection replaced by its in-memory copy stays open until the database is
+    evicted, as callers may still hold it.
+    """
+
+    def __init__(self, max_open_databases: int = 8, read_only: bool = False, check_same_thread: bool = True,
+                 profile: str = DEFAULT_PROFILE, mmap_size: int = 256 * 1024 * 1024, cache_size: int = 64 * 1024,
+                 hot_memory_budget: int = 256 * 1024 * 1024, hot_min_requests: int = 2):
+        if max_open_databases < 1:
+            raise ValueError("max_open_databases must be at least 1")
+        if profile not in CONNECTION_PROFILES:
+            raise ValueError(f"profile must be one of {', '.join(CONNECTION_PROFILES)}")
+
+        self.max_open_databases = max_open_databases
+        self.read_only = read_only
+        self.check_same_thread = check_same_thread
+        self.profile = profile
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.hot_memory_budget = hot_memory_budget
+        self.hot_min_requests = hot_min_requests
+        self.connections = OrderedDict()
+        self.hot_databases = {}
+        self.replaced_connections = {}
+        self.requests = Counter()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get_connection(self, db_name: str, db_path: str) -> sqlite3.Connection:
+        """
+        Return an open connection to the database, reusing a pooled one if possible.
+
+        Parameters:
+            db_name (str): The database id used as the pool key.
+            db_path (str): The path to the database file, used on a pool miss.
+
+        Returns:
+            sqlite3.Connection: An open connection to the database.
+        """
+        self.requests[db_name] += 1
+
+        if db_name in self.connections:
+            self.hits += 1
+            self.connections.move_to_end(db_name)
+            if self.should_load_into_memory(db_name, db_path):
+                self.load_into_memory(db_name, db_path)
+            return self.connections[db_name]
+
+        self.misses += 1
+        while len(self.connections) >= self.max_open_databases:
+            self.evict()
+
+        logging.debug("Opening connection to: " + db_path)
+        conn = self.connect(db_path)
+        self.connections[db_name] = conn
+        if self.should_load_into_memory(db_name, db_path):
+            self.load_into_memory(db_name, db_path)
+        return self.connections[db_name]
+
+
+    def connect(self, db_path: str) -> sqlite3.Connection:
+        """
+        Open a new connection to the database file.
+
+        Parameters:
+            db_path (str): The path to the database file.
+
+        Returns:
+            sqlite3.Connection: The new connection.
+        """
+        uri = pathlib.Path(db_path).absolute().as_uri()
+
+        if self.profile == DEFAULT_PROFILE:
+            if self.read_only:
+                return sqlite3.connect(uri + "?mode=ro", uri=True, check_same_thread=self.check_same_thread)
+            return sqlite3.connect(db_path, check_same_thread=self.check_same_thread)
+
+        conn = sqlite3.connect(uri + "?mode=ro&immutable=1", uri=True, check_same_thread=self.check_same_thread)
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)};")
+        conn.execute(f"PRAGMA cache_size = {-int(self.cache_size)};")
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.execute("PRAGMA query_only = ON;")
+        return conn
+
+
+    def should_load_into_memory(self, db_name: str, db_path: str) -> bool:
+        """
+        Return whether a pooled database should now be copied into memory.
+        """
+        if self.profile != HOT_PROFILE or db_name in self.hot_databases:
+            return False
+        if self.requests[db_name] < self.hot_min_requests:
+            return False
+
+        hot_bytes = sum(self.hot_databases.values())
+        return hot_bytes + os.path.getsize(db_path) <= self.hot_memory_budget
+
+
+    def load_into_memory(self, db_name: str, db_path: str) -> None:
+        """
+        Replace the pooled connection of a database with an in-memory copy of it.
+        """
+        logging.debug("Loading database into memory: " + db_path)
+        source = self.connections[db_name]
+        conn = sqlite3.connect(":memory:", check_same_thread=self.check_same_thread)
+        source.backup(conn)
+        conn.execute("PRAGMA temp_store = MEMORY;")
+        conn.execute("PRAGMA query_only = ON;")
+
+        self.replaced_connections[db_name] = source
+        self.connections[db_name] = conn
+        self.hot_databases[db_name] = os.path.getsize(db_path)
+
+
+    def create_worker_pool(self) -> "ConnectionPool":
+        """
+        Return an empty read-only pool with the same settings, to be used by a worker thread.
+        """
+        return ConnectionPool(
+            self.max_open_databases, read_only=True, check_same_thread=False, profile=self.profile,
+            mmap_size=self.mmap_size, cache_size=self.cache_size,
+            hot_memory_budget=self.hot_memory_budget, hot_min_requests=self.hot_min_requests)
+
+
+    def evict(self) -> None:
+        """
+        Close and remove the least recently used connection.
+        """
+        db_name, conn = self.connections.popitem(last=False)
+        logging.debug("Evicting connection to: " + db_name)
+        conn.close()
+        source = self.replaced_connections.pop(db_name, None)
+        if source is not None:
+            source.close()
+        self.hot_databases.pop(db_name, None)
+        self.evictions += 1
+
+
+    def close_all(self) -> None:
+        """
+        Close every pooled connection.
+        """
+        while self.connections:
+            _, conn = self.connections.popitem(last=False)
+            conn.close()
+        for source in self.replaced_connections.values():
+            source.close()
+        self.replaced_connections = {}
+        self.hot_databases = {}
+
+
+    def get_stats(self) -> dict:
+        """
+        Return the pool counters.
+
+        Returns:
+            dict: Hits, misses, evictions, hit rate, the number of open connections
+            and the number and size of the databases held in memory.
+        """
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / requests if requests > 0 else 0,
+            "open_connections": len(self.connections),
+            "in_memory_databases": len(self.hot_databases),
+            "in_memory_bytes": sum(self.hot_databases.values())
+        }
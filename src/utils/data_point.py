@@ -0,0 +1,105 @@
+
+class DataPoint:
+    """
+    An immutable question of a text-to-SQL dataset.
+
+    Only the fields used by the agents and the evaluation are kept, every other
+    field of the source record (token lists, parsed SQL, ...) is dropped at load
+    time. Fields can be read as attributes or with the dict-style access the run
+    scripts use, data_point['SQL'] or data_point.get('difficulty', ""). A field
+    without a value (None) behaves like a missing dict key.
+
+    DataPoints cannot be modified, so they are safe to share between threads
+    and to send to worker processes.
+    """
+
+    __slots__ = ("question", "evidence", "SQL", "db_id", "difficulty", "annotation")
+
+    def __init__(self, question: str, evidence: str, SQL: str, db_id: str,
+                 difficulty: str = None, annotation: tuple = None):
+        object.__setattr__(self, "question", question)
+        object.__setattr__(self, "evidence", evidence)
+        object.__setattr__(self, "SQL", SQL)
+        object.__setattr__(self, "db_id", db_id)
+        object.__setattr__(self, "difficulty", difficulty)
+        object.__setattr__(self, "annotation", tuple(annotation) if annotation is not None else None)
+
+
+    @classmethod
+    def from_bird(cls, record: dict) -> "DataPoint":
+        """
+        Build a DataPoint from a BIRD question record.
+        """
+        return cls(
+            question=record['question'],
+            evidence=record.get('evidence', ""),
+            SQL=record['SQL'],
+            db_id=record['db_id'],
+            difficulty=record.get('difficulty'),
+            annotation=record.get('annotation')
+        )
+
+
+    @classmethod
+    def from_spider(cls, record: dict) -> "DataPoint":
+        """
+        Build a DataPoint from a Spider question record, which has no evidence and stores the gold SQL as query.
+        """
+        return cls(
+            question=record['question'],
+            evidence="",
+            SQL=record['query'],
+            db_id=record['db_id']
+        )
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DataPoint is immutable")
+
+
+    def __delattr__(self, name):
+        raise AttributeError("DataPoint is immutable")
+
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__ or getattr(self, key) is None:
+            raise KeyError(key)
+        return getattr(self, key)
+
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__ and getattr(self, key) is not None
+
+
+    def get(self, key: str, default=None):
+        return self[key] if key in self else default
+
+
+    def keys(self) -> list:
+        return [key for key in self.__slots__ if key in self]
+
+
+    def to_dict(self) -> dict:
+        return {key: self[key] for key in self.keys()}
+
+
+    def _values(self) -> tuple:
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+
+    def __reduce__(self):
+        return (self.__class__, self._values())
+
+
+    def __eq__(self, other):
+        if not isinstance(other, DataPoint):
+            return NotImplemented
+        return self._values() == other._values()
+
+
+    def __hash__(self):
+        return hash(self._values())
+
+
+    def __repr__(self):
+        return f"DataPoint(db_id={self.db_id!r}, question={self.question!r})"
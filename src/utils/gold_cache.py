@@ -0,0 +1,187 @@
+
+import os
+import re
+import gzip
+import shutil
+import pickle
+import hashlib
+import logging
+import tempfile
+import threading
+
+
+QUOTED_SEGMENT_PATTERN = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`)""")
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normalize a SQL query so formatting differences map to the same cache key.
+
+    Whitespace outside quoted literals and identifiers is collapsed and a
+    trailing semicolon is removed. Quoted segments are kept verbatim.
+
+    Parameters:
+        sql (str): The SQL query.
+
+    Returns:
+        str: The normalized SQL query.
+    """
+    parts = QUOTED_SEGMENT_PATTERN.split(sql)
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2 == 1:
+            normalized.append(part)
+        else:
+            normalized.append(re.sub(r"\s+", " ", part))
+
+    return "".join(normalized).strip().rstrip(";").strip()
+
+
+def get_db_path_key(db_path: str) -> str:
+    """
+    Return a short key of the absolute path of a database file.
+
+    Parameters:
+        db_path (str): The path to the database file.
+
+    Returns:
+        str: A hex digest of the absolute path.
+    """
+    return hashlib.sha1(os.path.abspath(db_path).encode("utf-8")).hexdigest()[:16]
+
+
+def get_db_fingerprint(db_path: str) -> str:
+    """
+    Return a fingerprint of a database file that changes whenever the file changes.
+
+    Parameters:
+        db_path (str): The path to the database file.
+
+    Returns:
+        str: A hex digest of the file size and modification time.
+    """
+    stat = os.stat(db_path)
+    key = f"{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+class GoldResultCache:
+    """
+    An on-disk cache of gold query results.
+
+    Results are stored gzip compressed under
+    cache_dir/<db_name>/<path key>/<db fingerprint>/<sql hash>.<kind>.pkl.gz,
+    where kind separates full result rows from result fingerprints. Every
+    file of a database, such as the original and its optimized copy, has its
+    own path key directory, so switching between them keeps the results of
+    both. When a database file changes its fingerprint changes, so stale
+    results are never returned and the old fingerprint directories of that
+    file are removed on the next access. The cache may be shared between threads.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self.checked_paths = set()
+        self.lock = threading.Lock()
+
+
+    def get(self, db_name: str, db_path: str, sql: str, kind: str = "rows"):
+        """
+        Return the cached result of a query, or None on a cache miss.
+
+        Parameters:
+            db_name (str): The database name.
+            db_path (str): The path to the database file.
+            sql (str): The gold SQL query.
+            kind (str): The kind of cached result, "rows" or "fingerprint".
+
+        Returns:
+            The cached result, or None if the query is not cached.
+        """
+        path = self.get_entry_path(db_name, db_path, sql, kind)
+        if not os.path.exists(path):
+            self.count_lookup(hit=False)
+            return None
+
+        try:
+            with gzip.open(path, "rb") as f:
+                rows = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as err:
+            logging.warning("GoldResultCache.get() ignoring corrupt entry " + path + ": " + str(err))
+            self.count_lookup(hit=False)
+            return None
+
+        self.count_lookup(hit=True)
+        return rows
+
+
+    def count_lookup(self, hit: bool) -> None:
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+    def put(self, db_name: str, db_path: str, sql: str, result, kind: str = "rows") -> None:
+        """
+        Store the result of a query.
+
+        Parameters:
+            db_name (str): The database name.
+            db_path (str): The path to the database file.
+            sql (str): The gold SQL query.
+            result: The result rows or the result fingerprint of the query.
+            kind (str): The kind of result, "rows" or "fingerprint".
+        """
+        path = self.get_entry_path(db_name, db_path, sql, kind)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+    def get_entry_path(self, db_name: str, db_path: str, sql: str, kind: str) -> str:
+        fingerprint = get_db_fingerprint(db_path)
+        path_dir = os.path.join(self.cache_dir, db_name, get_db_path_key(db_path))
+
+        with self.lock:
+            if path_dir not in self.checked_paths:
+                self.remove_stale_entries(path_dir, fingerprint)
+                self.checked_paths.add(path_dir)
+
+        sql_hash = hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()
+        return os.path.join(path_dir, fingerprint, f"{sql_hash}.{kind}.pkl.gz")
+
+
+    def remove_stale_entries(self, path_dir: str, fingerprint: str) -> None:
+        """
+        Remove cached results computed against older versions of a database file.
+        """
+        if not os.path.isdir(path_dir):
+            return
+
+        for name in os.listdir(path_dir):
+            if name != fingerprint:
+                logging.info("GoldResultCache: removing stale results " + os.path.join(path_dir, name))
+                shutil.rmtree(os.path.join(path_dir, name), ignore_errors=True)
+
+
+    def get_stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests > 0 else 0
+        }
@@ -0,0 +1,385 @@
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from utils.token_counter import count_message_tokens, record_token_estimate, record_cached_call
+from utils.resilient_client import acall_with_retries
+
+
+READ_THROUGH = "read_through"
+WRITE_ONLY = "write_only"
+REPLAY_ONLY = "replay_only"
+BYPASS = "bypass"
+CACHE_MODES = (READ_THROUGH, WRITE_ONLY, REPLAY_ONLY, BYPASS)
+
+DEFAULT_CACHE_PATH = os.path.abspath(
+    os.path.join(os.path.dirname( __file__ ), '..', '..', 'cache/llm_responses.sqlite'))
+
+
+CachedResponse = namedtuple("CachedResponse", ["text", "usage", "latency"])
+
+
+class LLMCacheMiss(Exception):
+    """
+    Raised in replay_only mode when a response is not in the cache.
+    """
+    pass
+
+
+def get_cache_key(model: str, temperature: float, messages: list, prompt_version: str) -> str:
+    """
+    Return the content address of an LLM call.
+
+    Parameters:
+        model (str): The model name.
+        temperature (float): The sampling temperature.
+        messages (list): The rendered (role, content) messages sent to the model.
+        prompt_version (str): The version of the prompt template and its post-processing.
+
+    Returns:
+        str: The SHA-256 hex digest of the call.
+    """
+    content = json.dumps({
+        "model": model,
+        "temperature": temperature,
+        "messages": messages,
+        "prompt_version": prompt_version
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    A persistent cache of LLM responses in a SQLite file.
+
+    Responses are stored with the token usage and latency of the original call.
+    When the stored responses exceed max_bytes, the least recently used ones are
+    deleted. The mode decides how the cache is used:
+        read_through  return cached responses, call the model and store the
+                      response on a miss
+        write_only    always call the model and store the response
+        replay_only   return cached responses, raise LLMCacheMiss on a miss
+        bypass        always call the model and store nothing
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, mode: str = READ_THROUGH, max_bytes: int = 1024 * 1024 * 1024):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"mode must be one of {', '.join(CACHE_MODES)}")
+
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_latency = 0
+        self.lock = threading.Lock()
+        self.conn = None
+
+        if mode != BYPASS:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    temperature REAL,
+                    prompt_version TEXT,
+                    response TEXT,
+                    usage TEXT,
+                    latency REAL,
+                    size INTEGER,
+                    created_at REAL,
+                    last_used_at REAL
+                )""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used_at ON responses (last_used_at)")
+            self.conn.commit()
+
+
+    @classmethod
+    def from_config(cls, config) -> "LLMResponseCache":
+        """
+        Create the cache from the llm_cache_mode, llm_cache_path and llm_cache_max_bytes settings of a config.
+
+        The mode defaults to write_only, so an experiment run reports the
+        tokens, cost and latency of real calls unless it opts into reading
+        the cache.
+        """
+        return cls(
+            path=config.get('llm_cache_path') or DEFAULT_CACHE_PATH,
+            mode=config.get('llm_cache_mode') or WRITE_ONLY,
+            max_bytes=config.get('llm_cache_max_bytes') or 1024 * 1024 * 1024
+        )
+
+
+    def get(self, key: str) -> CachedResponse:
+        """
+        Return the cached response of a call, None if it is not cached.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, usage, latency FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            self.conn.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return CachedResponse(row[0], json.loads(row[1]), row[2])
+
+
+    def put(self, key: str, model: str, temperature: float, prompt_version: str,
+            response: str, usage: dict, latency: float) -> None:
+        """
+        Store the response of a call and evict old responses if the cache is over its size.
+        """
+        size = len(key) + len(response.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, temperature, prompt_version, response, json.dumps(usage), latency, size, now, now))
+            self.evict()
+            self.conn.commit()
+
+
+    def evict(self) -> None:
+        """
+        Delete the least recently used responses until the cache fits max_bytes.
+        """
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        while total > self.max_bytes:
+            row = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_used_at LIMIT 1").fetchone()
+            if row is None:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            total -= row[1]
+            self.evictions += 1
+
+
+    def lookup(self, key: str, model: str) -> str:
+        """
+        Return the cached response of a call if the mode reads from the cache, otherwise None.
+
+        Raises:
+            LLMCacheMiss: In replay_only mode, if the response is not cached.
+        """
+        if self.mode not in (READ_THROUGH, REPLAY_ONLY):
+            return None
+
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            self.saved_latency += cached.latency
+            return cached.text
+
+        self.misses += 1
+        if self.mode == REPLAY_ONLY:
+            raise LLMCacheMiss(f"No cached response for {model} call {key}")
+        return None
+
+
+    def call(self, key: str, model: str, temperature: float, prompt_version: str, generate) -> str:
+        """
+        Return the response of a call from the cache or from generate, depending on the mode.
+
+        Parameters:
+            key (str): The cache key of the call.
+            model (str): The model name.
+            temperature (float): The sampling temperature.
+            prompt_version (str): The prompt version.
+            generate (callable): Calls the model and returns the response text and token usage.
+
+        Returns:
+            str: The response text.
+
+        Raises:
+            LLMCacheMiss: In replay_only mode, if the response is not cached.
+        """
+        response = self.lookup(key, model)
+        if response is not None:
+            return response
+
+        start = time.perf_counter()
+        response, usage = generate()
+        latency = time.perf_counter() - start
+
+        if self.mode != BYPASS:
+            self.put(key, model, temperature, prompt_version, response, usage, latency)
+        return response
+
+
+    async def acall(self, key: str, model: str, temperature: float, prompt_version: str, agenerate) -> str:
+        """
+        Async version of call, agenerate is a coroutine function.
+        """
+        response = self.lookup(key, model)
+        if response is not None:
+            return response
+
+        start = time.perf_counter()
+        response, usage = await agenerate()
+        latency = time.perf_counter() - start
+
+        if self.mode != BYPASS:
+            self.put(key, model, temperature, prompt_version, response, usage, latency)
+        return response
+
+
+    def get_stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "saved_latency": self.saved_latency
+        }
+
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class CachedChain:
+    """
+    Wraps an LLMChain so that its run and arun methods go through an LLMResponseCache.
+
+    The cache key combines the model and temperature of the chain's LLM, the
+    messages rendered from the prompt and the prompt version. Without a cache
+    the chain is run as is. Token usage is still reported to an enclosing
+    get_openai_callback on a miss, while a hit uses no tokens. The local
+    prompt token count of every call sent to the model, and every hit, is
+    reported to an enclosing get_token_estimate. In an AsyncRunner, arun
+    retries a call that fails with a retryable error on its own.
+    """
+
+    def __init__(self, chain, cache: LLMResponseCache = None, prompt_version: str = "1"):
+        self.chain = chain
+        self.cache = cache
+        self.prompt_version = prompt_version
+
+
+    @property
+    def prompt(self):
+        return self.chain.prompt
+
+
+    def render_messages(self, inputs: dict) -> list:
+        """
+        Render the prompt with the inputs as (role, content) pairs.
+        """
+        prompt_inputs = {name: inputs[name] for name in self.chain.prompt.input_variables}
+        prompt_value = self.chain.prompt.format_prompt(**prompt_inputs)
+        return [[message.type, message.content] for message in prompt_value.to_messages()]
+
+
+    def get_config(self) -> dict:
+        """
+        Return what decides the output of the chain besides its inputs: the model, temperature, prompt version and templates.
+        """
+        prompt = self.chain.prompt
+        if hasattr(prompt, "messages"):
+            templates = [[type(message).__name__, message.prompt.template] for message in prompt.messages]
+        else:
+            templates = [prompt.template]
+
+        llm = self.chain.llm
+        return {
+            "model": getattr(llm, "model_name", None),
+            "temperature": getattr(llm, "temperature", None),
+            "prompt_version": self.prompt_version,
+            "templates": templates
+        }
+
+
+    def get_key(self, inputs: dict) -> tuple:
+        """
+        Return the model, temperature and cache key of a call with the inputs.
+        """
+        llm = self.chain.llm
+        model = getattr(llm, "model_name", None)
+        temperature = getattr(llm, "temperature", None)
+        return model, temperature, get_cache_key(model, temperature, self.render_messages(inputs), self.prompt_version)
+
+
+    def count_prompt_tokens(self, *args, **kwargs) -> int:
+        """
+        Count the prompt tokens of a call with the inputs, without calling the model.
+        """
+        inputs = args[0] if args else kwargs
+        model = getattr(self.chain.llm, "model_name", None) or "gpt-3.5-turbo"
+        return count_message_tokens(self.render_messages(inputs), model)
+
+
+    def run(self, *args, **kwargs) -> str:
+        inputs = args[0] if args else kwargs
+        if self.cache is None or self.cache.mode == BYPASS:
+            record_token_estimate(self.count_prompt_tokens(inputs))
+            return self.chain.run(*args, **kwargs)
+
+        model, temperature, key = self.get_key(inputs)
+        sent = False
+
+        def generate():
+            nonlocal sent
+            sent = True
+            record_token_estimate(self.count_prompt_tokens(inputs))
+            result = self.chain.generate([inputs])
+            usage = (result.llm_output or {}).get("token_usage", {})
+            return result.generations[0][0].text, dict(usage)
+
+        response = self.cache.call(key, model, temperature, self.prompt_version, generate)
+        if not sent:
+            record_cached_call()
+        logging.debug("LLM response cache " + self.cache.mode + " call " + key)
+        return response
+
+
+    async def asend(self, inputs: dict, send):
+        """
+        Send a call to the model, retried on its own by the retry policy of the
+        current task, see utils.resilient_client.acall_with_retries.
+
+        Parameters:
+            inputs (dict): The inputs of the call.
+            send (callable): Coroutine function sending the call once.
+        """
+        prompt_tokens = self.count_prompt_tokens(inputs)
+
+        async def attempt():
+            record_token_estimate(prompt_tokens)
+            return await send()
+
+        return await acall_with_retries(attempt, prompt_tokens)
+
+
+    async def arun(self, *args, **kwargs) -> str:
+        inputs = args[0] if args else kwargs
+        if self.cache is None or self.cache.mode == BYPASS:
+            return await self.asend(inputs, lambda: self.chain.arun(*args, **kwargs))
+
+        model, temperature, key = self.get_key(inputs)
+        sent = False
+
+        async def agenerate():
+            nonlocal sent
+            sent = True
+            result = await self.asend(inputs, lambda: self.chain.agenerate([inputs]))
+            usage = (result.llm_output or {}).get("token_usage", {})
+            return result.generations[0][0].text, dict(usage)
+
+        response = await self.cache.acall(key, model, temperature, self.prompt_version, agenerate)
+        if not sent:
+            record_cached_call()
+        logging.debug("LLM response cache " + self.cache.mode + " call " + key)
+        return response
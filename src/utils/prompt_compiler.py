@@ -0,0 +1,144 @@
+
+import re
+from utils.token_counter import count_tokens
+
+
+# Longest sample cell kept whole in a compiled prompt
+MAX_CELL_LENGTH = 32
+
+SAMPLE_ROWS_HEADER_PATTERN = re.compile(r'^\d+ rows from \S+ table:$')
+HTML_TAG_PATTERN = re.compile(r'</?[A-Za-z][^<>]*>')
+# A URL ends at whitespace, at the next URL or after an image file name, as
+# the sample rows sometimes glue the next value to a URL (image-w1280.jpg82)
+URL_PATTERN = re.compile(
+    r'\b(https?)://([^/\s]+)(?:/(?:\S*?\.(?:jpe?g|png|gif)(?:\?\d+)?(?=\d|\s|$|https?://)|\S*?(?=\s|$|https?://)))?')
+CELL_SEPARATOR_PATTERN = re.compile(r'\t+| {2,}| ?(?=https?://)')
+COLUMN_DESCRIPTION_PATTERN = re.compile(r'^Column (\S+)\s*: (.*)$')
+
+
+def shorten_cell(cell: str, max_cell_length: int = MAX_CELL_LENGTH) -> str:
+    """
+    Shorten a sample cell value: URLs to their host, other values over max_cell_length characters to a prefix.
+    """
+    match = URL_PATTERN.fullmatch(cell)
+    if match is not None:
+        return f"{match.group(1)}://{match.group(2)}/..."
+    if len(cell) > max_cell_length:
+        cell = cell[:max_cell_length].rstrip() + "..."
+    return cell
+
+
+def split_cells(line: str) -> list:
+    """
+    Split a line of sample rows into its cells.
+
+    Cells are separated by tabs, runs of spaces or the start of a URL, as in
+    the example schemas of the DIN-SQL prompts, and a value glued to the end
+    of a URL is a cell of its own.
+    """
+    cells = []
+    for cell in CELL_SEPARATOR_PATTERN.split(line):
+        start = 0
+        for match in URL_PATTERN.finditer(cell):
+            cells.extend([cell[start:match.start()], match.group(0)])
+            start = match.end()
+        cells.append(cell[start:])
+    return [cell.strip() for cell in cells if cell.strip()]
+
+
+def compile_sample_row(line: str, max_cell_length: int = MAX_CELL_LENGTH) -> str:
+    """
+    Render a line of sample rows with HTML markup removed, tab separated cells and long cells shortened.
+    """
+    line = HTML_TAG_PATTERN.sub("", line)
+    return "\t".join(shorten_cell(cell, max_cell_length) for cell in split_cells(line))
+
+
+def compile_template(template: str, max_cell_length: int = MAX_CELL_LENGTH) -> str:
+    """
+    Render the example schemas of a few-shot prompt template in a compact canonical form.
+
+    The text outside the example schemas is kept as is, so the template keeps
+    its input variables, questions, reasoning and answers. In the example
+    schemas:
+        - trailing whitespace is removed and the column definitions of CREATE
+          statements are indented by two spaces
+        - sample rows lose their HTML markup, their cells are tab separated
+          and URLs and other long values are shortened (see shorten_cell),
+          the column names line is kept whole
+        - a column description repeated for another table of the same schema
+          refers to the first table instead of repeating the description
+    """
+    compiled = []
+    in_create = False
+    in_sample_rows = False
+    after_rows_header = False
+    current_table = None
+    described_columns = {}
+
+    for line in template.split("\n"):
+        line = line.rstrip()
+        stripped = line.strip()
+
+        if line.startswith("Schema of the database"):
+            described_columns = {}
+        elif line.startswith("CREATE TABLE"):
+            in_create = True
+        elif in_create:
+            if stripped == ")":
+                in_create = False
+            else:
+                line = "  " + stripped
+        elif stripped == "/*":
+            in_sample_rows = True
+        elif stripped == "*/":
+            in_sample_rows = False
+        elif in_sample_rows:
+            if SAMPLE_ROWS_HEADER_PATTERN.match(stripped):
+                after_rows_header = True
+            elif after_rows_header:
+                after_rows_header = False
+                line = "\t".join(CELL_SEPARATOR_PATTERN.split(stripped))
+            else:
+                line = compile_sample_row(line, max_cell_length)
+                if not line:
+                    continue
+        elif line.startswith("Table: "):
+            current_table = line[len("Table: "):].strip()
+        else:
+            match = COLUMN_DESCRIPTION_PATTERN.match(line)
+            if match is not None and current_table is not None:
+                column, description = match.groups()
+                first_table = described_columns.setdefault((column, description), current_table)
+                if first_table != current_table:
+                    line = f"Column {column}: same as {first_table}.{column}"
+
+        compiled.append(line)
+
+    return "\n".join(compiled)
+
+
+def get_template_report(templates: dict, model: str = "gpt-3.5-turbo", max_cell_length: int = MAX_CELL_LENGTH) -> dict:
+    """
+    Return the tokens of each template before and after compile_template, and the totals.
+    """
+    report = {}
+    for name, template in templates.items():
+        tokens = count_tokens(template, model)
+        compact_tokens = count_tokens(compile_template(template, max_cell_length), model)
+        report[name] = {
+            "tokens": tokens,
+            "compact_tokens": compact_tokens,
+            "saved": tokens - compact_tokens,
+            "saved_ratio": (tokens - compact_tokens) / tokens if tokens else 0
+        }
+
+    tokens = sum(entry["tokens"] for entry in report.values())
+    compact_tokens = sum(entry["compact_tokens"] for entry in report.values())
+    report["total"] = {
+        "tokens": tokens,
+        "compact_tokens": compact_tokens,
+        "saved": tokens - compact_tokens,
+        "saved_ratio": (tokens - compact_tokens) / tokens if tokens else 0
+    }
+    return report
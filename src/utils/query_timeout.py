@@ -0,0 +1,54 @@
+
+import time
+import sqlite3
+
+
+SUCCESS = "success"
+ERROR = "error"
+TIMEOUT = "timeout"
+
+
+class QueryTimeoutError(Exception):
+    """
+    Raised when a query runs longer than its execution budget.
+    """
+    pass
+
+
+class QueryTimeout:
+    """
+    Context manager that interrupts queries on a connection once a time budget is spent.
+
+    The budget is enforced with the sqlite3 progress handler, which is called every
+    check_interval virtual machine instructions while a statement is executing or
+    rows are being fetched. When the deadline has passed the handler aborts the
+    statement and a QueryTimeoutError is raised instead of the sqlite3 error.
+    A timeout of None disables the budget.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, timeout: float = None, check_interval: int = 1000):
+        self.conn = conn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.deadline = None
+        self.timed_out = False
+
+    def __enter__(self):
+        if self.timeout is not None:
+            self.deadline = time.monotonic() + self.timeout
+            self.conn.set_progress_handler(self.check_deadline, self.check_interval)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.timeout is not None:
+            self.conn.set_progress_handler(None, self.check_interval)
+
+        if self.timed_out and exc_type is not None and issubclass(exc_type, sqlite3.OperationalError):
+            raise QueryTimeoutError(
+                f"Query exceeded its execution budget of {self.timeout:.2f} seconds") from exc_value
+
+    def check_deadline(self) -> int:
+        if time.monotonic() > self.deadline:
+            self.timed_out = True
+            return 1
+        return 0
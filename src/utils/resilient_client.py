@@ -0,0 +1,225 @@
+
+import re
+import time
+import random
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar
+import openai
+from utils.stats import summarize
+
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and server side failures
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+    TimeoutError,
+    ConnectionError
+)
+
+RETRY_AFTER_PATTERN = re.compile(r'try again in (\d+(?:\.\d+)?)\s*(ms|s)\b', re.IGNORECASE)
+
+# Retries the single LLM calls of the current asyncio task, set by the AsyncRunner for every item
+call_retry_policy = ContextVar("call_retry_policy", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a call could not be completed within its deadline.
+    """
+    pass
+
+
+def is_rate_limit_error(err: Exception) -> bool:
+    """
+    Whether an exception is an HTTP 429 response of the OpenAI API.
+    """
+    return isinstance(err, openai.error.RateLimitError) or getattr(err, "http_status", None) == 429
+
+
+def is_retryable_error(err: Exception) -> bool:
+    """
+    Whether a failed call may succeed when it is repeated.
+
+    Invalid requests, authentication and permission errors and other 4xx
+    responses are fatal. A generic APIError is retried when it is a 5xx
+    response or has no status at all, which is how the client reports
+    malformed responses from an overloaded server.
+    """
+    if isinstance(err, RETRYABLE_ERRORS) or is_rate_limit_error(err):
+        return True
+    if isinstance(err, openai.error.APIError):
+        status = getattr(err, "http_status", None)
+        return status is None or status >= 500
+    return False
+
+
+def get_retry_after(err: Exception) -> float:
+    """
+    Return the seconds the server asked to wait before retrying, None if it did not say.
+
+    The Retry-After header is used when present, otherwise the "Please try
+    again in 20s" hint of OpenAI rate limit messages.
+    """
+    headers = getattr(err, "headers", None) or {}
+    for name in ("retry-after-ms", "Retry-After-Ms"):
+        if name in headers:
+            try:
+                return float(headers[name]) / 1000
+            except (TypeError, ValueError):
+                pass
+    for name in ("retry-after", "Retry-After"):
+        if name in headers:
+            try:
+                return float(headers[name])
+            except (TypeError, ValueError):
+                pass
+
+    match = RETRY_AFTER_PATTERN.search(str(err))
+    if match is not None:
+        seconds = float(match.group(1))
+        return seconds / 1000 if match.group(2).lower() == "ms" else seconds
+    return None
+
+
+async def acall_with_retries(function, tokens: int = 0):
+    """
+    Await function(), retrying retryable errors with the retry policy of the current task, if any.
+
+    Only the failed call is repeated, so the calls that succeeded before it
+    are neither sent nor billed again. Without a policy, for example outside
+    an AsyncRunner, the call is made once.
+
+    Parameters:
+        function (callable): Coroutine function making one call.
+        tokens (int): The estimated tokens of the call, taken from the rate limits again on a retry.
+    """
+    policy = call_retry_policy.get()
+    if policy is None:
+        return await function()
+    return await policy(function, tokens)
+
+
+class ResilientClient:
+    """
+    Calls the OpenAI API with retries, exponential backoff with jitter and a deadline per call.
+
+    Retryable errors (see is_retryable_error) are retried up to max_retries
+    times. The wait before a retry is drawn uniformly between zero and
+    initial_backoff * 2 ** attempt, capped at max_backoff, so that many
+    clients hitting a rate limit together do not retry in lockstep. A
+    Retry-After from the server is respected as the minimum wait. Fatal
+    errors are raised at once. A call that cannot finish within deadline
+    seconds, including its retries, raises DeadlineExceeded. The request
+    timeout of each attempt is capped by the time left.
+
+    The counters in get_stats can be logged with the run metrics. The client
+    is safe to share between threads.
+    """
+
+    def __init__(self, max_retries: int = 8, initial_backoff: float = 0.5, max_backoff: float = 30.0,
+                 deadline: float = 300.0, request_timeout: float = 60.0):
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+        self.request_timeout = request_timeout
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.retries = Counter()
+        self.backoff_time = 0
+        self.latencies = []
+
+
+    @classmethod
+    def from_config(cls, config) -> "ResilientClient":
+        """
+        Create the client from the api_max_retries, api_deadline and llm_settings.request_timeout settings of a config.
+        """
+        llm_settings = config.get('llm_settings') or {}
+        return cls(
+            max_retries=config.get('api_max_retries', 8),
+            deadline=config.get('api_deadline') or 300.0,
+            request_timeout=llm_settings.get('request_timeout') or 60.0
+        )
+
+
+    def get_backoff(self, attempt: int, err: Exception) -> float:
+        backoff = random.uniform(0, min(self.max_backoff, self.initial_backoff * 2 ** attempt))
+        retry_after = get_retry_after(err)
+        if retry_after is not None:
+            backoff = max(backoff, retry_after)
+        return backoff
+
+
+    def call(self, function, *args, **kwargs):
+        """
+        Call function with the arguments, retrying retryable errors.
+
+        Raises:
+            DeadlineExceeded: If the call did not succeed within the deadline.
+            Exception: The error of the last attempt if it is fatal or the retries ran out.
+        """
+        start = time.perf_counter()
+        deadline = start + self.deadline if self.deadline else None
+
+        for attempt in range(self.max_retries + 1):
+            attempt_start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as err:
+                if not is_retryable_error(err) or attempt == self.max_retries:
+                    with self.lock:
+                        self.failures += 1
+                    raise
+
+                backoff = self.get_backoff(attempt, err)
+                if deadline is not None and time.perf_counter() + backoff >= deadline:
+                    with self.lock:
+                        self.failures += 1
+                    raise DeadlineExceeded(
+                        f"No response within the {self.deadline}s deadline after {attempt + 1} attempts") from err
+
+                with self.lock:
+                    self.retries[type(err).__name__] += 1
+                    self.backoff_time += backoff
+                logging.warning(f"API call failed with {type(err).__name__}, retry {attempt + 1} of "
+                                f"{self.max_retries} in {backoff:.2f}s: " + str(err))
+                time.sleep(backoff)
+            else:
+                with self.lock:
+                    self.calls += 1
+                    self.latencies.append(time.perf_counter() - attempt_start)
+                return result
+
+
+    def chat_completion(self, **kwargs):
+        """
+        Call openai.ChatCompletion.create with the arguments, with retries and the request timeout capped by the deadline.
+        """
+        start = time.perf_counter()
+
+        def create():
+            request_timeout = kwargs.get("request_timeout", self.request_timeout)
+            if self.deadline:
+                request_timeout = max(1.0, min(request_timeout, start + self.deadline - time.perf_counter()))
+            return openai.ChatCompletion.create(**{**kwargs, "request_timeout": request_timeout})
+
+        return self.call(create)
+
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "retries": sum(self.retries.values()),
+                "retries_by_error": dict(self.retries),
+                "backoff_time": self.backoff_time,
+                "latency": summarize(self.latencies)
+            }
@@ -0,0 +1,121 @@
+
+import re
+import hashlib
+import sqlite3
+from collections import namedtuple
+
+
+EXACT = "exact"
+STREAMING = "streaming"
+PUSHDOWN = "pushdown"
+COMPARISON_MODES = (EXACT, STREAMING, PUSHDOWN)
+
+DIGEST_MODULUS = 2 ** 128
+
+TRAILING_TERMINATOR_PATTERN = re.compile(r"(;\s*(--[^\n]*)?\s*)+$")
+
+
+ResultFingerprint = namedtuple("ResultFingerprint", ["row_count", "digest", "truncated"])
+
+
+def normalize_value(value):
+    """
+    Map values that compare equal in Python to the same representation.
+
+    collections.Counter treats True, 1 and 1.0 as the same key, so integral
+    floats and booleans are normalized to int to keep the fingerprint comparison
+    consistent with the exact comparison.
+    """
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def row_digest(row: tuple) -> int:
+    """
+    Return a stable 128-bit hash of a result row.
+
+    Unlike hash() the digest does not depend on PYTHONHASHSEED, so fingerprints
+    can be cached on disk and compared across processes.
+    """
+    normalized = repr(tuple(normalize_value(value) for value in row))
+    digest = hashlib.blake2b(normalized.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    return int.from_bytes(digest, "big")
+
+
+def fingerprint_rows(rows) -> ResultFingerprint:
+    """
+    Compute the order-independent multiset fingerprint of an iterable of rows.
+    """
+    row_count = 0
+    digest = 0
+    for row in rows:
+        row_count += 1
+        digest = (digest + row_digest(row)) % DIGEST_MODULUS
+    return ResultFingerprint(row_count, digest, False)
+
+
+def fingerprint_query(conn: sqlite3.Connection, sql: str, batch_size: int = 1000, row_limit: int = None) -> ResultFingerprint:
+    """
+    Execute a query and fingerprint its result while streaming it with fetchmany.
+
+    At most batch_size rows are held in memory at a time. Streaming stops as soon
+    as more than row_limit rows have been read, in which case the returned
+    fingerprint is marked as truncated.
+
+    Parameters:
+        conn (sqlite3.Connection): An open connection to the database.
+        sql (str): The SQL query to execute.
+        batch_size (int): The number of rows fetched per batch.
+        row_limit (int): Stop after this many rows, None for no limit.
+
+    Returns:
+        ResultFingerprint: The row count, multiset digest and whether the result was truncated.
+    """
+    cursor = conn.cursor()
+    cursor.execute(sql)
+
+    row_count = 0
+    digest = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            for row in rows:
+                row_count += 1
+                digest = (digest + row_digest(row)) % DIGEST_MODULUS
+
+            if row_limit is not None and row_count > row_limit:
+                return ResultFingerprint(row_count, digest, True)
+    finally:
+        cursor.close()
+
+    return ResultFingerprint(row_count, digest, False)
+
+
+def count_query_rows(conn: sqlite3.Connection, sql: str) -> int:
+    """
+    Count the rows of a query result inside SQLite, without fetching the rows.
+
+    Parameters:
+        conn (sqlite3.Connection): An open connection to the database.
+        sql (str): The SQL query to count the result rows of.
+
+    Returns:
+        int: The number of rows the query returns.
+
+    Raises:
+        sqlite3.Error: If the query cannot be wrapped, for example when it is not a SELECT.
+    """
+    inner_sql = TRAILING_TERMINATOR_PATTERN.sub("", sql.strip())
+    cursor = conn.cursor()
+    try:
+        # The newline keeps a trailing line comment from swallowing the closing parenthesis
+        cursor.execute(f"SELECT COUNT(*) FROM (\n{inner_sql}\n)")
+        return cursor.fetchone()[0]
+    finally:
+        cursor.close()
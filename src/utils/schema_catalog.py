@@ -0,0 +1,294 @@
+
+import os
+import pickle
+import logging
+import tempfile
+from collections import OrderedDict
+
+
+# Part of the key of persisted catalogs, increased when the introspection changes
+CATALOG_VERSION = 3
+
+# Hides the tables ANALYZE creates on optimized copies (sqlite_stat1, sqlite_stat4), but not
+# sqlite_sequence, which the original databases list. "_" is a LIKE wildcard, so it is escaped
+NOT_ANALYZE_TABLE = "name NOT LIKE 'sqlite\\_stat%' ESCAPE '\\'"
+
+
+class SchemaCatalog:
+    """
+    Schema information of one database, introspected lazily and cached.
+
+    Every piece of information (table names, CREATE statements, columns, sample
+    rows) and every rendering of it is computed on first use only. The
+    renderings are cached independently of each other, so asking for the CREATE
+    statements never returns the schema with sample data and vice versa.
+    The size attribute is a rough estimate of the memory held by the catalog, in bytes.
+    """
+
+    def __init__(self, db_name: str, key: str, connect):
+        """
+        Parameters:
+            db_name (str): The database name.
+            key (str): Identifies the version of the database the catalog describes.
+            connect (callable): Returns an open connection to the database.
+        """
+        self.db_name = db_name
+        self.key = key
+        self.connect = connect
+        self.data = {}
+        self.size = 0
+        self.on_change = None
+        self.depth = 0
+
+
+    def get_or_compute(self, name: str, compute):
+        if name not in self.data:
+            # Renderings compute other entries, on_change fires once the outermost computation is done
+            self.depth += 1
+            try:
+                self.data[name] = compute(self.connect())
+            finally:
+                self.depth -= 1
+
+            if self.depth == 0:
+                self.size = len(repr(self.data))
+                if self.on_change is not None:
+                    self.on_change(self)
+        return self.data[name]
+
+
+    def get_table_names(self) -> list:
+        return self.get_or_compute("table_names", lambda conn: [
+            row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND " + NOT_ANALYZE_TABLE + ";")
+        ])
+
+
+    def get_table_create_statements(self) -> dict:
+        return self.get_or_compute("table_create_statements", lambda conn: {
+            row[0]: row[1] for row in conn.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type='table' AND " + NOT_ANALYZE_TABLE + ";")
+        })
+
+
+    def get_columns(self, table: str) -> list:
+        """
+        Return the (name, type) of each column of a table.
+        """
+        return self.get_or_compute(f"columns:{table}", lambda conn: [
+            (column[1], column[2]) for column in conn.execute(f"PRAGMA table_info(\"{table}\");")
+        ])
+
+
+    def get_foreign_keys(self) -> list:
+        """
+        Return the (table, column, referenced table, referenced column) of every foreign key.
+        """
+        def foreign_keys(conn):
+            keys = []
+            for table in self.get_table_names():
+                for key in conn.execute(f"PRAGMA foreign_key_list(\"{table}\");"):
+                    keys.append((table, key[3], key[2], key[4]))
+            return keys
+
+        return self.get_or_compute("foreign_keys", foreign_keys)
+
+
+    def get_sample_rows(self, table: str, limit: int = 3) -> list:
+        return self.get_or_compute(f"sample_rows:{table}:{limit}", lambda conn:
+            conn.execute(f"SELECT * FROM \"{table}\" LIMIT {limit};").fetchall())
+
+
+    def get_row_counts(self) -> dict:
+        """
+        Return the number of rows of every table.
+
+        The counts are read from sqlite_stat1 where ANALYZE has stored them and
+        counted with COUNT(*) for the other tables.
+        """
+        def count(conn):
+            row_counts = {}
+            has_stats = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sqlite_stat1';").fetchone()
+            if has_stats:
+                for table, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1;"):
+                    if stat:
+                        row_counts.setdefault(table, int(stat.split()[0]))
+
+            for table in self.get_table_names():
+                if table not in row_counts:
+                    row_counts[table] = conn.execute(f"SELECT COUNT(*) FROM \"{table}\";").fetchone()[0]
+            return row_counts
+
+        return self.get_or_compute("row_counts", count)
+
+
+    def get_create_statements(self) -> str:
+        """
+        Return the CREATE statements of all tables, one after another.
+        """
+        return self.get_or_compute("create_statements", lambda conn: '\n'.join(
+            [statement for statement in self.get_table_create_statements().values()]))
+
+
+    def get_schema_and_sample_data(self) -> str:
+        """
+        Return the CREATE statement, column names and three sample rows of every table.
+        """
+        return self.get_or_compute("schema_and_sample_data", lambda conn: self.render_schema_and_sample_data())
+
+
+    def render_schema_and_sample_data(self, tables: list = None, include_sample_rows: bool = True) -> str:
+        """
+        Render the CREATE statements and sample rows of the given tables, all tables by default.
+        """
+        create_statements = self.get_table_create_statements()
+        schema_and_sample_data = ""
+
+        for table in (tables if tables is not None else self.get_table_names()):
+            schema_and_sample_data += f"{create_statements[table]};\n\n"
+
+            if include_sample_rows:
+                column_names = [column[0] for column in self.get_columns(table)]
+                column_names_line = "\t".join(column_names)
+
+                schema_and_sample_data += f"Three rows from {table} table:\n"
+                schema_and_sample_data += f"{column_names_line}\n"
+
+                for row in self.get_sample_rows(table):
+                    row_line = "\t".join([str(value) for value in row])
+                    schema_and_sample_data += f"{row_line}\n"
+
+                schema_and_sample_data += "\n"
+
+        schema_and_sample_data += "\n"
+        return schema_and_sample_data
+
+
+    def get_tables_and_columns(self) -> str:
+        """
+        Return a listing of every table and the name and type of its columns.
+        """
+        def render(conn):
+            res = ""
+            for table_name in self.get_table_names():
+                res = res + f"Table: {table_name}\n"
+                for col_name, col_type in self.get_columns(table_name):
+                    res = res + f"  Column: {col_name}, Type: {col_type}\n"
+            return res
+
+        return self.get_or_compute("tables_and_columns", render)
+
+
+class SchemaCatalogCache:
+    """
+    An LRU cache of SchemaCatalogs bounded by an estimate of their memory use.
+
+    Catalogs are persisted to cache_dir whenever they gain information and are
+    reloaded from there as long as the modification time and PRAGMA
+    schema_version of the database are unchanged. Pass cache_dir=None to keep
+    the catalogs in memory only.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, cache_dir: str = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.catalogs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+
+    def get_catalog(self, db_name: str, db_path: str, connect) -> SchemaCatalog:
+        """
+        Return the catalog of a database, from memory, from disk or newly created.
+
+        Parameters:
+            db_name (str): The database name.
+            db_path (str): The path to the database file.
+            connect (callable): Returns an open connection to the database.
+
+        Returns:
+            SchemaCatalog: The catalog of the database.
+        """
+        mtime = os.stat(db_path).st_mtime_ns
+        catalog = self.catalogs.get(db_name)
+
+        if catalog is not None and catalog.key.startswith(f"{mtime}:"):
+            self.hits += 1
+            catalog.connect = connect
+            self.catalogs.move_to_end(db_name)
+            return catalog
+
+        self.misses += 1
+        schema_version = connect().execute("PRAGMA schema_version;").fetchone()[0]
+        key = f"{mtime}:{schema_version}:{CATALOG_VERSION}"
+
+        catalog = SchemaCatalog(db_name, key, connect)
+        catalog.data = self.load(db_name, key)
+        catalog.size = len(repr(catalog.data))
+        catalog.on_change = self.on_catalog_change
+
+        self.catalogs[db_name] = catalog
+        self.catalogs.move_to_end(db_name)
+        self.evict()
+        return catalog
+
+
+    def on_catalog_change(self, catalog: SchemaCatalog) -> None:
+        self.save(catalog)
+        self.evict()
+
+
+    def evict(self) -> None:
+        """
+        Drop least recently used catalogs until the memory estimate fits the budget.
+
+        The most recently used catalog is always kept.
+        """
+        total = sum(catalog.size for catalog in self.catalogs.values())
+        while total > self.max_bytes and len(self.catalogs) > 1:
+            _, catalog = self.catalogs.popitem(last=False)
+            total -= catalog.size
+
+
+    def get_path(self, db_name: str) -> str:
+        return os.path.join(self.cache_dir, db_name + ".pkl")
+
+
+    def load(self, db_name: str, key: str) -> dict:
+        if self.cache_dir is None or not os.path.exists(self.get_path(db_name)):
+            return {}
+
+        try:
+            with open(self.get_path(db_name), "rb") as f:
+                stored = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as err:
+            logging.warning("SchemaCatalogCache.load() ignoring corrupt catalog of " + db_name + ": " + str(err))
+            return {}
+
+        if stored.get("key") != key:
+            return {}
+
+        self.disk_hits += 1
+        return stored["data"]
+
+
+    def save(self, catalog: SchemaCatalog) -> None:
+        if self.cache_dir is None:
+            return
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"key": catalog.key, "data": catalog.data}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.get_path(catalog.db_name))
+
+
+    def get_stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "cached_databases": len(self.catalogs)
+        }
@@ -0,0 +1,102 @@
+
+import re
+from collections import namedtuple, deque
+from typing import List
+from utils.schema_catalog import SchemaCatalog
+from utils.token_budget import get_table_descriptions
+
+
+PrunedSchema = namedtuple("PrunedSchema", ["schema", "descriptions", "tables", "bridge_tables"])
+
+
+def get_linked_tables(schema_links: List[str]) -> set:
+    """
+    Return the lower-cased tables referenced as table.column in schema links.
+    """
+    return {table.lower() for link in schema_links for table in re.findall(r'([A-Za-z_][\w]*)\.[A-Za-z_`"]', link)}
+
+
+def get_join_graph(catalog: SchemaCatalog) -> dict:
+    """
+    Return the tables joined to each table by a foreign key, in either direction.
+    """
+    graph = {table: set() for table in catalog.get_table_names()}
+    for table, _, referenced_table, _ in catalog.get_foreign_keys():
+        if referenced_table in graph and table != referenced_table:
+            graph[table].add(referenced_table)
+            graph[referenced_table].add(table)
+    return graph
+
+
+def connect_tables(tables: list, graph: dict) -> list:
+    """
+    Return the tables with the tables needed to join them along the shortest foreign key paths.
+
+    Starting from the first table, every other table is connected to the
+    tables kept so far by a shortest path of the join graph, adding the
+    tables on the path. A table with no path is kept on its own.
+    """
+    if not tables:
+        return []
+
+    kept = [tables[0]]
+    for table in tables[1:]:
+        if table in kept:
+            continue
+
+        # Breadth first search from the table to the nearest kept table
+        parents = {table: None}
+        queue = deque([table])
+        reached = None
+        while queue and reached is None:
+            current = queue.popleft()
+            for neighbour in sorted(graph.get(current, ())):
+                if neighbour not in parents:
+                    parents[neighbour] = current
+                    if neighbour in kept:
+                        reached = neighbour
+                        break
+                    queue.append(neighbour)
+
+        # The tables between the nearest kept table and the table, nearest first
+        node = parents[reached] if reached is not None else None
+        while node is not None and node != table:
+            kept.append(node)
+            node = parents[node]
+        kept.append(table)
+    return kept
+
+
+def prune_schema(catalog: SchemaCatalog, schema_links: List[str], descriptions=None) -> PrunedSchema:
+    """
+    Render the schema, sample rows and descriptions of only the tables a question is linked to.
+
+    The tables referenced by the schema links are kept together with the
+    tables needed to join them through the foreign keys, in the order of the
+    database. Returns None when no link names a table of the database, so the
+    full schema can be used instead.
+
+    Parameters:
+        catalog (SchemaCatalog): The catalog of the database.
+        schema_links (list): The schema links of DIN-SQL, such as "account.district_id = district.district_id".
+        descriptions (DatabaseDescription): The BIRD descriptions of the database, None to leave them out.
+
+    Returns:
+        PrunedSchema: The schema, descriptions, kept tables and the tables kept only to join others.
+    """
+    all_tables = catalog.get_table_names()
+    linked = get_linked_tables(schema_links)
+    tables = [table for table in all_tables if table.lower() in linked]
+    if not tables:
+        return None
+
+    connected = connect_tables(tables, get_join_graph(catalog))
+    kept = [table for table in all_tables if table in connected]
+    bridge_tables = [table for table in kept if table not in tables]
+
+    rendered_descriptions = ""
+    if descriptions is not None:
+        table_descriptions = get_table_descriptions(descriptions, kept)
+        rendered_descriptions = descriptions.render([table_descriptions[table] for table in kept if table in table_descriptions])
+
+    return PrunedSchema(catalog.render_schema_and_sample_data(kept), rendered_descriptions, kept, bridge_tables)
@@ -0,0 +1,47 @@
+
+import re
+
+
+IDENTIFIER = r'(?:\w+|`[^`]+`|"[^"]+"|\[[^\]]+\])'
+TABLE_REFERENCE_PATTERN = re.compile(
+    rf'(?:\bFROM|\bJOIN|,)\s*({IDENTIFIER})(?:\s+(?:AS\s+)?(?!(?:ON|WHERE|JOIN|INNER|LEFT|RIGHT|CROSS|NATURAL|GROUP|ORDER|LIMIT|UNION|EXCEPT|INTERSECT|USING|HAVING|FROM|AND|OR)\b)({IDENTIFIER}))?',
+    re.IGNORECASE)
+
+
+def unquote(identifier: str) -> str:
+    if identifier[0] in '`"[' and len(identifier) > 1:
+        return identifier[1:-1]
+    return identifier
+
+
+def quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def get_table_aliases(sql: str, tables: list) -> dict:
+    """
+    Map the lower-cased names and aliases a query uses for tables to the table names.
+
+    Tables are recognized after FROM, JOIN and commas. Only tables listed in
+    tables are included, so subquery and CTE names are left out. An alias
+    reused for different tables maps to the last one.
+
+    Parameters:
+        sql (str): The SQL query.
+        tables (list): The table names of the database.
+
+    Returns:
+        dict: The table name per lower-cased table name or alias.
+    """
+    table_names = {table.lower(): table for table in tables}
+    aliases = {}
+
+    for match in TABLE_REFERENCE_PATTERN.finditer(sql):
+        table = table_names.get(unquote(match.group(1)).lower())
+        if table is None:
+            continue
+        aliases[table.lower()] = table
+        if match.group(2):
+            aliases[unquote(match.group(2)).lower()] = table
+
+    return aliases
@@ -0,0 +1,204 @@
+
+import re
+import sqlite3
+import threading
+from collections import namedtuple, Counter
+from utils.admission import explain_query_plan, cap_query
+from utils.query_timeout import QueryTimeout, QueryTimeoutError
+from utils.sql_tables import get_table_aliases
+
+
+# Reasons a query is sent to the self-correction
+NOT_A_SELECT = "not_a_select"
+COMPILE_ERROR = "compile_error"
+UNKNOWN_IDENTIFIER = "unknown_identifier"
+MISSING_JOIN_KEY = "missing_join_key"
+RUNTIME_ERROR = "runtime_error"
+TIMEOUT = "timeout"
+EMPTY_RESULT = "empty_result"
+NULL_RESULT = "null_result"
+
+STRING_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+DOUBLE_QUOTED_PATTERN = re.compile(r'"((?:[^"]|"")+)"')
+JOIN_PATTERN = re.compile(r'\b(NATURAL\s+(?:\w+\s+)?|CROSS\s+)?JOIN\b', re.IGNORECASE)
+JOIN_CLAUSE_END_PATTERN = re.compile(r'\b(JOIN|WHERE|GROUP|ORDER|LIMIT|UNION|EXCEPT|INTERSECT|HAVING)\b|\)', re.IGNORECASE)
+JOIN_CONDITION_PATTERN = re.compile(r'\b(ON|USING)\b', re.IGNORECASE)
+FROM_PATTERN = re.compile(r'\bFROM\b', re.IGNORECASE)
+FROM_CLAUSE_END_PATTERN = re.compile(
+    r'\b(WHERE|GROUP|ORDER|LIMIT|UNION|EXCEPT|INTERSECT|HAVING|WINDOW)\b|[();]', re.IGNORECASE)
+
+
+ValidationResult = namedtuple("ValidationResult", ["valid", "reasons"])
+
+
+def has_join_without_condition(sql: str) -> bool:
+    """
+    Whether a query joins tables without a join condition.
+
+    A JOIN needs an ON or USING before the next clause, except NATURAL and
+    CROSS joins, which are explicit. Tables listed with commas in a FROM
+    clause need a WHERE clause right after it.
+    """
+    for match in JOIN_PATTERN.finditer(sql):
+        if match.group(1):
+            continue
+        rest = sql[match.end():]
+        end = JOIN_CLAUSE_END_PATTERN.search(rest)
+        clause = rest[:end.start()] if end is not None else rest
+        if JOIN_CONDITION_PATTERN.search(clause) is None:
+            return True
+
+    for match in FROM_PATTERN.finditer(sql):
+        rest = sql[match.end():]
+        end = FROM_CLAUSE_END_PATTERN.search(rest)
+        clause = rest[:end.start()] if end is not None else rest
+        if "," in clause and (end is None or end.group(1) is None or end.group(1).upper() != "WHERE"):
+            return True
+    return False
+
+
+def get_unknown_identifiers(sql: str, catalog) -> list:
+    """
+    Return the double-quoted identifiers of a query that name no table, column or alias.
+
+    SQLite reads a double-quoted identifier it cannot resolve as a string
+    literal, so a misspelled quoted column compiles and runs but compares
+    against a constant.
+    """
+    tables = catalog.get_table_names()
+    names = {table.lower() for table in tables}
+    for table in tables:
+        names.update(column.lower() for column, _ in catalog.get_columns(table))
+    names.update(get_table_aliases(sql, tables))
+    names.update(alias.lower() for alias in re.findall(r'\bAS\s+(\w+)', sql, re.IGNORECASE))
+
+    sql = STRING_LITERAL_PATTERN.sub("''", sql)
+    identifiers = [identifier.replace('""', '"') for identifier in DOUBLE_QUOTED_PATTERN.findall(sql)]
+    return [identifier for identifier in identifiers if identifier.lower() not in names]
+
+
+class SQLValidator:
+    """
+    Checks a generated query against its local SQLite database to decide whether it needs the LLM self-correction.
+
+    A query is valid when it is a SELECT, compiles, has no double-quoted
+    identifier SQLite would read as a string, joins every table with a
+    condition, and a dry run capped at row_limit rows finishes within
+    timeout seconds without error. With flag_empty_results, queries that
+    return no rows, or only NULLs, are suspicious too, as a wrong filter
+    value or join usually shows up that way.
+
+    Every thread validates on its own read-only connections, from a worker
+    pool of the dataset's connection pool, so validate can be called from any
+    thread, for example with asyncio.to_thread. Call close once done.
+    """
+
+    def __init__(self, dataset, row_limit: int = 100, timeout: float = 1.0, flag_empty_results: bool = True):
+        self.dataset = dataset
+        self.row_limit = row_limit
+        self.timeout = timeout
+        self.flag_empty_results = flag_empty_results
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.pools = []
+        self.valid = 0
+        self.invalid = 0
+        self.reasons = Counter()
+
+
+    @classmethod
+    def from_config(cls, dataset, config) -> "SQLValidator":
+        """
+        Create the validator from the correction_gate_row_limit, correction_gate_timeout and correction_gate_empty_results settings of a config.
+        """
+        flag_empty_results = config.get('correction_gate_empty_results')
+        return cls(
+            dataset,
+            row_limit=config.get('correction_gate_row_limit') or 100,
+            timeout=config.get('correction_gate_timeout') or 1.0,
+            flag_empty_results=True if flag_empty_results is None else flag_empty_results
+        )
+
+
+    def validate(self, sql: str, db_name: str) -> ValidationResult:
+        """
+        Validate a query on a database, returning whether it is valid and the reasons it is not.
+        """
+        reasons = self.get_reasons(sql, db_name)
+        with self.lock:
+            if reasons:
+                self.invalid += 1
+                self.reasons.update(reasons)
+            else:
+                self.valid += 1
+        return ValidationResult(not reasons, reasons)
+
+
+    def get_reasons(self, sql: str, db_name: str) -> list:
+        if not sql or not re.match(r'\s*(SELECT|WITH)\b', sql, re.IGNORECASE):
+            return [NOT_A_SELECT]
+
+        db_path = self.dataset.get_db_path(db_name)
+        conn = self.get_thread_pool().get_connection(db_name, db_path)
+        try:
+            explain_query_plan(conn, sql)
+        except (sqlite3.Error, sqlite3.Warning):
+            return [COMPILE_ERROR]
+
+        reasons = []
+        # The catalog introspects on the connection of the calling thread, see Dataset.admit_query
+        with self.dataset.schema_catalog_lock:
+            catalog = self.dataset.schema_catalog_cache.get_catalog(db_name, db_path, lambda: conn)
+            unknown_identifiers = get_unknown_identifiers(sql, catalog)
+        if unknown_identifiers:
+            reasons.append(UNKNOWN_IDENTIFIER)
+        if has_join_without_condition(sql):
+            reasons.append(MISSING_JOIN_KEY)
+
+        try:
+            with QueryTimeout(conn, self.timeout):
+                rows = conn.execute(cap_query(sql, self.row_limit)).fetchall()
+        except QueryTimeoutError:
+            reasons.append(TIMEOUT)
+        except sqlite3.Error:
+            reasons.append(RUNTIME_ERROR)
+        else:
+            if self.flag_empty_results:
+                if not rows:
+                    reasons.append(EMPTY_RESULT)
+                elif all(value is None for row in rows for value in row):
+                    reasons.append(NULL_RESULT)
+        return reasons
+
+
+    def get_thread_pool(self):
+        """
+        Return the connection pool owned by the calling thread.
+        """
+        pool = getattr(self.local, "pool", None)
+        if pool is None:
+            pool = self.dataset.connection_pool.create_worker_pool()
+            self.local.pool = pool
+            with self.lock:
+                self.pools.append(pool)
+        return pool
+
+
+    def close(self) -> None:
+        """
+        Close the connections opened by the validating threads.
+        """
+        with self.lock:
+            for pool in self.pools:
+                pool.close_all()
+            self.pools = []
+        self.local = threading.local()
+
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "valid": self.valid,
+                "invalid": self.invalid,
+                "reasons": dict(self.reasons)
+            }
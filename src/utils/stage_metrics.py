@@ -0,0 +1,193 @@
+
+import os
+import json
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+from langchain.callbacks import get_openai_callback
+from utils.stats import summarize
+from utils.token_counter import get_token_estimate
+
+
+class StageUsage:
+    """
+    The wall time, tokens and cost of one stage of one question.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.wall_time = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.cost = 0
+        self.estimated_prompt_tokens = 0
+        # LLM calls answered from the response cache
+        self.cached_calls = 0
+        # Failed attempts of LLM calls that were sent again
+        self.retries = 0
+        self.failed = False
+        # A speculative call whose result was not used
+        self.discarded = False
+
+    def to_dict(self) -> dict:
+        return {
+            "stage": self.stage,
+            "wall_time": self.wall_time,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": self.cost,
+            "estimated_prompt_tokens": self.estimated_prompt_tokens,
+            "cached_calls": self.cached_calls,
+            "retries": self.retries,
+            "failed": self.failed,
+            "discarded": self.discarded
+        }
+
+
+def sum_stage_usage(stages: list, execution_time: float) -> dict:
+    """
+    Return the usage of a question as the sum of its stages, in the form of sql_agents.zero_shot.get_usage.
+
+    Discarded speculative calls are billed, so they count in the totals, and
+    are also reported apart as discarded_tokens and discarded_cost.
+    """
+    discarded = [stage for stage in stages if stage.discarded]
+    return {
+        "total_tokens": sum(stage.total_tokens for stage in stages),
+        "prompt_tokens": sum(stage.prompt_tokens for stage in stages),
+        "completion_tokens": sum(stage.completion_tokens for stage in stages),
+        "total_cost": sum(stage.cost for stage in stages),
+        "estimated_prompt_tokens": sum(stage.estimated_prompt_tokens for stage in stages),
+        "cached_calls": sum(stage.cached_calls for stage in stages),
+        "retries": sum(stage.retries for stage in stages),
+        "execution_time": execution_time,
+        "discarded_tokens": sum(stage.total_tokens for stage in discarded),
+        "discarded_cost": sum(stage.cost for stage in discarded),
+        "stages": {stage.stage: stage.wall_time for stage in stages if not stage.discarded}
+    }
+
+
+class StageLedger:
+    """
+    Records the wall time, tokens, cost and failed attempts of every stage of a multi-call agent.
+
+    Each stage is measured with its own get_openai_callback, so a stage never
+    picks up the tokens of another. The failed attempts of the LLM calls of
+    a stage that the AsyncRunner retried on their own, for example on a rate
+    limit, are counted in the retries of the stage, and their prompt tokens in
+    its estimated prompt tokens. A stage that raises is recorded as a failed
+    attempt and also counted in the retries. A speculative call that is
+    cancelled, or marked discarded because its result was not used, is
+    counted apart with the tokens and cost it wasted. The ledger is shared by the
+    concurrent questions of a run and is safe to use from several tasks and
+    threads.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        Measure the block as one call of a stage, yielding the StageUsage that is filled in on exit.
+        """
+        usage = StageUsage(stage)
+        start = time.perf_counter()
+        with get_openai_callback() as cb, get_token_estimate() as estimate:
+            try:
+                yield usage
+            except asyncio.CancelledError:
+                usage.discarded = True
+                raise
+            except BaseException:
+                usage.failed = True
+                raise
+            finally:
+                usage.wall_time = time.perf_counter() - start
+                usage.prompt_tokens = cb.prompt_tokens
+                usage.completion_tokens = cb.completion_tokens
+                usage.total_tokens = cb.total_tokens
+                usage.cost = cb.total_cost
+                usage.estimated_prompt_tokens = estimate.prompt_tokens
+                usage.cached_calls = estimate.cached_calls
+                usage.retries = estimate.retries
+                with self.lock:
+                    self.records.append(usage)
+
+
+    def summarize(self) -> dict:
+        """
+        Return per stage the number of calls, retries, discarded and cached
+        calls, the wall time summary (mean, p50, p95, p99, max) of the used
+        calls sent to the model and the total and mean tokens and cost, in the
+        order the stages were first recorded.
+        """
+        with self.lock:
+            records = list(self.records)
+
+        stages = {}
+        for record in records:
+            stages.setdefault(record.stage, []).append(record)
+
+        summary = {}
+        for stage, stage_records in stages.items():
+            succeeded = [record for record in stage_records if not record.failed and not record.discarded]
+            discarded = [record for record in stage_records if record.discarded]
+            cached = [record for record in succeeded if record.cached_calls > 0]
+            calls = max(len(succeeded), 1)
+            summary[stage] = {
+                "calls": len(succeeded),
+                "retries": sum(record.failed + record.retries for record in stage_records),
+                "discarded": len(discarded),
+                "discarded_tokens": sum(record.total_tokens for record in discarded),
+                "discarded_cost": sum(record.cost for record in discarded),
+                "cached": len(cached),
+                "wall_time": summarize([record.wall_time for record in succeeded if record.cached_calls == 0]),
+                "total_wall_time": sum(record.wall_time for record in stage_records),
+                "prompt_tokens": sum(record.prompt_tokens for record in stage_records),
+                "completion_tokens": sum(record.completion_tokens for record in stage_records),
+                "estimated_prompt_tokens": sum(record.estimated_prompt_tokens for record in stage_records),
+                "cost": sum(record.cost for record in stage_records),
+                "mean_prompt_tokens": sum(record.prompt_tokens for record in succeeded) / calls,
+                "mean_completion_tokens": sum(record.completion_tokens for record in succeeded) / calls,
+                "mean_cost": sum(record.cost for record in succeeded) / calls
+            }
+        return summary
+
+
+    def save(self, path: str) -> None:
+        """
+        Write the summary and every recorded stage call to a JSON file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self.lock:
+            records = [record.to_dict() for record in self.records]
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"summary": self.summarize(), "records": records}, f, ensure_ascii=False, indent=4)
+
+
+    def log_to_wandb(self, wandb) -> None:
+        """
+        Store the summary in the run summary and as a table with one row per stage.
+        """
+        summary = self.summarize()
+        wandb.run.summary["stages"] = summary
+
+        table = wandb.Table(columns=["Stage", "Calls", "Retries", "Discarded", "Cached", "Mean", "p50", "p95", "p99",
+                                     "Max", "Prompt tokens", "Completion tokens", "Cost", "Discarded tokens"])
+        for stage, stats in summary.items():
+            wall_time = stats["wall_time"]
+            table.add_data(stage, stats["calls"], stats["retries"], stats["discarded"], stats["cached"], wall_time["mean"],
+                           wall_time["p50"], wall_time["p95"], wall_time["p99"], wall_time["max"],
+                           stats["prompt_tokens"], stats["completion_tokens"], stats["cost"],
+                           stats["discarded_tokens"])
+        wandb.log({"stage_metrics": table})
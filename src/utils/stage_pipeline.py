@@ -0,0 +1,167 @@
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+
+def get_stage_key(stage: str, config: dict, inputs: dict) -> str:
+    """
+    Return the content address of a stage run: the SHA-256 hex digest of its name, config and inputs.
+    """
+    content = json.dumps({"stage": stage, "config": config, "inputs": inputs}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_question_key(*parts) -> str:
+    """
+    Return a short stable key for a question from its database, question text and hint.
+    """
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+class StageStore:
+    """
+    An append-only JSONL file of stage outputs, keyed by question, stage and stage key.
+
+    Every completed stage is appended as one line with the question key, stage
+    name, stage key (see get_stage_key), output and time, and flushed at once,
+    so a crashed run loses at most the stages in flight. Lines are never
+    rewritten: a later line for the same key wins when the file is loaded, and
+    a truncated last line is skipped. The store is safe to share between
+    tasks and threads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.outputs = {}
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning(f"Skipping unreadable line {number} of the stage store {path}")
+                        continue
+                    self.outputs[(record["question"], record["stage"], record["key"])] = record["output"]
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+
+    def __len__(self) -> int:
+        return len(self.outputs)
+
+
+    def get(self, question: str, stage: str, key: str) -> dict:
+        """
+        Return the stored output of a stage run, None if it was not stored.
+        """
+        with self.lock:
+            output = self.outputs.get((question, stage, key))
+            if output is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return output
+
+
+    def put(self, question: str, stage: str, key: str, output: dict) -> None:
+        record = {"question": question, "stage": stage, "key": key, "output": output, "time": time.time()}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.outputs[(question, stage, key)] = output
+            self.file.write(line)
+            self.file.flush()
+            self.writes += 1
+
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "stored": len(self.outputs)
+            }
+
+
+class PipelineStage:
+    """
+    One stage of a StagePipeline.
+
+    run is a coroutine function taking the pipeline state and returning a dict
+    of the values it produces, which are added to the state. requires names
+    the state values the stage reads. config returns, for a state, what else
+    decides the output, such as the model and prompt templates. A stage with
+    checkpoint set is stored and reused when its name, config and required
+    values are the same, so they must be JSON serializable, as must its output.
+    """
+
+    def __init__(self, name: str, requires: tuple, run, config=None, checkpoint: bool = True):
+        self.name = name
+        self.requires = requires
+        self.run = run
+        self.config = config
+        self.checkpoint = checkpoint
+
+
+    def get_key(self, state: dict) -> str:
+        config = self.config(state) if self.config is not None else None
+        return get_stage_key(self.name, config, {name: state[name] for name in self.requires})
+
+
+class StagePipeline:
+    """
+    Runs stages in order on a shared state, reusing the outputs of checkpointed stages from a StageStore.
+
+    A stage whose prompt or inputs changed gets a new key and runs again, and
+    so does every stage that requires one of its outputs, as soon as the new
+    output differs. Without store every stage runs.
+    """
+
+    def __init__(self, stages: list, store: StageStore = None):
+        self.stages = stages
+        self.store = store
+
+
+    async def arun(self, question: str, state: dict) -> list:
+        """
+        Run the stages for a question, updating the state with their outputs.
+
+        Returns:
+            list: The names of the stages whose outputs were reused from the store.
+        """
+        reused = []
+        for stage in self.stages:
+            key = None
+            if self.store is not None and stage.checkpoint:
+                key = stage.get_key(state)
+                output = self.store.get(question, stage.name, key)
+                if output is not None:
+                    state.update(output)
+                    reused.append(stage.name)
+                    continue
+
+            output = await stage.run(state)
+            if key is not None:
+                self.store.put(question, stage.name, key, output)
+            state.update(output)
+        return reused
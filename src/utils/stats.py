@@ -0,0 +1,37 @@
+
+def percentile(values: list, q: float) -> float:
+    """
+    Return the q-th percentile of the values, interpolating linearly between the closest ranks.
+
+    Parameters:
+        values (list): The values, in any order.
+        q (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The percentile, None if there are no values.
+    """
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(values: list) -> dict:
+    """
+    Return the count, mean, p50, p95, p99 and max of the values.
+    """
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None, "max": None}
+
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values)
+    }
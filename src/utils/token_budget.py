@@ -0,0 +1,141 @@
+
+import re
+import logging
+from collections import namedtuple
+from utils.schema_catalog import SchemaCatalog
+from utils.token_counter import count_tokens_cached
+
+
+DROP_SAMPLE_ROWS = "drop_sample_rows"
+DROP_DESCRIPTIONS = "drop_descriptions"
+DROP_TABLES = "drop_tables"
+
+
+BudgetedSchema = namedtuple("BudgetedSchema", ["schema", "descriptions", "tokens", "steps", "dropped_tables"])
+
+
+def get_words(text: str) -> set:
+    """
+    Return the lower-cased words of a text, splitting snake_case and camelCase names.
+    """
+    text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text or "")
+    return {word for word in re.split(r'[^a-z0-9]+', text.lower()) if word}
+
+
+def rank_tables(catalog: SchemaCatalog, question: str, evidence: str = "") -> list:
+    """
+    Return the tables of a database from most to least relevant to a question.
+
+    A table scores two points for each word of its name and one point for each
+    column name with a word in the question or evidence. Ties keep the order
+    of the tables in the database, so the ranking is deterministic.
+    """
+    question_words = get_words(question) | get_words(evidence)
+
+    def score(table):
+        table_score = 2 * len(get_words(table) & question_words)
+        for column, _ in catalog.get_columns(table):
+            if get_words(column) & question_words:
+                table_score += 1
+        return table_score
+
+    tables = catalog.get_table_names()
+    return sorted(tables, key=lambda table: (-score(table), tables.index(table)))
+
+
+def get_table_descriptions(descriptions, tables: list) -> dict:
+    """
+    Map each table to the name of its BIRD description, matching names case-insensitively.
+    """
+    if descriptions is None:
+        return {}
+
+    names = {name.lower(): name for name in descriptions.tables}
+    return {table: names[table.lower()] for table in tables if table.lower() in names}
+
+
+def fit_schema(catalog: SchemaCatalog, budget: int, model: str = "gpt-3.5-turbo", question: str = "",
+               evidence: str = "", descriptions=None) -> BudgetedSchema:
+    """
+    Render the schema of a database, and optionally its BIRD descriptions, within a token budget.
+
+    When the full rendering does not fit, it is reduced step by step until it
+    does: first the sample rows are dropped, then the descriptions, then the
+    tables least relevant to the question (see rank_tables), one at a time,
+    keeping at least one table. The same inputs always give the same result.
+
+    Tokens are counted per table and rendering with the model's tokenizer and
+    cached, so trying the steps costs no more than counting the full schema.
+
+    Parameters:
+        catalog (SchemaCatalog): The catalog of the database.
+        budget (int): The tokens the schema and descriptions may use together.
+        model (str): The model whose tokenizer counts the tokens.
+        question (str): The question, to rank the tables.
+        evidence (str): The hint of the question, to rank the tables.
+        descriptions (DatabaseDescription): The BIRD descriptions of the database, None to leave them out.
+
+    Returns:
+        BudgetedSchema: The schema and descriptions, their token count, the
+        degradation steps taken and the dropped tables.
+    """
+    tables = catalog.get_table_names()
+    table_descriptions = get_table_descriptions(descriptions, tables)
+
+    counts = {}
+
+    def count_schema(table, include_sample_rows):
+        if (table, include_sample_rows) not in counts:
+            counts[(table, include_sample_rows)] = count_tokens_cached(
+                catalog.render_schema_and_sample_data([table], include_sample_rows), model)
+        return counts[(table, include_sample_rows)]
+
+    def count_description(table):
+        if table not in table_descriptions:
+            return 0
+        if (table, "description") not in counts:
+            counts[(table, "description")] = count_tokens_cached(descriptions.render([table_descriptions[table]]), model)
+        return counts[(table, "description")]
+
+    include_sample_rows = True
+    include_descriptions = descriptions is not None
+    kept = list(tables)
+
+    def total():
+        tokens = sum(count_schema(table, include_sample_rows) for table in kept)
+        if include_descriptions:
+            tokens += sum(count_description(table) for table in kept)
+        return tokens
+
+    steps = []
+    dropped_tables = []
+    if total() > budget:
+        include_sample_rows = False
+        steps.append(DROP_SAMPLE_ROWS)
+    if total() > budget and include_descriptions:
+        include_descriptions = False
+        steps.append(DROP_DESCRIPTIONS)
+    if total() > budget and len(kept) > 1:
+        steps.append(DROP_TABLES)
+        for table in reversed(rank_tables(catalog, question, evidence)):
+            if total() <= budget or len(kept) == 1:
+                break
+            kept.remove(table)
+            dropped_tables.append(table)
+
+    if not steps:
+        schema = catalog.get_schema_and_sample_data()
+        rendered_descriptions = descriptions.render() if include_descriptions else ""
+        tokens = count_tokens_cached(schema, model) + count_tokens_cached(rendered_descriptions, model)
+    else:
+        schema = catalog.render_schema_and_sample_data(kept, include_sample_rows)
+        rendered_descriptions = ""
+        if include_descriptions:
+            rendered_descriptions = descriptions.render(
+                [table_descriptions[table] for table in kept if table in table_descriptions])
+        tokens = total()
+
+    if tokens > budget:
+        logging.warning(f"Schema of {catalog.db_name} needs {tokens} tokens after degradation, over the budget of {budget}")
+
+    return BudgetedSchema(schema, rendered_descriptions, tokens, steps, dropped_tables)
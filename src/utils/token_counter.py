@@ -0,0 +1,127 @@
+
+import logging
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# Tokens OpenAI chat models add around every message and to prime the reply
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Average characters per token of English text, used when tiktoken is not installed
+CHARACTERS_PER_TOKEN = 4
+
+encodings = {}
+
+token_estimate_var = ContextVar("token_estimate", default=None)
+
+
+def get_encoding(model: str):
+    """
+    Return the tiktoken encoding of a model, None if tiktoken is not installed.
+    """
+    if tiktoken is None:
+        return None
+
+    if model not in encodings:
+        try:
+            encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            logging.debug("No tiktoken encoding for " + str(model) + ", using cl100k_base")
+            encodings[model] = tiktoken.get_encoding("cl100k_base")
+    return encodings[model]
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """
+    Count the tokens of a text, estimated from its length if tiktoken is not installed.
+    """
+    encoding = get_encoding(model)
+    if encoding is None:
+        return (len(text) + CHARACTERS_PER_TOKEN - 1) // CHARACTERS_PER_TOKEN
+    return len(encoding.encode(text))
+
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens_cached(text: str, model: str = "gpt-3.5-turbo") -> int:
+    """
+    count_tokens for texts that are counted repeatedly, such as schema renderings.
+    """
+    return count_tokens(text, model)
+
+
+def count_message_tokens(messages: list, model: str = "gpt-3.5-turbo") -> int:
+    """
+    Count the prompt tokens of a list of (role, content) chat messages.
+    """
+    tokens = TOKENS_PER_REPLY
+    for _, content in messages:
+        tokens += TOKENS_PER_MESSAGE + count_tokens(content, model)
+    return tokens
+
+
+class TokenEstimate:
+    """
+    The locally counted prompt tokens of the LLM calls made in a get_token_estimate block.
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.calls = 0
+        self.cached_calls = 0
+        # Failed attempts of calls that were sent again
+        self.retries = 0
+
+
+@contextmanager
+def get_token_estimate():
+    """
+    Collect the prompt token estimates of the calls sent to the model within the block.
+
+    Like get_openai_callback, calls answered from the LLM response cache are
+    not counted, so the estimate can be compared with the billed usage, but
+    they are counted apart as cached_calls. Every attempt of a retried call
+    is sent, so it is counted, and the failed attempts also as retries. The
+    estimate is held in a context variable, so concurrent asyncio tasks each
+    collect their own calls.
+    """
+    estimate = TokenEstimate()
+    token = token_estimate_var.set(estimate)
+    try:
+        yield estimate
+    finally:
+        token_estimate_var.reset(token)
+
+
+def record_token_estimate(prompt_tokens: int) -> None:
+    """
+    Add the prompt tokens of a call sent to the model to the enclosing get_token_estimate block, if any.
+    """
+    estimate = token_estimate_var.get()
+    if estimate is not None:
+        estimate.prompt_tokens += prompt_tokens
+        estimate.calls += 1
+
+
+def record_cached_call() -> None:
+    """
+    Count a call answered from the LLM response cache in the enclosing get_token_estimate block, if any.
+    """
+    estimate = token_estimate_var.get()
+    if estimate is not None:
+        estimate.cached_calls += 1
+
+
+def record_retry() -> None:
+    """
+    Count a failed attempt of a call that is sent again in the enclosing get_token_estimate block, if any.
+    """
+    estimate = token_estimate_var.get()
+    if estimate is not None:
+        estimate.retries += 1
@@ -1,8 +1,101 @@
 
 import json
 
+# Characters that can continue a number, "12" of "12.5" decodes without error
+NUMBER_CONTINUATION = "0123456789.eE+-"
+
 def load_json(path):
    with open(path, 'r') as j:
       data = json.loads(j.read())
    return data
 
+
+def iter_json_array(path, chunk_size=65536):
+   """
+   Incrementally parse a file containing a JSON array and yield its elements one at a time.
+
+   Only the current chunk of the file and the element being decoded are held in
+   memory, so filtering large dataset files does not require loading them whole.
+
+   Parameters:
+      path (str): Path to the JSON file.
+      chunk_size (int): Number of characters read from the file at a time.
+
+   Yields:
+      The decoded elements of the array.
+   """
+   decoder = json.JSONDecoder()
+
+   with open(path, 'r', encoding='utf-8') as j:
+      buffer = ""
+      pos = 0
+      eof = False
+      started = False
+
+      while True:
+         # Skip whitespace, the opening bracket and the commas between elements
+         while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ',')):
+               pos += 1
+            if pos < len(buffer) or eof:
+               break
+            chunk = j.read(chunk_size)
+            eof = chunk == ""
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+         if pos >= len(buffer):
+            raise ValueError(f"Unexpected end of file in JSON array: {path}")
+
+         if not started:
+            if buffer[pos] != '[':
+               raise ValueError(f"Expected a JSON array in: {path}")
+            started = True
+            pos += 1
+            continue
+
+         if buffer[pos] == ']':
+            return
+
+         try:
+            element, end = decoder.raw_decode(buffer, pos)
+         except json.JSONDecodeError:
+            if eof:
+               raise
+            end = None
+
+         # An element ending at the end of the buffer may continue in the next chunk,
+         # and so may a number cut off before its fraction or exponent
+         truncated_number = (end is not None and end < len(buffer) and buffer[end] in NUMBER_CONTINUATION
+                             and isinstance(element, (int, float)) and not isinstance(element, bool))
+         if end is None or ((end == len(buffer) or truncated_number) and not eof):
+            chunk = j.read(chunk_size)
+            eof = chunk == ""
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+         yield element
+         pos = end
+
+
+def parse_name_list(value):
+   """
+   Parse a list of names from the config into a set.
+
+   Names can be given as a YAML list or as a block string with one name per line.
+
+   Parameters:
+      value (str | list | None): The config value.
+
+   Returns:
+      set: The names, or None if the value is empty.
+   """
+   if value is None:
+      return None
+
+   if isinstance(value, str):
+      value = value.splitlines()
+
+   names = set(str(name).strip() for name in value if str(name).strip())
+   return names if names else None